@@ -0,0 +1,191 @@
+import shutil
+from fractions import Fraction
+import numpy as np
+
+# Segment, overlap and search lengths in ms, close to the speech profile of
+# sox tempo -s that Scaper uses for time stretching
+WSOLA_SEGMENT_MS = 35.0
+WSOLA_OVERLAP_MS = 14.0
+WSOLA_SEARCH_MS = 16.0
+
+
+def convert_channels(audio, n_channels):
+    # audio : (n_samples, n_channels_in) array, downmix or duplicate to n_channels
+    if audio.shape[1] == n_channels:
+        return audio
+    return audio.mean(axis=1, keepdims=True).repeat(n_channels, axis=1)
+
+
+def resample_ratio(audio, ratio, max_denominator=1000):
+    """
+    Resample (n_samples, n_channels) audio by ratio = new rate / old rate
+
+    Uses a polyphase filter with ratio approximated by a fraction, which is exact
+    for the usual sample rate pairs and within 1e-6 for pitch shift ratios.
+    """
+    from scipy.signal import resample_poly
+
+    ratio = Fraction(ratio).limit_denominator(max_denominator)
+    if ratio == 1:
+        return audio
+    return resample_poly(audio, ratio.numerator, ratio.denominator, axis=0)
+
+
+def wsola(
+    audio,
+    stretch,
+    sr,
+    segment_ms=WSOLA_SEGMENT_MS,
+    overlap_ms=WSOLA_OVERLAP_MS,
+    search_ms=WSOLA_SEARCH_MS,
+):
+    """
+    Time stretch audio without changing its pitch, by waveform similarity overlap-add
+
+    Segments are taken from the input at the nominal position for the stretch
+    factor, shifted by up to search_ms to best match the end of the output so far,
+    and cross-faded over overlap_ms. The search uses FFT cross-correlation
+    normalised by the candidate energy.
+
+    Params
+    -------
+    audio: (n_samples, n_channels) array
+    stretch: output duration / input duration
+    sr: sample rate of audio
+
+    Returns
+    -------
+    (round(n_samples * stretch), n_channels) array
+    """
+    n_in = audio.shape[0]
+    n_out = int(round(n_in * stretch))
+    segment = max(int(sr * segment_ms / 1000), 2)
+    overlap = min(max(int(sr * overlap_ms / 1000), 1), segment // 2)
+    search = int(sr * search_ms / 1000)
+    hop_out = segment - overlap
+    hop_in = hop_out / stretch
+    if stretch == 1 or n_in <= segment + search:
+        # too short to search, fall back to resampling the whole excerpt
+        return resample_ratio(audio, n_out / n_in)[:n_out] if n_out else audio[:0]
+
+    # search statistics in float64 so that the segments chosen do not depend on dtype
+    mono = audio.mean(axis=1, dtype=np.float64)
+    ramp = np.linspace(0, 1, overlap, endpoint=False)[:, None]
+    n_fft = 1 << int(np.ceil(np.log2(2 * search + 2 * overlap)))
+    energy = np.concatenate([[0], np.cumsum(mono**2)])
+
+    out = np.zeros((n_out + segment, audio.shape[1]), dtype=audio.dtype)
+    out[:segment] = audio[:segment]
+    n_written, last = segment, 0
+    k = 1
+    while n_written < n_out:
+        nominal = int(round(k * hop_in))
+        lo = max(nominal - search, 0)
+        hi = min(nominal + search, n_in - segment)
+        if hi < lo:
+            break
+        # the tail of the output continues naturally from last + hop_out
+        template = mono[last + hop_out : last + segment]
+        if len(template) < overlap:
+            template = out[n_written - overlap : n_written].mean(
+                axis=1, dtype=np.float64
+            )
+        region = mono[lo : hi + overlap]
+        corr = np.fft.irfft(
+            np.fft.rfft(region, n_fft) * np.conj(np.fft.rfft(template, n_fft)), n_fft
+        )[: hi - lo + 1]
+        norm = np.sqrt(
+            energy[lo + overlap : hi + overlap + 1] - energy[lo : hi + 1] + 1e-12
+        )
+        start = lo + int(np.argmax(corr / norm))
+
+        out[n_written - overlap : n_written] *= 1 - ramp
+        out[n_written - overlap : n_written] += ramp * audio[start : start + overlap]
+        out[n_written : n_written + hop_out] = audio[start + overlap : start + segment]
+        n_written += hop_out
+        last = start
+        k += 1
+
+    if n_written < n_out:
+        # input exhausted, append its remainder
+        tail = audio[last + segment :][: n_out - n_written]
+        out[n_written : n_written + len(tail)] = tail
+
+    return out[:n_out]
+
+
+def transform_wsola(
+    audio, sr_in, sr_out, n_channels, pitch_shift=None, time_stretch=None
+):
+    """
+    Convert, pitch shift and time stretch an event with WSOLA and resampling
+
+    A pitch shift by factor p = 2 ** (semitones / 12) is a time stretch by p
+    followed by resampling by 1 / p, so both augmentations and the sample rate
+    conversion are done in a single WSOLA pass and a single resampling.
+
+    Params
+    -------
+    audio: (n_samples, n_channels_in) source excerpt at sr_in
+    sr_in, sr_out: source and rendering sample rates
+    n_channels: number of rendering channels
+    pitch_shift: semitones, or None
+    time_stretch: output duration / input duration, or None
+
+    Returns
+    -------
+    (n_samples_out, n_channels) array at sr_out
+    """
+    pitch_factor = 1.0 if pitch_shift is None else 2 ** (pitch_shift / 12)
+    stretch = pitch_factor * (1.0 if time_stretch is None else time_stretch)
+
+    audio = convert_channels(audio, n_channels)
+    if stretch != 1:
+        audio = wsola(audio, stretch, sr_in)
+    return resample_ratio(audio, sr_out / (sr_in * pitch_factor))
+
+
+def transform_librosa(
+    audio, sr_in, sr_out, n_channels, pitch_shift=None, time_stretch=None
+):
+    """
+    Convert, pitch shift and time stretch an event with librosa's phase vocoder
+
+    Same signature as transform_wsola.
+    """
+    import librosa
+
+    audio = resample_ratio(convert_channels(audio, n_channels), sr_out / sr_in).T
+    if pitch_shift is not None:
+        audio = np.stack(
+            [
+                librosa.effects.pitch_shift(y, sr=sr_out, n_steps=pitch_shift)
+                for y in audio
+            ]
+        )
+    if time_stretch is not None:
+        audio = np.stack(
+            [librosa.effects.time_stretch(y, rate=1.0 / time_stretch) for y in audio]
+        )
+    return audio.T
+
+
+# Backend name -> transform(audio, sr_in, sr_out, n_channels, pitch_shift, time_stretch)
+BACKENDS = {
+    "wsola": transform_wsola,
+    "librosa": transform_librosa,
+}
+
+# Choices of the --backend options, sox being Scaper's own rendering
+RENDER_BACKENDS = ["sox"] + list(BACKENDS)
+
+
+def check_backend(backend):
+    # Raise before any work if backend cannot render here, sox needs its binary
+    if backend not in RENDER_BACKENDS:
+        raise ValueError(f"backend should be one of {RENDER_BACKENDS}, got {backend}")
+    if backend == "sox" and shutil.which("sox") is None:
+        raise RuntimeError(
+            "the sox backend needs the sox binary on the PATH, install sox or "
+            f"use one of {list(BACKENDS)}"
+        )
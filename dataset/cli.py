@@ -0,0 +1,121 @@
+import argparse
+import subprocess
+import sys
+
+from dataset import (
+    generate_oss,
+    generate_ost,
+    golden,
+    ground_truth_estimates,
+    render,
+    scheduler,
+    stems,
+    verify,
+)
+
+# Subcommand name -> (module with add_arguments and main, help)
+COMMANDS = {
+    "oss": (generate_oss, "synthesize OSS jams files"),
+    "ost": (generate_ost, "synthesize OST clips from OSS jams files"),
+    "gt": (ground_truth_estimates, "synthesize ground truth estimates of OST"),
+    "render": (render, "resample source files and compare rendering paths"),
+    "jobs": (scheduler, "run the OST and ground truth job grid from a work queue"),
+    "verify": (verify, "check generated clips, annotations and source splits"),
+    "stems": (stems, "save event stems and remix them at other SNRs"),
+    "golden": (golden, "check pipeline outputs against a golden manifest"),
+}
+
+# Modules that take long to import or JIT, only to be imported by the code that uses
+# them. numpy and yaml are cheap and imported at module level
+HEAVY_MODULES = [
+    "scipy",
+    "scaper",
+    "librosa",
+    "numba",
+    "jams",
+    "soundfile",
+    "pandas",
+]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="moads", description="Multi-label open-set audio dataset synthesis"
+    )
+    subparsers = parser.add_subparsers(dest="tool", required=True)
+    for name, (module, help) in COMMANDS.items():
+        module.add_arguments(subparsers.add_parser(name, help=help))
+
+    check = subparsers.add_parser(
+        "importcheck", help="check that the CLI starts without heavy imports"
+    )
+    check.add_argument(
+        "--budget",
+        type=float,
+        required=False,
+        help="maximum start-up time in seconds",
+        default=0.5,
+    )
+    check.add_argument(
+        "-n", type=int, required=False, help="number of timed runs", default=5
+    )
+
+    return parser
+
+
+def check_import_time(budget=0.5, n_runs=5):
+    """
+    Measure the start-up time of the CLI in fresh interpreters
+
+    Imports dataset.cli and builds the full argument parser, as `moads --help`
+    does, and records which heavy modules ended up imported.
+
+    Params
+    -------
+    budget: maximum allowed start-up time in seconds, best of n_runs
+    n_runs: number of fresh interpreters to time
+
+    Returns
+    -------
+    best start-up time in seconds, list of heavy modules imported, list of the
+    failed checks, empty if start-up is within budget and free of heavy modules
+    """
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "import dataset.cli\n"
+        "dataset.cli.build_parser()\n"
+        "print(time.perf_counter() - start)\n"
+        "print(','.join(m for m in dataset.cli.HEAVY_MODULES if m in sys.modules))\n"
+    )
+    times, heavy = [], []
+    for _ in range(n_runs):
+        out = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        ).stdout.split("\n")
+        times.append(float(out[0]))
+        heavy = [m for m in out[1].split(",") if m]
+
+    failures = []
+    if heavy:
+        failures.append(f"CLI start-up imports {heavy}")
+    if min(times) >= budget:
+        failures.append(f"CLI start-up took {min(times):.3f} s > {budget} s")
+
+    return min(times), heavy, failures
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.tool == "importcheck":
+        start_time, _, failures = check_import_time(args.budget, args.n)
+        if failures:
+            sys.exit("\n".join(failures))
+        print(f"CLI start-up in {start_time * 1000:.1f} ms, no heavy imports")
+    else:
+        COMMANDS[args.tool][0].main(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,140 @@
+import errno
+import os
 import shutil
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
 from os.path import join, basename
 
+STAGING_MODES = ["copy", "hardlink", "symlink", "reflink"]
+
+FICLONE = 0x40049409  # Linux ioctl cloning a file into another (reflink)
+
+# errors of a link or clone that copying may get around: not supported by the
+# filesystem, across filesystems or devices, not permitted
+_LINK_ERRORS = (errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL)
+
+
+def _reflink(src, dst):
+    # Clone src into dst, sharing its blocks on filesystems that support it
+    import fcntl
+
+    with open(src, "rb") as f_src, open(dst, "wb") as f_dst:
+        try:
+            fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+        except OSError:
+            f_dst.close()
+            os.remove(dst)
+            raise
+
+
+def _up_to_date(src, dst, mode):
+    # Whether dst already stages src in mode. A hardlink must be one, unless src
+    # and dst are on different devices, where it falls back to a copy
+    try:
+        if mode == "symlink":
+            return os.path.islink(dst) and os.readlink(dst) == os.path.abspath(src)
+        src_stat, dst_stat = os.stat(src), os.lstat(dst)
+        if mode == "hardlink" and src_stat.st_dev == dst_stat.st_dev:
+            return os.path.samefile(src, dst)
+    except OSError:
+        return False
+    return (
+        not os.path.islink(dst)
+        and src_stat.st_size == dst_stat.st_size
+        and int(src_stat.st_mtime) == int(dst_stat.st_mtime)
+    )
+
+
+def stage_file(src, dst, mode="copy", incremental=False):
+    """
+    Stage src at dst by copy, hardlink, symlink or reflink
+
+    Links and reflinks that the filesystem refuses fall back to a copy. Copies and
+    reflinks keep the modification time of src, so that incremental staging can
+    compare it.
+
+    Returns
+    -------
+    the mode used, or "skipped" if incremental and dst is already up to date
+    """
+    if not os.path.islink(dst) and os.path.realpath(src) == os.path.realpath(dst):
+        raise ValueError(f"cannot stage {src} onto itself")
+    if incremental and _up_to_date(src, dst, mode):
+        return "skipped"
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    try:
+        if mode == "hardlink":
+            os.link(src, dst)
+            return mode
+        if mode == "symlink":
+            os.symlink(os.path.abspath(src), dst)
+            return mode
+        if mode == "reflink":
+            _reflink(src, dst)
+            shutil.copystat(src, dst)
+            return mode
+    except OSError as e:
+        if e.errno not in _LINK_ERRORS:
+            raise
+    shutil.copyfile(src, dst)
+    shutil.copystat(src, dst)
+    return "copy"
+
+
+def create_new_paths(paths, source_dir, mode="copy", incremental=False, n_threads=8):
+    """
+    Stage source files in a new source directory, as source_dir/<label>/<file>
+
+    This structure is based on what Scaper needs. The label subdirectories are
+    created if needed.
 
-def create_new_paths(paths, source_dir):
-    # copy desired audio files to a new directory
-    # this function assumes that the label subdirectories have already been created
-    # this structure is based on what Scaper needs
+    Params
+    -------
+    paths: source wav files, in label subdirectories
+    source_dir: directory to stage them in
+    mode: copy, hardlink, symlink or reflink (copy-on-write clone). Hardlinks and
+        reflinks need source_dir on the same filesystem as the sources, else
+        files are copied
+    incremental: if True, skip files already staged, by size and modification
+        time for copies and reflinks
+    n_threads: number of files staged at once
+
+    Returns
+    -------
+    Counter of the modes used (copy when a link falls back) and of skipped files
+    """
+    assert mode in STAGING_MODES, f"mode should be one of {STAGING_MODES}"
+
+    jobs = []
     for path in paths:
         # get label
         label = path.split("/")[-2]
         # move to corresponding folder in new source dir
-        shutil.copyfile(path, join(source_dir, label, basename(path)))
+        jobs.append((path, join(source_dir, label, basename(path))))
+    for label_dir in {os.path.dirname(dst) for _, dst in jobs}:
+        os.makedirs(label_dir, exist_ok=True)
+
+    with ThreadPoolExecutor(n_threads) as pool:
+        modes = pool.map(lambda job: stage_file(*job, mode, incremental), jobs)
+        return Counter(modes)
+
+
+def list_source_paths(fg_path, sort=False):
+    """
+    Source wav files of a Scaper foreground directory, in the order
+    generate_oss.py splits them
+
+    get_source_path_splits assigns the first files of each class to train, so the
+    splits depend on this order. Everything that rebuilds the splits lists the
+    sources with this function. By default the order is that of the directory
+    listing, as the paper's dataset was generated. It can differ between
+    filesystems, sort for splits that do not.
+    """
+    paths = glob(join(fg_path, "*/*.wav"))
+    return sorted(paths) if sort else paths
 
 
 def get_class_assignments(variant_id, vocab_idx):
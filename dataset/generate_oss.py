@@ -1,26 +1,21 @@
 import random
 import time
 from collections import Counter
-from glob import glob
 import os
-from os.path import join
-
-import numpy as np
-import scaper
+from os.path import join, dirname
 import argparse
-
+import numpy as np
 import yaml
 
-from dataset.data_utils import get_class_assignments, get_source_path_splits
-from dataset.soundscape_generation import (
-    create_soundscape,
-    generate_without_audio,
-    SEED,
+from dataset.augmentation import RENDER_BACKENDS
+from dataset.data_utils import (
+    get_class_assignments,
+    get_source_path_splits,
+    list_source_paths,
 )
 
 
-def parse_args():
-    parser = argparse.ArgumentParser()
+def add_arguments(parser):
     parser.add_argument(
         "--fgpath", type=str, required=True, help="path to foreground source files"
     )
@@ -42,15 +37,137 @@ def parse_args():
     parser.add_argument(
         "--openness", type=str, required=True, help="openness: high or low"
     )
+    parser.add_argument(
+        "--config",
+        type=str,
+        required=False,
+        help="path to the OSS config file",
+        default=join(dirname(__file__), "oss.yml"),
+    )
+    parser.add_argument(
+        "--sortsources",
+        action="store_true",
+        help="split the source files in sorted order instead of directory order, "
+        "for splits that do not depend on the filesystem",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="only estimate the files, bytes, memory and time of the build, "
+        "with its OST and ground truth",
+    )
+    parser.add_argument(
+        "--plansamples",
+        type=int,
+        required=False,
+        help="number of soundscapes sampled by --plan",
+        default=200,
+    )
+    parser.add_argument(
+        "--planworkers",
+        type=int,
+        required=False,
+        help="number of OST and ground truth workers to plan for",
+        default=os.cpu_count(),
+    )
+    parser.add_argument(
+        "--plansr",
+        type=int,
+        required=False,
+        help="sample rate of the planned OST and ground truth",
+        default=16_000,
+    )
+    parser.add_argument(
+        "--planbackend",
+        type=str,
+        required=False,
+        choices=RENDER_BACKENDS,
+        help="augmentation backend of the planned OST and ground truth",
+        default="sox",
+    )
+    parser.add_argument(
+        "--planjson",
+        type=str,
+        required=False,
+        help="path to save the plan as JSON",
+        default=None,
+    )
 
-    args = parser.parse_args()
+    return parser
 
+
+def parse_args():
+    args = add_arguments(argparse.ArgumentParser()).parse_args()
+    check_args(args)
+
+    return args
+
+
+def check_args(args):
     assert (args.nvariants < 6) & (args.nvariants > 0)
     assert os.path.isdir(args.fgpath)
-    assert os.path.isdir(args.bgpath)
+    # the plan needs no backgrounds unless the config adds them
+    assert args.plan if args.bgpath is None else os.path.isdir(args.bgpath)
     assert args.openness in ["high", "low"]
 
-    return args
+
+def get_split_sources(source_paths, vocab_idx, variant_id, openness, config):
+    """
+    Source files, class counts and classes of each split of a dataset variant
+
+    Params
+    -------
+    source_paths: List of source wav file paths
+    vocab_idx: shuffled class indices
+    variant_id: dataset variant number (1-5)
+    openness: high or low
+    config: OSS config, see oss.yml
+
+    Returns
+    -------
+    dict of split name -> (split_source_paths, split_source_counts,
+    split_class_idx), as taken by generate_split
+    """
+    source_class_counts = Counter([path.split("/")[-2] for path in source_paths])
+
+    # get kk, ku and uu classes
+    kk_idx, ku_idx, uu_idx = get_class_assignments(variant_id, vocab_idx)
+    if openness == "high":
+        known_classes = kk_idx
+        unknown_classes = ku_idx + uu_idx
+    else:
+        known_classes = kk_idx + ku_idx
+        unknown_classes = uu_idx
+
+    # get paths
+    train_paths, val_paths, test_paths = get_source_path_splits(
+        source_paths,
+        known_classes,
+        unknown_classes,
+        train_frac=float(config["train_paths_frac"]),
+        val_frac=float(config["val_paths_frac"]),
+    )
+
+    train_source_counts = Counter(
+        {str(k): source_class_counts.get(str(k), 0) for k in kk_idx + ku_idx}
+    )
+    # same classes seen in train and val
+    val_source_counts = train_source_counts
+
+    return {
+        "train": (train_paths, train_source_counts, known_classes),
+        "val": (val_paths, val_source_counts, known_classes),
+        "test": (test_paths, source_class_counts, known_classes + unknown_classes),
+    }
+
+
+def get_vocab_idx():
+    # Class indices shuffled with SEED, the order get_class_assignments splits
+    from dataset.soundscape_generation import SEED
+
+    vocab_idx = [i for i in range(89)]
+    random.Random(SEED).shuffle(vocab_idx)
+    return vocab_idx
 
 
 def generate_split(
@@ -63,6 +180,7 @@ def generate_split(
     split_class_idx,
     outpath,
     config,
+    rng=None,
 ):
     """
     Generate a specific dataset variant split and save JAMS files
@@ -71,11 +189,14 @@ def generate_split(
     -------
     sc: Scaper Soundscape object
     n: starting number for file names
+    rng: np.random.RandomState of the event draws, the global np.random if None
 
     Returns
     -------
     sc object
     """
+    from dataset.soundscape_generation import create_soundscape, generate_without_audio
+
     for class_id in split_class_idx:
         for i in range(int(config["min_examples_per_class"])):
             sc = create_soundscape(
@@ -86,6 +207,7 @@ def generate_split(
                 snr_min=float(config["clean_snr"]),
                 snr_max=float(config["clean_snr"]),
                 add_bg=bool(config["add_bg"]),
+                rng=rng,
             )
 
             jamsfile = join(outpath, split, f"{n}.jams")
@@ -104,6 +226,7 @@ def generate_split(
             snr_min=float(config["clean_snr"]),
             snr_max=float(config["clean_snr"]),
             add_bg=bool(config["add_bg"]),
+            rng=rng,
         )
 
         jamsfile = join(outpath, split, f"{n}.jams")
@@ -112,23 +235,43 @@ def generate_split(
     return sc
 
 
-def main():
-    args = parse_args()
+def main(args=None):
+    import scaper
+    from dataset.soundscape_generation import SEED
+
+    if args is None:
+        args = parse_args()
+    else:
+        check_args(args)
 
-    with open(join("dataset", "oss.yml"), "r") as f:
+    with open(args.config, "r") as f:
         config = yaml.safe_load(f)
     print("Loaded config file")
     print(config)
 
+    if args.plan:
+        from dataset.plan import plan_build, print_plan
+
+        plan = plan_build(
+            args.fgpath,
+            args.bgpath,
+            config,
+            args.openness,
+            args.nvariants,
+            n_samples=args.plansamples,
+            target_sr=args.plansr,
+            backend=args.planbackend,
+            n_workers=args.planworkers,
+        )
+        print_plan(plan, args.planjson)
+        return
+
     # get shuffled class ids
-    vocab_idx = [i for i in range(89)]
-    random.Random(SEED).shuffle(vocab_idx)
+    vocab_idx = get_vocab_idx()
 
     # get paths
-    source_paths = glob(join(args.fgpath, "*/*.wav"))
+    source_paths = list_source_paths(args.fgpath, args.sortsources)
 
-    # get source class counts
-    source_class_counts = Counter([path.split("/")[-2] for path in source_paths])
     start_time = time.time()
 
     sc = scaper.Scaper(
@@ -153,52 +296,29 @@ def main():
         for split in ["train", "val", "test"]:
             os.makedirs(os.path.join(dataset_variant_outpath, split), exist_ok=True)
 
-        # get kk, ku and uu classes
-        kk_idx, ku_idx, uu_idx = get_class_assignments(variant_id, vocab_idx)
-        if args.openness == "high":
-            known_classes = kk_idx
-            unknown_classes = ku_idx + uu_idx
-        else:
-            known_classes = kk_idx + ku_idx
-            unknown_classes = uu_idx
-
-        # get paths
-        train_paths, val_paths, test_paths = get_source_path_splits(
-            source_paths,
-            known_classes,
-            unknown_classes,
-            train_frac=float(config["train_paths_frac"]),
-            val_frac=float(config["val_paths_frac"]),
+        split_sources = get_split_sources(
+            source_paths, vocab_idx, variant_id, args.openness, config
         )
 
         # train split
-        train_source_counts = Counter(
-            {str(k): source_class_counts.get(str(k), 0) for k in kk_idx + ku_idx}
-        )
-
         sc = generate_split(
             sc,
             0,
             "train",
             int(config["n_train_soundscapes"]),
-            train_paths,
-            train_source_counts,
-            known_classes,
+            *split_sources["train"],
             dataset_variant_outpath,
             config,
         )
         print("Generated training set examples")
 
         # val split
-        val_source_counts = train_source_counts  # same classes seen in train and val
         sc = generate_split(
             sc,
             int(config["n_train_soundscapes"]),
             "val",
             int(config["n_val_soundscapes"]),
-            val_paths,
-            val_source_counts,
-            known_classes,
+            *split_sources["val"],
             dataset_variant_outpath,
             config,
         )
@@ -206,15 +326,12 @@ def main():
         print("Generated validation set examples")
 
         # test split
-        test_source_counts = source_class_counts
         sc = generate_split(
             sc,
             int(config["n_train_soundscapes"]) + int(config["n_val_soundscapes"]),
             "test",
             int(config["n_test_soundscapes"]),
-            test_paths,
-            test_source_counts,
-            known_classes + unknown_classes,
+            *split_sources["test"],
             dataset_variant_outpath,
             config,
         )
@@ -1,13 +1,21 @@
 import os
 from pathlib import Path
 import time
-import numpy as np
-import jams
-import scaper
-import librosa
-import soundfile as sf
-import pandas as pd
 import argparse
+import numpy as np
+
+from dataset.augmentation import RENDER_BACKENDS
+from dataset.render import DTYPES, SUBTYPES, WORK_DTYPE
+
+# (length in s, hop in s) of the OST windows, hop None for a window centred on
+# each event
+OST_WINDOW = (1.0, None)
+# Context in s read around each window of an OSS wav file, more than the half
+# length of librosa's default resampling filter (64 zero crossings)
+RESAMPLE_MARGIN = 0.01
+# dtype OSS wav files are read and resampled in, librosa.load's default as for the
+# paper's OST, whatever the working dtype of rendered audio
+WAV_DTYPE = "float32"
 
 
 def create_tag(
@@ -18,6 +26,16 @@ def create_tag(
     jams_dir_id,
     save_isolated_events=False,
     gt_dir_id=None,
+    fg_path=None,
+    render_at_target_sr=False,
+    paths=None,
+    ann_name=None,
+    backend="sox",
+    windows=None,
+    dtype=WORK_DTYPE,
+    subtype="PCM_16",
+    cache_dir=None,
+    cache_bytes=None,
 ):
     """
     Create the tag dataset based on the given directory of jams files
@@ -25,7 +43,25 @@ def create_tag(
     ------
     split_dir : path to directory with jams files
     generate_audio : If True, generate Tag audio files as well
+    fg_path : source directory used to render soundscapes without a wav file,
+        defaults to the path stored in the jams files
+    render_at_target_sr : If True, render directly at target_sr from fg_path,
+        which must then hold sources resampled to target_sr
+    paths : jams files to process, defaults to all jams files in split_dir
+    ann_name : name of the annotation file, defaults to {openness}_{variant}_{split}
+    backend : pitch shift and time stretch backend of render_from_jams
+    windows : list of (length, hop) window configurations, see clip_windows,
+        all cut from one render of each soundscape. Defaults to [OST_WINDOW].
+        The clips and annotation file of each configuration other than OST_WINDOW
+        are saved under out_dir_id suffixed with window_name
+    dtype : working dtype of rendered soundscapes, OSS wav files are read in
+        WAV_DTYPE
+    subtype : sample format of the clips, e.g. PCM_16 or FLOAT
+    cache_dir, cache_bytes : render cache of render_at_sr, not used if None
     """
+    import soundfile as sf
+    import pandas as pd
+    from dataset.jams_reader import read_scaper_annotation
 
     # if "train" in split_dir:
     #     paths = glob.glob(os.path.join(split_dir, "*.jams"))
@@ -35,21 +71,28 @@ def create_tag(
     #         + glob.glob(os.path.join(split_dir, "kk/seen/*.jams"))
     #         + glob.glob(os.path.join(split_dir, "kk/unseen/*.jams"))
     #     )
-    paths = [str(path) for path in Path(split_dir).rglob("*.jams")]
+    if paths is None:
+        paths = [str(path) for path in Path(split_dir).rglob("*.jams")]
+
+    if windows is None:
+        windows = [OST_WINDOW]
+    windows = [tuple(window) for window in windows]
+    out_ids = {window: window_out_id(out_dir_id, window) for window in windows}
 
     columns = ["file_name", "source_file", "start_time", "label"]
-    df = pd.DataFrame(columns=columns)
+    dfs = {window: pd.DataFrame(columns=columns) for window in windows}
     index = 0
-    pkl_dir = os.path.join(
-        split_dir.replace(jams_dir_id, out_dir_id).split("jams")[0], "ann"
-    )
-    os.makedirs(pkl_dir, exist_ok=True)
+    for out_id in out_ids.values():
+        os.makedirs(get_ann_dir(split_dir, jams_dir_id, out_id), exist_ok=True)
     openness, variant_id, split = split_dir.split("/")[-3:]
+    if ann_name is None:
+        ann_name = f"{openness}_{variant_id}_{split}"
 
     dirs = set(
         [
-            str(path.parent).replace(jams_dir_id, out_dir_id)
-            for path in Path(split_dir).rglob("*.jams")
+            os.path.dirname(path).replace("jams", "audio").replace(jams_dir_id, out_id)
+            for path in paths
+            for out_id in out_ids.values()
         ]
     )
     for d in dirs:
@@ -58,81 +101,53 @@ def create_tag(
     for jamsPath in paths:
         fName = os.path.splitext(jamsPath)[0].replace("jams", "audio") + ".wav"
 
-        jamsFile = jams.load(jamsPath)
-
-        # if soundscape wav file doesn't exist, generate audio array
-        if not os.path.isfile(fName):
-            try:
-                audioArray, _, _, _ = scaper.generate_from_jams(jamsPath, None)
-            except:
-                with open(
-                    f"/home/s/ss645/mlos/logs/{openness}.{variant_id}.{split}.txt", "a"
-                ) as f:
-                    f.write("Scaper:" + jamsPath + "\n")
-                continue
-        else:
-            try:
-                audioArray, _ = librosa.load(fName, sr=target_sr)
-            except:
-                with open(
-                    f"/home/s/ss645/mlos/logs/{openness}.{variant_id}.{split}.txt", "a"
-                ) as f:
-                    f.write("Librosa:" + jamsPath + "\n")
-                continue
-
-        annotations = jamsFile.annotations.search(namespace="scaper")[0].data
-        annotations = [
-            event for event in annotations if event.value["label"] != "brownnoise"
+        ann = read_scaper_annotation(jamsPath)
+
+        labels = ann["label"]
+        start_times = ann["time"].tolist()
+        end_times = (ann["time"] + ann["duration"]).tolist()
+
+        clips = [
+            (window, n, startTime, event_idx)
+            for window in windows
+            for n, (startTime, event_idx) in enumerate(
+                clip_windows(start_times, end_times, ann["soundscape_duration"], window)
+            )
         ]
-        eventCount = len(annotations)
-
-        labels = []
-        start_times = []
-        end_times = []
-        for event in annotations:
-            labels.append(event.value["label"])
-            start_times.append(event.time)
-            end_times.append(event.time + event.duration)
-
-        for i in range(eventCount):
-            fileLabel = []
-            fileLabel.append(labels[i])
-            startTime = start_times[i]
-            endTime = end_times[i]
-
-            midPoint = (startTime + endTime) / 2
-            startTime = midPoint - 0.5  # window start time
-
-            if startTime < 0:
-                startTime = 0
-            elif (
-                startTime + 1
-            ) >= 10:  # probably not needed as latest event start time is 9s
-                extra = (startTime + 1) - 10
-                startTime = startTime - extra
-            endTime = startTime + 1  # window end time
-
-            other_idx = [k for k in range(eventCount)]
-            other_idx.pop(i)
-            for j in other_idx:
-                if (
-                    (startTime < start_times[j] < endTime)
-                    or (startTime < end_times[j] < endTime)
-                    or ((start_times[j] < startTime) and (end_times[j] > endTime))
-                ):
-                    fileLabel.append(labels[j])
-
-            sampleStart = int(startTime * target_sr)
-
-            eventArray = audioArray[sampleStart : sampleStart + target_sr]
-
-            trimfName = fName.replace(".wav", "_" + str(i + 1) + ".wav").replace(
-                jams_dir_id, out_dir_id
+
+        try:
+            clipArrays = load_windows(
+                jamsPath,
+                target_sr,
+                [
+                    (int(startTime * target_sr), int(window[0] * target_sr))
+                    for window, _, startTime, _ in clips
+                ],
+                fg_path,
+                render_at_target_sr,
+                backend,
+                dtype,
+                cache_dir,
+                cache_bytes,
+            )
+        except:
+            step = "Librosa:" if os.path.isfile(fName) else "Scaper:"
+            with open(
+                f"/home/s/ss645/mlos/logs/{openness}.{variant_id}.{split}.txt", "a"
+            ) as f:
+                f.write(step + jamsPath + "\n")
+            continue
+
+        for (window, n, startTime, event_idx), eventArray in zip(clips, clipArrays):
+            fileLabel = [labels[j] for j in event_idx]
+
+            trimfName = fName.replace(".wav", "_" + str(n + 1) + ".wav").replace(
+                jams_dir_id, out_ids[window]
             )
 
             if generate_audio:
                 try:
-                    sf.write(trimfName, eventArray, target_sr)
+                    sf.write(trimfName, eventArray, target_sr, subtype)
                 except:
                     with open(
                         f"/home/s/ss645/mlos/out/{openness}.{variant_id}.{split}.txt",
@@ -145,14 +160,278 @@ def create_tag(
                 orient="index",
                 columns=columns,
             )
-            df = pd.concat([df, df2], ignore_index=True, axis=0)
+            dfs[window] = pd.concat([dfs[window], df2], ignore_index=True, axis=0)
             index = index + 1
 
-    df.to_pickle(os.path.join(pkl_dir, f"{openness}_{variant_id}_{split}.pkl"))
+    for window, df in dfs.items():
+        pkl_dir = get_ann_dir(split_dir, jams_dir_id, out_ids[window])
+        df.to_pickle(os.path.join(pkl_dir, f"{ann_name}.pkl"))
 
 
-def parse_args():
-    parser = argparse.ArgumentParser()
+def load_soundscape(
+    jams_path,
+    target_sr,
+    fg_path=None,
+    render_at_target_sr=False,
+    backend="sox",
+    dtype=WORK_DTYPE,
+    cache_dir=None,
+    cache_bytes=None,
+):
+    """
+    Soundscape of a JAMS file at target_sr, as create_tag cuts it into clips
+
+    Loads the OSS wav file of the soundscape in WAV_DTYPE if it exists (the jams
+    file path with jams replaced by audio), else renders it in dtype with
+    render_at_sr, through the render cache in cache_dir if given.
+
+    Returns
+    -------
+    (n_samples,) array of WAV_DTYPE, or (n_samples, n_channels) of dtype if rendered
+    """
+    import librosa
+    from dataset.render import render_at_sr
+
+    wav_path = os.path.splitext(jams_path)[0].replace("jams", "audio") + ".wav"
+    # if soundscape wav file doesn't exist, generate audio array
+    if not os.path.isfile(wav_path):
+        audio, _, _ = render_at_sr(
+            jams_path,
+            target_sr,
+            fg_path=fg_path,
+            at_target_sr=render_at_target_sr,
+            backend=backend,
+            dtype=dtype,
+            cache_dir=cache_dir,
+            cache_bytes=cache_bytes,
+        )
+    else:
+        audio, _ = librosa.load(wav_path, sr=target_sr, dtype=WAV_DTYPE)
+    return audio
+
+
+def load_windows(
+    jams_path,
+    target_sr,
+    windows,
+    fg_path=None,
+    render_at_target_sr=False,
+    backend="sox",
+    dtype=WORK_DTYPE,
+    cache_dir=None,
+    cache_bytes=None,
+):
+    """
+    Windows of the soundscape of a JAMS file at target_sr
+
+    The same audio as slicing load_soundscape, but if the OSS wav file exists,
+    only the windows are read and resampled, see read_windows.
+
+    Params
+    -------
+    windows: list of (start, length) in samples at target_sr
+    other params: see load_soundscape
+
+    Returns
+    -------
+    list of arrays, one per window
+    """
+    wav_path = os.path.splitext(jams_path)[0].replace("jams", "audio") + ".wav"
+    if os.path.isfile(wav_path):
+        return read_windows(wav_path, target_sr, windows)
+
+    audio = load_soundscape(
+        jams_path,
+        target_sr,
+        fg_path,
+        render_at_target_sr,
+        backend,
+        dtype,
+        cache_dir,
+        cache_bytes,
+    )
+    return [audio[start : start + length] for start, length in windows]
+
+
+def read_windows(wav_path, target_sr, windows, dtype=WAV_DTYPE, margin=None):
+    """
+    Windows of a wav file as sliced from librosa.load(wav_path, sr=target_sr)
+
+    Windows are padded with margin seconds of context and merged where they
+    overlap. Each merged segment is read with a seek and resampled on its own, so
+    that only the windows are decoded and resampled instead of the whole file.
+    Segments start on a multiple of the resampling period, where their samples
+    line up with those of the whole resampled file, and the margin covers the
+    resampling filter, so the windows match librosa.load. That holds when both
+    read in the same dtype, float32 by default for both.
+
+    Params
+    -------
+    windows: list of (start, length) in samples at target_sr
+    margin: context in s, defaults to RESAMPLE_MARGIN
+
+    Returns
+    -------
+    list of (n_samples,) arrays of dtype, one per window
+    """
+    import math
+    import librosa
+    import soundfile as sf
+
+    margin = RESAMPLE_MARGIN if margin is None else margin
+    with sf.SoundFile(wav_path) as f:
+        orig_sr, n_frames = f.samplerate, f.frames
+        # input and output samples of one resampling period
+        gcd = math.gcd(orig_sr, target_sr)
+        step_in, step_out = orig_sr // gcd, target_sr // gcd
+        n_out = int(np.ceil(n_frames * float(target_sr) / orig_sr))
+        margin = int(np.ceil(margin * target_sr))
+
+        spans = sorted(
+            (max(0, start - margin) // step_out * step_out, start + length + margin)
+            for start, length in windows
+        )
+        segments = []
+        for lo, hi in spans:
+            if segments and lo <= segments[-1][1]:
+                segments[-1][1] = max(segments[-1][1], hi)
+            else:
+                segments.append([lo, hi])
+
+        resampled = []
+        for lo, hi in segments:
+            start = lo // step_out * step_in
+            stop = n_frames if hi >= n_out else -(-hi // step_out) * step_in
+            f.seek(start)
+            audio = f.read(min(stop, n_frames) - start, dtype=dtype, always_2d=True)
+            audio = librosa.to_mono(audio.T)
+            if orig_sr != target_sr:
+                audio = librosa.resample(audio, orig_sr=orig_sr, target_sr=target_sr)
+            resampled.append((lo, audio))
+
+    clips = []
+    for start, length in windows:
+        lo, audio = [
+            (lo, audio) for lo, audio in resampled if lo <= max(0, start - margin)
+        ][-1]
+        clips.append(audio[start - lo : start - lo + length])
+    return clips
+
+
+def ost_window(start_time, end_time, duration=10.0, window=1.0):
+    """
+    Start time of the OST window of an event
+
+    The window is centred on the event and shifted to lie within the soundscape.
+
+    Params
+    -------
+    start_time, end_time: event onset and offset in seconds
+    duration: soundscape duration in seconds
+    window: window length in seconds
+
+    Returns
+    -------
+    window start time in seconds
+    """
+    window_start = (start_time + end_time) / 2 - window / 2
+    if window_start < 0:
+        window_start = 0
+    elif (window_start + window) >= duration:
+        extra = (window_start + window) - duration
+        window_start = window_start - extra
+    return window_start
+
+
+def overlapping_events(window_start, window_end, start_times, end_times, i):
+    # Indices of the events other than i that overlap the window, whose labels are
+    # added to the label of event i
+    return [
+        j
+        for j in range(len(start_times))
+        if j != i
+        and (
+            (window_start < start_times[j] < window_end)
+            or (window_start < end_times[j] < window_end)
+            or ((start_times[j] < window_start) and (end_times[j] > window_end))
+        )
+    ]
+
+
+def clip_windows(start_times, end_times, duration=10.0, window=OST_WINDOW):
+    """
+    Clip windows of a soundscape and the events labelling each of them
+
+    Params
+    -------
+    start_times, end_times: event onsets and offsets in seconds
+    duration: soundscape duration in seconds
+    window: (length, hop) in seconds. With hop None, one window per event,
+        centred on it as in OST, labelled with the event followed by the events
+        overlapping the window. Otherwise windows of the given length every hop
+        seconds from 0, labelled with all events overlapping them (possibly none)
+
+    Returns
+    -------
+    list of (window start time, list of event indices)
+    """
+    length, hop = window
+    if hop is None:
+        windows = []
+        for i in range(len(start_times)):
+            window_start = ost_window(start_times[i], end_times[i], duration, length)
+            windows.append(
+                (
+                    window_start,
+                    [i]
+                    + overlapping_events(
+                        window_start,
+                        window_start + length,
+                        start_times,
+                        end_times,
+                        i,
+                    ),
+                )
+            )
+        return windows
+
+    n_windows = int((duration - length) / hop + 1e-9) + 1
+    return [
+        (
+            n * hop,
+            overlapping_events(n * hop, n * hop + length, start_times, end_times, -1),
+        )
+        for n in range(max(n_windows, 0))
+    ]
+
+
+def window_name(window):
+    # Short name of a window configuration, e.g. w0.5 or w2-h0.5
+    length, hop = window
+    return f"w{length:g}" if hop is None else f"w{length:g}-h{hop:g}"
+
+
+def window_out_id(out_dir_id, window):
+    # Dataset name of the clips of a window configuration, out_dir_id for OST
+    if tuple(window) == OST_WINDOW:
+        return out_dir_id
+    return f"{out_dir_id}-{window_name(window)}"
+
+
+def parse_window(spec):
+    # "length" for a centred window, "length:hop" for sliding windows
+    length, _, hop = spec.partition(":")
+    return (float(length), float(hop) if hop else None)
+
+
+def get_ann_dir(split_dir, jams_dir_id, out_dir_id):
+    # Directory where create_tag saves the annotation files of split_dir
+    return os.path.join(
+        split_dir.replace(jams_dir_id, out_dir_id).split("jams")[0], "ann"
+    )
+
+
+def add_arguments(parser):
     parser.add_argument(
         "-o", "--openness", type=str, required=True, help="\{high, low\}"
     )
@@ -197,13 +476,78 @@ def parse_args():
         help="whether to save wav files. If false, just save annotation file",
         default=True,
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--fgpath",
+        type=str,
+        required=False,
+        help="path to foreground source files, defaults to the path in the jams files",
+        default=None,
+    )
+    parser.add_argument(
+        "--atsr",
+        action="store_true",
+        help="render directly at --sr, --fgpath must hold sources resampled to --sr",
+    )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        required=False,
+        choices=RENDER_BACKENDS,
+        help="pitch shift and time stretch backend, sox or in process",
+        default="sox",
+    )
+    parser.add_argument(
+        "--windows",
+        type=str,
+        nargs="+",
+        required=False,
+        help="clip windows, length for one window centred on each event or "
+        "length:hop for sliding windows, in seconds",
+        default=["1"],
+    )
+    parser.add_argument(
+        "--dtype",
+        type=str,
+        required=False,
+        choices=DTYPES,
+        help="working dtype of the rendered audio",
+        default=WORK_DTYPE,
+    )
+    parser.add_argument(
+        "--subtype",
+        type=str,
+        required=False,
+        choices=SUBTYPES,
+        help="sample format of the output wav files",
+        default="PCM_16",
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        required=False,
+        help="directory of the render cache, shared by runs on the same jams files",
+        default=None,
+    )
+    parser.add_argument(
+        "--cachesize",
+        type=str,
+        required=False,
+        help="size of the render cache, e.g. 50G",
+        default="50G",
+    )
 
-    return args
+    return parser
 
 
-if __name__ == "__main__":
-    args = parse_args()
+def parse_args():
+    return add_arguments(argparse.ArgumentParser()).parse_args()
+
+
+def main(args=None):
+    from dataset.scheduler import parse_memory
+
+    if args is None:
+        args = parse_args()
 
     print(
         f"Generating from openness {args.openness}, {args.variant}, {args.split} split"
@@ -219,7 +563,19 @@ if __name__ == "__main__":
         args.sr,
         args.outid,
         args.jamid,
+        fg_path=args.fgpath,
+        render_at_target_sr=args.atsr,
+        backend=args.backend,
+        windows=[parse_window(spec) for spec in args.windows],
+        dtype=args.dtype,
+        subtype=args.subtype,
+        cache_dir=args.cache,
+        cache_bytes=parse_memory(args.cachesize),
     )
     split_time = time.time() - start_time
     print(f"Generated the split in {round(split_time / 60.0, 2)} minutes")
     print("-------------------------------------------------")
+
+
+if __name__ == "__main__":
+    main()
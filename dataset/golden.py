@@ -0,0 +1,549 @@
+import argparse
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import sys
+import time
+from os.path import join, dirname, relpath
+from pathlib import Path
+import numpy as np
+import yaml
+
+from dataset.augmentation import RENDER_BACKENDS
+from dataset.render import WORK_DTYPE
+
+N_CLASSES = 89
+N_BLOCKS = 32  # block RMS values kept per wav for tolerance-aware comparisons
+FLOAT_DIGITS = 9  # significant digits of the floats in canonicalised JAMS files
+SPLITS = ["train", "val", "test"]
+# Largest change of a block RMS, in dB, of a wav file whose samples differ.
+# Rounding to 16 bits moves it by far less, a level change by more
+TOLERANCE_DB = 0.01
+SILENCE_RMS = 1e-5  # block RMS floor, about 1/3 of a 16 bit step
+
+GOLDEN_MANIFEST = join(dirname(__file__), "golden_manifest.json")
+
+# Sandbox fields that depend on the machine or library versions, not on the spec
+VOLATILE_FIELDS = [
+    "scaper_version",
+    "fg_path",
+    "bg_path",
+    "fg_spec",
+    "bg_spec",
+    "jams_path",
+    "audio_path",
+]
+
+
+def make_synthetic_sources(
+    fg_path, n_per_class=10, sr=16_000, min_duration=0.5, max_duration=2.0, seed=0
+):
+    """
+    Write a small synthetic Scaper source tree, one directory per class
+
+    Every file is a decaying harmonic tone with a little noise, with class
+    dependent pitch and file dependent duration, so the tree is reproducible and
+    pitch shift and time stretch have something to act on.
+
+    Returns
+    -------
+    list of the source files written
+    """
+    import soundfile as sf
+
+    rng = np.random.default_rng(seed)
+    paths = []
+    for label in range(N_CLASSES):
+        os.makedirs(join(fg_path, str(label)), exist_ok=True)
+        for k in range(n_per_class):
+            duration = rng.uniform(min_duration, max_duration)
+            t = np.arange(int(duration * sr)) / sr
+            f0 = 110 * 2 ** (label / 24)
+            audio = sum(
+                np.sin(2 * np.pi * f0 * h * t + rng.uniform(0, 2 * np.pi)) / h
+                for h in range(1, 6)
+            )
+            audio = audio * np.exp(
+                -t * rng.uniform(0.5, 3)
+            ) + 0.01 * rng.standard_normal(len(t))
+            path = join(fg_path, str(label), f"{label}_{k}.wav")
+            sf.write(path, (0.5 * audio / np.max(np.abs(audio))).astype("float32"), sr)
+            paths.append(path)
+    return paths
+
+
+def save_soundscapes(jams_dir, backend, dtype=WORK_DTYPE):
+    """
+    Render every JAMS file under jams_dir and save it as an OSS wav file
+
+    The wav files go where create_tag looks for them (jams replaced by audio in
+    the path), at the sr of the JAMS file and in PCM_32, as Scaper's generate
+    saves soundscapes.
+
+    Returns
+    -------
+    list of the wav files written
+    """
+    import soundfile as sf
+    from dataset.render import render_from_jams
+
+    paths = []
+    for jams_path in sorted(str(p) for p in Path(jams_dir).rglob("*.jams")):
+        audio, _, _, sr = render_from_jams(jams_path, backend=backend, dtype=dtype)
+        wav_path = os.path.splitext(jams_path)[0].replace("jams", "audio") + ".wav"
+        os.makedirs(dirname(wav_path), exist_ok=True)
+        sf.write(wav_path, audio, sr, subtype="PCM_32")
+        paths.append(wav_path)
+    return paths
+
+
+def _cli_args(module, argv):
+    # Namespace of the command line argv, with the defaults of module's CLI
+    return module.add_arguments(argparse.ArgumentParser()).parse_args(argv)
+
+
+def run_pipeline(
+    work_dir,
+    n_soundscapes=(12, 4, 6),
+    min_examples_per_class=1,
+    n_variants=1,
+    openness="low",
+    target_sr=16_000,
+    backends=("sox",),
+    dtype=WORK_DTYPE,
+    config=join(dirname(__file__), "oss.yml"),
+):
+    """
+    Run OSS, OST and ground truth generation on a synthetic source tree
+
+    Drives the command line entry points: generate_oss.py with a copy of config
+    for fewer soundscapes, then generate_ost.py and ground_truth_estimates.py on
+    every split, once per backend. Then, per backend, saves the soundscapes as
+    OSS wav files and runs generate_ost.py again, which cuts OST from the wav
+    files instead of rendering. Sources are split in sorted order
+    (--sortsources), so the outputs do not depend on the filesystem.
+
+    Params
+    -------
+    work_dir: directory for the sources and outputs, its path must not contain
+        "oss" or "jams", which the pipeline replaces in output paths
+    n_soundscapes: number of train, val and test soundscapes, besides the
+        class-wise ones
+    min_examples_per_class: class-wise soundscapes per class and split
+    target_sr, dtype: passed to generate_ost.py and ground_truth_estimates.py
+    backends: augmentation backends, the OST and ground truth of each are saved
+        under ost-{backend} and ost-gt-{backend}, its OSS wav files under
+        audio-{backend} and the OST cut from them under ost-wav-{backend}
+
+    Returns
+    -------
+    dict of the parameters of the run, saved with its manifest
+    """
+    from dataset import generate_oss, generate_ost, ground_truth_estimates
+    from dataset.augmentation import check_backend
+    from dataset.data_utils import list_source_paths
+
+    for backend in backends:
+        check_backend(backend)
+    work_dir = os.path.abspath(work_dir)
+    assert "oss" not in work_dir and "jams" not in work_dir, work_dir
+    fg_path, bg_path = join(work_dir, "fg"), join(work_dir, "bg")
+    os.makedirs(bg_path, exist_ok=True)
+    make_synthetic_sources(fg_path)
+
+    with open(config, "r") as f:
+        config = yaml.safe_load(f)
+    split_sources = generate_oss.get_split_sources(
+        list_source_paths(fg_path, sort=True),
+        generate_oss.get_vocab_idx(),
+        1,
+        openness,
+        config,
+    )
+    # generate_oss.py counts the class-wise soundscapes in each split
+    config["min_examples_per_class"] = min_examples_per_class
+    for split, n_split in zip(SPLITS, n_soundscapes):
+        config[f"n_{split}_soundscapes"] = (
+            n_split + len(split_sources[split][2]) * min_examples_per_class
+        )
+    config_path = join(work_dir, "config.yml")
+    with open(config_path, "w") as f:
+        yaml.safe_dump(config, f)
+
+    jams_path = join(work_dir, "oss", "jams")
+    generate_oss.main(
+        _cli_args(
+            generate_oss,
+            [
+                *("--fgpath", fg_path, "--bgpath", bg_path, "--outpath", jams_path),
+                *("--nvariants", str(n_variants), "--openness", openness),
+                *("--config", config_path, "--sortsources"),
+            ],
+        )
+    )
+
+    for backend in backends:
+        for variant_id in range(1, n_variants + 1):
+            for split in SPLITS:
+                common = [
+                    *("-o", openness, "-v", f"variant{variant_id}", "-s", split),
+                    *("-p", jams_path, "--jamid", "oss", "--sr", str(target_sr)),
+                    *("--backend", backend, "--dtype", dtype),
+                ]
+                generate_ost.main(
+                    _cli_args(generate_ost, common + ["--outid", f"ost-{backend}"])
+                )
+                ground_truth_estimates.main(
+                    _cli_args(
+                        ground_truth_estimates,
+                        common + ["--outid", f"ost-gt-{backend}"],
+                    )
+                )
+
+        # the wav files of one backend at a time, where generate_ost.py finds them
+        save_soundscapes(jams_path, backend, dtype)
+        for variant_id in range(1, n_variants + 1):
+            for split in SPLITS:
+                generate_ost.main(
+                    _cli_args(
+                        generate_ost,
+                        [
+                            *("-o", openness, "-v", f"variant{variant_id}"),
+                            *("-s", split, "-p", jams_path, "--jamid", "oss"),
+                            *("--sr", str(target_sr), "--dtype", dtype),
+                            *("--outid", f"ost-wav-{backend}"),
+                        ],
+                    )
+                )
+        os.rename(join(work_dir, "oss", "audio"), join(work_dir, f"audio-{backend}"))
+
+    return dict(
+        n_soundscapes=list(n_soundscapes),
+        min_examples_per_class=min_examples_per_class,
+        n_variants=n_variants,
+        openness=openness,
+        target_sr=target_sr,
+        dtype=dtype,
+    )
+
+
+def _canonical(value):
+    # JSON value with floats rounded to FLOAT_DIGITS significant digits
+    if isinstance(value, float):
+        return float(f"{value:.{FLOAT_DIGITS}g}")
+    if isinstance(value, dict):
+        return {k: _canonical(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_canonical(v) for v in value]
+    return value
+
+
+def hash_jams(path):
+    """
+    Hash the scaper annotation of a JAMS file, independent of where it was made
+
+    Source paths are made relative to their label directory, machine and version
+    dependent sandbox fields are dropped and floats are rounded, then the JSON is
+    serialised with sorted keys.
+    """
+    with open(path, "r") as f:
+        jam = json.load(f)
+    ann = [a for a in jam["annotations"] if a["namespace"] == "scaper"][0]
+    for obs in ann["data"]:
+        if obs["value"].get("source_file"):
+            obs["value"]["source_file"] = join(
+                *Path(obs["value"]["source_file"]).parts[-2:]
+            )
+    sandbox = {
+        k: v for k, v in ann["sandbox"]["scaper"].items() if k not in VOLATILE_FIELDS
+    }
+    spec = _canonical({"data": ann["data"], "sandbox": sandbox})
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+
+def hash_annotations(ann_path, root):
+    # One hash per row of an OST annotation file, by clip path relative to root
+    import pandas as pd
+
+    df = pd.read_pickle(ann_path)
+    rows = {}
+    for file_name, source_file, start_time, label in zip(
+        df["file_name"], df["source_file"], df["start_time"], df["label"]
+    ):
+        row = [source_file, _canonical(float(start_time)), [str(x) for x in label]]
+        rows[relpath(file_name, root)] = hashlib.sha256(
+            json.dumps(row).encode()
+        ).hexdigest()
+    return rows
+
+
+def hash_wav(path, root):
+    """
+    Exact hash and a coarse fingerprint of a wav file
+
+    Returns
+    -------
+    relative path, dict of sha256 of the sample data, sr, n_frames and the RMS of
+    N_BLOCKS equal blocks of the samples, for comparisons with a tolerance
+    """
+    from dataset.verify import read_wav_header, wav_samples
+
+    header = read_wav_header(path)
+    samples = wav_samples(path, header)
+    record = {
+        "sha256": hashlib.sha256(memoryview(np.ascontiguousarray(samples))).hexdigest(),
+        "sr": header["sr"],
+        "n_frames": header["n_frames"],
+    }
+    audio = np.asarray(samples, dtype=np.float64).mean(axis=1)
+    if samples.dtype.kind == "i":
+        audio /= -float(np.iinfo(samples.dtype).min)
+    blocks = np.array_split(audio, N_BLOCKS) if len(audio) else []
+    record["blocks"] = [
+        float(np.sqrt(np.mean(b**2))) if len(b) else 0.0 for b in blocks
+    ]
+    return relpath(path, root), record
+
+
+def _hash_wav(args):
+    return hash_wav(*args)
+
+
+def make_manifest(work_dir, backends, n_jobs=1, params=None):
+    """
+    Hash every JAMS file, annotation row and wav file produced under work_dir
+
+    Returns
+    -------
+    manifest: dict of params, jams (path -> hash) and backends (backend -> dict
+    of annotations, clip path -> hash, and audio, path -> hash_wav record),
+    paths relative to work_dir
+    """
+    work_dir = os.path.abspath(work_dir)
+    jams_paths = sorted(str(p) for p in Path(work_dir, "oss").rglob("*.jams"))
+    manifest = {"params": params or {}, "jams": {}, "backends": {}}
+    for path in jams_paths:
+        manifest["jams"][relpath(path, work_dir)] = hash_jams(path)
+
+    for backend in backends:
+        out_dirs = [
+            Path(work_dir, f"ost-{backend}"),
+            Path(work_dir, f"ost-gt-{backend}"),
+            Path(work_dir, f"audio-{backend}"),
+            Path(work_dir, f"ost-wav-{backend}"),
+        ]
+        annotations = {}
+        for out_dir in [out_dirs[0], out_dirs[3]]:
+            for path in sorted(out_dir.glob("ann/*.pkl")):
+                annotations.update(hash_annotations(str(path), work_dir))
+        jobs = [
+            (str(p), work_dir)
+            for p in sorted(p for d in out_dirs for p in d.rglob("*.wav"))
+        ]
+        if n_jobs == 1:
+            records = [_hash_wav(job) for job in jobs]
+        else:
+            with multiprocessing.Pool(n_jobs) as pool:
+                records = pool.map(_hash_wav, jobs, chunksize=64)
+        manifest["backends"][backend] = {
+            "annotations": annotations,
+            "audio": dict(records),
+        }
+
+    return manifest
+
+
+def level_change(old_blocks, new_blocks):
+    # Largest change in dB between the block RMS of two wav files, blocks
+    # quieter than SILENCE_RMS compared as SILENCE_RMS
+    return max(
+        (
+            abs(20 * math.log10(max(b, SILENCE_RMS) / max(a, SILENCE_RMS)))
+            for a, b in zip(old_blocks, new_blocks)
+        ),
+        default=0.0,
+    )
+
+
+def _diff_section(old, new, audio=False, tolerance_db=TOLERANCE_DB):
+    # missing, extra and changed keys of a section, and within_tolerance for audio
+    changed, within_tolerance = [], []
+    for key in sorted(set(old) & set(new)):
+        if not audio:
+            if old[key] != new[key]:
+                changed.append(key)
+        elif old[key]["sha256"] != new[key]["sha256"]:
+            close = (
+                old[key]["sr"] == new[key]["sr"]
+                and old[key]["n_frames"] == new[key]["n_frames"]
+                and level_change(old[key]["blocks"], new[key]["blocks"]) <= tolerance_db
+            )
+            (within_tolerance if close else changed).append(key)
+    section = {
+        "missing": sorted(set(old) - set(new)),
+        "extra": sorted(set(new) - set(old)),
+        "changed": changed,
+    }
+    if audio:
+        section["within_tolerance"] = within_tolerance
+    return section
+
+
+def diff_manifests(golden, current, tolerance_db=TOLERANCE_DB):
+    """
+    Compare a manifest with a golden manifest
+
+    JAMS files and annotation rows must hash identically. Wav files whose
+    samples differ are accepted if sr and length match and no block RMS changes
+    by more than tolerance_db. Every backend of current must be in golden.
+
+    Returns
+    -------
+    dict of section (jams, {backend}/annotations, {backend}/audio) -> dict of
+    missing, extra and changed keys, and for audio also within_tolerance
+    (differing samples, accepted). Backends of current missing from golden are
+    listed under no_baseline
+    """
+    report = {"jams": _diff_section(golden.get("jams", {}), current["jams"])}
+    report["no_baseline"] = sorted(set(current["backends"]) - set(golden["backends"]))
+    for backend in sorted(set(current["backends"]) & set(golden["backends"])):
+        old, new = golden["backends"][backend], current["backends"][backend]
+        report[f"{backend}/annotations"] = _diff_section(
+            old["annotations"], new["annotations"]
+        )
+        report[f"{backend}/audio"] = _diff_section(
+            old["audio"], new["audio"], True, tolerance_db
+        )
+    if golden.get("params") != current.get("params"):
+        report["params"] = {
+            "golden": golden.get("params"),
+            "current": current["params"],
+        }
+
+    return report
+
+
+def _sections(report):
+    return [key for key in report if key not in ["no_baseline", "params"]]
+
+
+def n_differences(report):
+    # Number of differences that fail a check, within_tolerance does not count
+    return (
+        sum(
+            len(keys)
+            for section in _sections(report)
+            for kind, keys in report[section].items()
+            if kind != "within_tolerance"
+        )
+        + len(report["no_baseline"])
+        + int("params" in report)
+    )
+
+
+def print_diff(report):
+    for section in _sections(report):
+        counts = ", ".join(f"{k} {len(v)}" for k, v in report[section].items())
+        print(f"{section}: {counts}")
+        for kind in ["missing", "extra", "changed"]:
+            for key in report[section][kind][:5]:
+                print(f"  {kind}: {key}")
+    for backend in report["no_baseline"]:
+        print(f"no golden outputs of the {backend} backend")
+    if "params" in report:
+        print(f"params differ: {report['params']}")
+    print(f"{n_differences(report)} differences")
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        "command",
+        choices=["record", "check"],
+        help="record a golden manifest, or check a new run against it",
+    )
+    parser.add_argument(
+        "--workdir",
+        type=str,
+        required=True,
+        help="empty directory to run the pipeline in, must not contain oss or jams",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default=GOLDEN_MANIFEST,
+        help="path of the golden manifest, defaults to the one in the repository",
+    )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        nargs="+",
+        choices=RENDER_BACKENDS,
+        default=None,
+        help="augmentation backends, sox needs the sox binary. Defaults to sox "
+        "for record, to the backends of the manifest for check",
+    )
+    parser.add_argument(
+        "--minexamples",
+        type=int,
+        default=1,
+        help="class-wise soundscapes per class and split, must match the manifest "
+        "for check",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=TOLERANCE_DB,
+        help="tolerance in dB on the block RMS of wav files whose samples differ",
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=os.cpu_count(), help="number of processes"
+    )
+
+    return parser
+
+
+def parse_args():
+    return add_arguments(argparse.ArgumentParser()).parse_args()
+
+
+def main(args=None):
+    if args is None:
+        args = parse_args()
+
+    golden = None
+    backends = args.backend or ["sox"]
+    if args.command == "check":
+        with open(args.manifest, "r") as f:
+            golden = json.load(f)
+        backends = args.backend or sorted(golden["backends"])
+
+    start_time = time.time()
+    params = run_pipeline(
+        args.workdir,
+        min_examples_per_class=args.minexamples,
+        backends=backends,
+    )
+    manifest = make_manifest(args.workdir, backends, args.jobs, params)
+    n_rows = sum(len(b["annotations"]) for b in manifest["backends"].values())
+    n_wavs = sum(len(b["audio"]) for b in manifest["backends"].values())
+    print(
+        f"Hashed {len(manifest['jams'])} jams files, {n_rows} annotation rows and "
+        f"{n_wavs} wav files of {', '.join(backends)} in "
+        f"{round(time.time() - start_time, 1)} s"
+    )
+
+    if args.command == "record":
+        with open(args.manifest, "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        print(f"Saved golden manifest to {args.manifest}")
+    else:
+        report = diff_manifests(golden, manifest, args.tolerance)
+        print_diff(report)
+        if n_differences(report):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,15 @@
 import argparse
 import time
-import jams
 import os
 from os import path
 from pathlib import Path
 from glob import glob
-import soundfile as sf
-import scaper
-import yaml
-import librosa
 import numpy as np
 
+from dataset.augmentation import RENDER_BACKENDS
+from dataset.generate_ost import ost_window, overlapping_events
+from dataset.render import DTYPES, SUBTYPES, WORK_DTYPE
+
 
 def get_failed_jams(
     openness,
@@ -43,54 +42,62 @@ def ground_truth_estimates(
     label_in_file_name=True,
     out_dir_id="ost-clean-gt",
     jams_dir_id="oss-clean",
+    fg_path=None,
+    render_at_target_sr=False,
+    backend="sox",
+    dtype=WORK_DTYPE,
+    subtype="PCM_16",
+    cache_dir=None,
+    cache_bytes=None,
 ):
+    # fg_path : source directory, defaults to the path stored in the jams files
+    # render_at_target_sr : if True, render directly at target_sr from fg_path,
+    # which must then hold sources resampled to target_sr
+    # backend : pitch shift and time stretch backend of render_from_jams
+    # dtype : working dtype of the events, subtype : sample format of the clips
+    # cache_dir, cache_bytes : render cache of render_at_sr, not used if None
+    import soundfile as sf
+    from dataset.jams_reader import read_scaper_annotation
+    from dataset.render import render_at_sr
+
     # file_list = glob(path.join(split_dir, "*.jams"))
     for file in file_list:
         # grab foreground event annotations
-        jams_dump = jams.load(file).search(namespace="scaper")[0]
-        orig_sr, duration = (
-            jams_dump["sandbox"].scaper["sr"],
-            jams_dump["sandbox"].scaper["duration"],
-        )
-        anns = jams_dump.data
-        anns = [event for event in anns if event.value["label"] != "brownnoise"]
+        anns = read_scaper_annotation(file)
+        orig_sr, duration = anns["sr"], anns["soundscape_duration"]
         # get list of event arrays
-        _, _, _, event_audio_list = scaper.generate_from_jams(file)
-        event_audio_list = librosa.resample(
-            np.array(event_audio_list).squeeze(axis=-1),
-            orig_sr=orig_sr,
-            target_sr=target_sr,
+        _, event_audio_list, _ = render_at_sr(
+            file,
+            target_sr,
+            fg_path=fg_path,
+            at_target_sr=render_at_target_sr,
+            backend=backend,
+            dtype=dtype,
+            cache_dir=cache_dir,
+            cache_bytes=cache_bytes,
         )
+        event_audio_list = np.stack(event_audio_list).squeeze(axis=-1)
         assert event_audio_list.shape[-1] == (target_sr * duration)
 
         # if "clean" not in out_dir_id:
         #     event_audio_list = event_audio_list[1:]  # ignore background noise
         openness, fold, split = split_dir.split("/")[-3:]
 
-        labels, start_times, end_times = [], [], []
-        for event in anns:
-            labels.append(event.value["label"])
-            start_times.append(event.time)
-            end_times.append(event.time + event.duration)
+        labels = anns["label"]
+        start_times = anns["time"].tolist()
+        end_times = (anns["time"] + anns["duration"]).tolist()
 
-        for i, (ann, event_wav) in enumerate(zip(anns, event_audio_list)):
+        for i, (start_time, end_time, event_wav) in enumerate(
+            zip(start_times, end_times, event_audio_list)
+        ):
             clip_basepath = (
                 path.splitext(file)[0]
                 .replace("jams", "audio")
                 .replace(jams_dir_id, out_dir_id)
                 + f"_{i+1}"
             )
-            start_time = ann.time
-            end_time = start_time + ann.duration
-            mid_point = (start_time + end_time) / 2
-
             # crop middle 1s of the event
-            start_time = mid_point - 0.5
-            if start_time < 0:
-                start_time = 0
-            elif (start_time + 1) >= duration:
-                extra = (start_time + 1) - duration
-                start_time = start_time - extra
+            start_time = ost_window(start_time, end_time, duration)
             end_time = start_time + 1
 
             event_wav = event_wav[
@@ -103,7 +110,9 @@ def ground_truth_estimates(
 
             os.makedirs(path.dirname(event_out_path), exist_ok=True)
             try:
-                sf.write(event_out_path, event_wav, samplerate=target_sr)
+                sf.write(
+                    event_out_path, event_wav, samplerate=target_sr, subtype=subtype
+                )
             except Exception as e:
                 # print(e)
                 with open(
@@ -112,65 +121,171 @@ def ground_truth_estimates(
                 ) as f:
                     f.write(e, event_out_path + "\n")
 
-            other_idx = [k for k in range(len(anns))]
-            other_idx.pop(i)
             overlap_idx = 1
-            for j in other_idx:
-                if (
-                    (start_time < start_times[j] < end_time)
-                    or (start_time < end_times[j] < end_time)
-                    or ((start_times[j] < start_time) and (end_times[j] > end_time))
-                ):
-                    overlap_idx += 1
-                    event_wav = event_audio_list[j][
-                        int(start_time * target_sr) : int(end_time * target_sr)
-                    ]
-                    if label_in_file_name:
-                        event_out_path = clip_basepath + f"_{labels[j]}.wav"
-                    else:
-                        event_out_path = clip_basepath + f"_{overlap_idx}.wav"
-                    try:
-                        sf.write(event_out_path, event_wav, samplerate=target_sr)
-                    except Exception as e:
-                        with open(
-                            f"/home/s/ss645/mlos/out/ost-clean-gt/{openness}.{fold}.{split}.txt",
-                            "a",
-                        ) as f:
-                            f.write(e, event_out_path + "\n")
+            for j in overlapping_events(
+                start_time, end_time, start_times, end_times, i
+            ):
+                overlap_idx += 1
+                event_wav = event_audio_list[j][
+                    int(start_time * target_sr) : int(end_time * target_sr)
+                ]
+                if label_in_file_name:
+                    event_out_path = clip_basepath + f"_{labels[j]}.wav"
+                else:
+                    event_out_path = clip_basepath + f"_{overlap_idx}.wav"
+                try:
+                    sf.write(
+                        event_out_path, event_wav, samplerate=target_sr, subtype=subtype
+                    )
+                except Exception as e:
+                    with open(
+                        f"/home/s/ss645/mlos/out/ost-clean-gt/{openness}.{fold}.{split}.txt",
+                        "a",
+                    ) as f:
+                        f.write(e, event_out_path + "\n")
 
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument("-o", "--openness", help="\{high, low\}")
-    parser.add_argument("-f", "--variant", help="variant\{1,2,..,5\}")
-    parser.add_argument("-s", "--split", help="\{train, val, test\}")
-    args = parser.parse_args()
+def add_arguments(parser):
+    parser.add_argument(
+        "-o", "--openness", type=str, required=True, help="\{high, low\}"
+    )
+    parser.add_argument(
+        "-v", "-f", "--variant", type=str, required=True, help="variant\{1,2,..,5\}"
+    )
+    parser.add_argument(
+        "-s", "--split", type=str, required=True, help="\{train, val, test\}"
+    )
+    parser.add_argument(
+        "-p",
+        "--osspath",
+        type=str,
+        required=True,
+        help="path to base directory with openness, dataset variants, and splits",
+    )
+    parser.add_argument(
+        "--jamid",
+        type=str,
+        required=False,
+        help="Name of jams dataset, e.g. oss-clean",
+        default="oss-clean",
+    )
+    parser.add_argument(
+        "--outid",
+        type=str,
+        required=False,
+        help="Name of ground truth dataset, e.g. ost-clean-gt",
+        default="ost-clean-gt",
+    )
+    parser.add_argument(
+        "--sr",
+        type=int,
+        required=False,
+        help="sample rate of output wav files",
+        default=16_000,
+    )
+    parser.add_argument(
+        "--nolabel",
+        dest="label_in_file_name",
+        action="store_false",
+        help="name event files by overlap index instead of label",
+    )
+    parser.add_argument(
+        "--fgpath",
+        type=str,
+        required=False,
+        help="path to foreground source files, defaults to the path in the jams files",
+        default=None,
+    )
+    parser.add_argument(
+        "--atsr",
+        action="store_true",
+        help="render directly at --sr, --fgpath must hold sources resampled to --sr",
+    )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        required=False,
+        choices=RENDER_BACKENDS,
+        help="pitch shift and time stretch backend, sox or in process",
+        default="sox",
+    )
+    parser.add_argument(
+        "--dtype",
+        type=str,
+        required=False,
+        choices=DTYPES,
+        help="working dtype of the rendered audio",
+        default=WORK_DTYPE,
+    )
+    parser.add_argument(
+        "--subtype",
+        type=str,
+        required=False,
+        choices=SUBTYPES,
+        help="sample format of the output wav files",
+        default="PCM_16",
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        required=False,
+        help="directory of the render cache, shared by runs on the same jams files",
+        default=None,
+    )
+    parser.add_argument(
+        "--cachesize",
+        type=str,
+        required=False,
+        help="size of the render cache, e.g. 50G",
+        default="50G",
+    )
+
+    return parser
 
-    with open("tag.yml", "r") as f:
-        config = yaml.safe_load(f)
-    print(config)
 
-    # file_list = get_failed_jams(args.openness, args.fold, args.split)
+def parse_args():
+    return add_arguments(argparse.ArgumentParser()).parse_args()
+
+
+def main(args=None):
+    from dataset.scheduler import parse_memory
+
+    if args is None:
+        args = parse_args()
+    print(args)
+
+    # file_list = get_failed_jams(args.openness, args.variant, args.split)
     # if len(file_list) == 0:
     #     print("This split has no pending files, exiting now")
     # else:
     #     assert all([path.isfile(file) for file in file_list])
 
     start_time = time.time()
-    split_dir = path.join(config["jams_dir"], args.openness, args.fold, args.split)
+    split_dir = path.join(args.osspath, args.openness, args.variant, args.split)
     print(split_dir)
     paths = [str(path) for path in Path(split_dir).rglob("*.jams")]
     print(
-        f"Generating from {len(paths)} jams files for {args.openness}, {args.fold}, {args.split}"
+        f"Generating from {len(paths)} jams files for {args.openness}, {args.variant}, {args.split}"
     )
     ground_truth_estimates(
         paths,
         split_dir,
-        config["sr"],
-        config["label_in_file_name"],
-        config["out_dir_id"],
-        config["jams_dir_id"],
+        args.sr,
+        args.label_in_file_name,
+        args.outid,
+        args.jamid,
+        fg_path=args.fgpath,
+        render_at_target_sr=args.atsr,
+        backend=args.backend,
+        dtype=args.dtype,
+        subtype=args.subtype,
+        cache_dir=args.cache,
+        cache_bytes=parse_memory(args.cachesize),
     )
     split_time = time.time() - start_time
     print(f"Generated the split in {split_time} s")
     print("-------------------------------------------------")
+
+
+if __name__ == "__main__":
+    main()
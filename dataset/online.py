@@ -0,0 +1,484 @@
+import multiprocessing
+import traceback
+from os.path import join, dirname
+import numpy as np
+import yaml
+
+from dataset.generate_ost import ost_window, overlapping_events
+
+N_CLASSES = 89
+
+
+def worker_seed(seed, epoch, worker_id):
+    # Independent seed of one worker in one epoch
+    return int(np.random.SeedSequence([seed, epoch, worker_id]).generate_state(1)[0])
+
+
+def make_scaper(fg_path, bg_path, config, random_state):
+    # Scaper object set up as in generate_oss
+    import scaper
+
+    sc = scaper.Scaper(
+        duration=int(config["duration"]),
+        fg_path=fg_path,
+        bg_path=bg_path,
+        random_state=random_state,
+    )
+    sc.sr = int(config["sr"])
+    sc.n_channels = int(config["n_channels"])
+    sc.ref_db = float(config["ref_db"])
+    return sc
+
+
+def sample_soundscape(
+    sc,
+    split_paths,
+    split_source_counts,
+    config,
+    labels=None,
+    allowed_combos=None,
+    rng=None,
+):
+    """
+    Draw one soundscape and return its scaper annotation, without writing it
+
+    Events are added with create_soundscape (OSS), or with oss_tiny_soundscape
+    (OSS-tiny) if labels is given, then instantiated as generate_without_audio
+    does. Draws from rng and sc.random_state.
+
+    Params
+    -------
+    sc: Scaper object
+    split_paths, split_source_counts: sources and class counts of the split
+    config: OSS config, see oss.yml
+    labels, allowed_combos: labels and combinations of oss_tiny_soundscape
+    rng: np.random.RandomState of the event draws, the global np.random if None
+
+    Returns
+    -------
+    scaper namespace annotation, with sandbox.scaper as a dict
+    """
+    from dataset.soundscape_generation import create_soundscape, oss_tiny_soundscape
+
+    event_args = dict(
+        snr_min=float(config["clean_snr"]),
+        snr_max=float(config["clean_snr"]),
+        add_bg=bool(config["add_bg"]),
+        rng=rng,
+    )
+    if labels is None:
+        sc = create_soundscape(sc, split_paths, split_source_counts, **event_args)
+    else:
+        sc, _ = oss_tiny_soundscape(
+            sc, split_paths, labels, allowed_combos, **event_args
+        )
+
+    jam = sc._instantiate(
+        allow_repeated_label=False,
+        allow_repeated_source=False,
+        reverb=0,
+        disable_instantiation_warnings=True,
+    )
+    ann = jam.annotations.search(namespace="scaper")[0]
+    ann.sandbox.scaper = dict(vars(ann.sandbox.scaper), fix_clipping=True)
+    return ann
+
+
+def soundscape_clips(ann, soundscape_audio, sr, n_classes=N_CLASSES):
+    """
+    Cut the OST clips of a rendered soundscape
+
+    One 1 s clip per foreground event, windowed and labelled as in create_tag.
+
+    Params
+    -------
+    ann: scaper namespace annotation
+    soundscape_audio: (n_samples, n_channels) soundscape at sr
+    sr: sample rate
+
+    Returns
+    -------
+    clips: (n_events, sr) float32 array
+    targets: (n_events, n_classes) multi-hot float32 array
+    """
+    events = [obs for obs in ann.data if obs.value["role"] == "foreground"]
+    labels = [int(obs.value["label"]) for obs in events]
+    start_times = [obs.time for obs in events]
+    end_times = [obs.time + obs.duration for obs in events]
+    duration = ann.sandbox.scaper["duration"]
+    audio = soundscape_audio.mean(axis=1)
+
+    clips = np.zeros((len(events), sr), dtype=np.float32)
+    targets = np.zeros((len(events), n_classes), dtype=np.float32)
+    for i in range(len(events)):
+        window_start = ost_window(start_times[i], end_times[i], duration)
+        sample_start = int(window_start * sr)
+        clip = audio[sample_start : sample_start + sr]
+        clips[i, : len(clip)] = clip
+        for j in [i] + overlapping_events(
+            window_start, window_start + 1, start_times, end_times, i
+        ):
+            targets[i, labels[j]] = 1
+
+    return clips, targets
+
+
+def render_soundscapes(params, source_bank, seed, n_soundscapes=None):
+    # Draw and render n_soundscapes (forever if None) from seed, yields the clips
+    # and targets of each soundscape
+    import itertools
+    from dataset.augmentation import BACKENDS
+    from dataset.render import render_in_process
+
+    rng = np.random.RandomState(seed)
+    sc = make_scaper(params["fg_path"], params["bg_path"], params["config"], seed)
+    transform = BACKENDS[params["backend"]]
+    counter = itertools.count() if n_soundscapes is None else range(n_soundscapes)
+    for _ in counter:
+        ann = sample_soundscape(
+            sc,
+            params["split_paths"],
+            params["split_source_counts"],
+            params["config"],
+            params["labels"],
+            params["allowed_combos"],
+            rng,
+        )
+        soundscape_audio, _ = render_in_process(
+            ann, params["target_sr"], transform, source_bank
+        )
+        yield soundscape_clips(ann, soundscape_audio, params["target_sr"])
+
+
+def _sample_worker(params, source_bank, seed, n_soundscapes, out_queue):
+    # Put the output of render_soundscapes in out_queue, followed by None, or by
+    # the traceback if an exception is raised
+    try:
+        for item in render_soundscapes(params, source_bank, seed, n_soundscapes):
+            out_queue.put(item)
+        out_queue.put(None)
+    except Exception:
+        out_queue.put(traceback.format_exc())
+
+
+class OnlineOST:
+    """
+    Iterable of batches of OST clips synthesised on the fly
+
+    Soundscapes of one split of an OSS variant are drawn as generate_oss draws
+    them, rendered in memory from a source bank resampled to target_sr, and cut
+    into OST clips as create_tag cuts them, so that nothing is written to disk.
+    Each epoch, worker w draws its soundscapes from worker_seed(seed, epoch, w),
+    and batches are assembled from the workers in turn, so an epoch is
+    reproducible for a given seed, number of workers and batch size. Call
+    set_epoch before each epoch to draw new soundscapes.
+
+    Rendering uses an in-process backend (see augmentation.py) and the sources
+    resampled to target_sr, so clips are close to, not identical with, OST
+    rendered from the same JAMS files. The class balanced soundscapes that
+    generate_oss draws first (min_examples_per_class) are not drawn separately.
+
+    Params
+    -------
+    fg_path: path to foreground source files
+    split: train, val or test
+    variant_id: dataset variant number (1-5)
+    openness: high or low
+    bg_path: path to background files, defaults to fg_path, OSS has no background
+    config: path to the OSS config file
+    target_sr: sample rate of the clips
+    backend: in-process augmentation backend
+    n_soundscapes: soundscapes per epoch, unlimited if None
+    batch_size: clips per batch
+    n_workers: number of rendering processes, 0 to render in this process
+    prefetch: soundscapes rendered ahead per worker
+    shuffle_buffer: clips to shuffle batches from, 0 to keep the clips in order
+    seed: base seed of the workers, defaults to SEED
+    labels, allowed_combos: draw OSS-tiny soundscapes with oss_tiny_soundscape
+
+    Yields
+    -------
+    clips: (batch_size, target_sr) float32 array
+    targets: (batch_size, 89) multi-hot float32 array
+    """
+
+    def __init__(
+        self,
+        fg_path,
+        split="train",
+        variant_id=1,
+        openness="low",
+        bg_path=None,
+        config=join(dirname(__file__), "oss.yml"),
+        target_sr=16_000,
+        backend="wsola",
+        n_soundscapes=None,
+        batch_size=64,
+        n_workers=4,
+        prefetch=8,
+        shuffle_buffer=1024,
+        seed=None,
+        labels=None,
+        allowed_combos=None,
+    ):
+        from dataset.data_utils import list_source_paths
+        from dataset.generate_oss import get_split_sources, get_vocab_idx
+        from dataset.soundscape_generation import SEED
+
+        with open(config, "r") as f:
+            self.config = yaml.safe_load(f)
+        source_paths = list_source_paths(fg_path)
+        split_paths, split_source_counts, _ = get_split_sources(
+            source_paths, get_vocab_idx(), variant_id, openness, self.config
+        )[split]
+
+        self.params = dict(
+            fg_path=fg_path,
+            bg_path=fg_path if bg_path is None else bg_path,
+            config=self.config,
+            target_sr=target_sr,
+            backend=backend,
+            split_paths=split_paths,
+            split_source_counts=split_source_counts,
+            labels=labels,
+            allowed_combos=allowed_combos,
+        )
+        self.n_soundscapes = n_soundscapes
+        self.batch_size = batch_size
+        self.n_workers = n_workers
+        self.prefetch = prefetch
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = SEED if seed is None else seed
+        self.epoch = 0
+        self.source_bank = None
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def load_source_bank(self):
+        # Sources of the split in memory at target_sr, loaded once and shared
+        # with the forked workers
+        from dataset.render import load_source_bank
+
+        if self.source_bank is None:
+            self.source_bank = load_source_bank(
+                self.params["split_paths"], sr=self.params["target_sr"]
+            )
+        return self.source_bank
+
+    def soundscapes(self):
+        # Clips and targets of each soundscape of the epoch, from the workers in turn
+        source_bank = self.load_source_bank()
+        n_workers = max(self.n_workers, 1)
+        counts = [None] * n_workers
+        if self.n_soundscapes is not None:
+            counts = [
+                self.n_soundscapes // n_workers + (w < self.n_soundscapes % n_workers)
+                for w in range(n_workers)
+            ]
+        seeds = [worker_seed(self.seed, self.epoch, w) for w in range(n_workers)]
+
+        if self.n_workers == 0:
+            yield from render_soundscapes(self.params, source_bank, seeds[0], counts[0])
+            return
+
+        ctx = multiprocessing.get_context(
+            "fork" if "fork" in multiprocessing.get_all_start_methods() else None
+        )
+        queues = [ctx.Queue(self.prefetch) for _ in range(n_workers)]
+        workers = [
+            ctx.Process(
+                target=_sample_worker,
+                args=(self.params, source_bank, seeds[w], counts[w], queues[w]),
+                daemon=True,
+            )
+            for w in range(n_workers)
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            yield from _drain(queues)
+        finally:
+            for worker in workers:
+                worker.terminate()
+                worker.join()
+
+    def __iter__(self):
+        import collections
+
+        rng = np.random.default_rng(
+            worker_seed(self.seed, self.epoch, max(self.n_workers, 1))
+        )
+        # clips in order, taken from the left, or a shuffle buffer
+        buffer = [] if self.shuffle_buffer else collections.deque()
+        batch_rng = rng if self.shuffle_buffer else None
+        for clips, targets in self.soundscapes():
+            buffer.extend(zip(clips, targets))
+            while len(buffer) >= max(self.shuffle_buffer, self.batch_size):
+                yield _take_batch(buffer, self.batch_size, batch_rng)
+
+        # last, possibly smaller, batches
+        while buffer:
+            yield _take_batch(buffer, min(self.batch_size, len(buffer)), batch_rng)
+
+
+def _take_batch(buffer, batch_size, rng=None):
+    # Remove batch_size (clip, target) pairs from buffer and stack them. With rng,
+    # pairs are drawn uniformly and each is replaced by the last pair of the
+    # buffer list, else they are the first pairs of the buffer deque
+    if rng is None:
+        batch = [buffer.popleft() for _ in range(batch_size)]
+    else:
+        batch = []
+        for i in rng.integers(len(buffer) - np.arange(batch_size)):
+            buffer[i], buffer[-1] = buffer[-1], buffer[i]
+            batch.append(buffer.pop())
+    clips, targets = zip(*batch)
+    return np.stack(clips), np.stack(targets)
+
+
+def _drain(queues):
+    # Take items from the queues in turn until every queue has ended with None
+    queues = list(queues)
+    while queues:
+        for out_queue in list(queues):
+            item = out_queue.get()
+            if item is None:
+                queues.remove(out_queue)
+            elif isinstance(item, str):
+                raise RuntimeError(f"Soundscape worker failed:\n{item}")
+            else:
+                yield item
+
+
+class LazyOST:
+    """
+    Random access to the OST clips of a directory of OSS JAMS files
+
+    Clip k is the k-th row of the annotation file create_tag writes for the same
+    directory: its soundscape is loaded or rendered on demand with
+    load_soundscape, and cut and labelled as in create_tag. Recently used
+    soundscapes are kept in an LRU cache of cache_size renders, so that the
+    clips of one soundscape (see soundscape_order) share a single render.
+
+    Params
+    -------
+    split_dir: path to directory with jams files
+    target_sr: sample rate of the clips
+    fg_path, render_at_target_sr, backend: as in create_tag
+    paths: jams files, defaults to all jams files in split_dir in create_tag order
+    cache_size: number of rendered soundscapes to keep
+    n_jobs: number of processes to read the jams files with
+
+    Returns (of __getitem__)
+    -------
+    clip: (target_sr,) float32 array
+    target: (89,) multi-hot float32 array
+    """
+
+    def __init__(
+        self,
+        split_dir,
+        target_sr=16_000,
+        fg_path=None,
+        render_at_target_sr=False,
+        backend="sox",
+        paths=None,
+        cache_size=16,
+        n_jobs=1,
+    ):
+        import collections
+        from pathlib import Path
+        from dataset.jams_reader import read_scaper_annotations
+
+        if paths is None:
+            paths = [str(path) for path in Path(split_dir).rglob("*.jams")]
+        self.paths = paths
+        self.target_sr = target_sr
+        # cached soundscapes are rendered and kept in float32
+        self.render_args = (fg_path, render_at_target_sr, backend, "float32")
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()
+
+        # one row per clip: soundscape, event, window start and labels
+        events = read_scaper_annotations(paths, n_jobs=n_jobs)
+        self.file_idx = events["file_idx"]
+        self.event_idx = (
+            np.arange(len(self.file_idx)) - events["offsets"][self.file_idx]
+        )
+        self.window_start = np.zeros(len(self.file_idx))
+        self.labels = []
+        end_time = events["time"] + events["duration"]
+        for k, (start, stop) in enumerate(
+            zip(events["offsets"][:-1], events["offsets"][1:])
+        ):
+            start_times = events["time"][start:stop].tolist()
+            end_times = end_time[start:stop].tolist()
+            for i in range(stop - start):
+                window_start = ost_window(
+                    start_times[i], end_times[i], events["soundscape_duration"][k]
+                )
+                self.window_start[start + i] = window_start
+                self.labels.append(
+                    [events["label"][start + i]]
+                    + [
+                        events["label"][start + j]
+                        for j in overlapping_events(
+                            window_start, window_start + 1, start_times, end_times, i
+                        )
+                    ]
+                )
+
+    def __len__(self):
+        return len(self.file_idx)
+
+    def soundscape(self, file_idx):
+        # Audio of soundscape file_idx, from the cache if recently used
+        if file_idx in self.cache:
+            self.cache.move_to_end(file_idx)
+            return self.cache[file_idx]
+
+        from dataset.generate_ost import load_soundscape
+
+        audio = load_soundscape(self.paths[file_idx], self.target_sr, *self.render_args)
+        if audio.ndim == 2:
+            audio = audio.mean(axis=1)
+        self.cache[file_idx] = audio
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return audio
+
+    def __getitem__(self, k):
+        audio = self.soundscape(int(self.file_idx[k]))
+        sample_start = int(self.window_start[k] * self.target_sr)
+        clip = np.zeros(self.target_sr, dtype=np.float32)
+        excerpt = audio[sample_start : sample_start + self.target_sr]
+        clip[: len(excerpt)] = excerpt
+
+        target = np.zeros(N_CLASSES, dtype=np.float32)
+        target[[int(label) for label in self.labels[k]]] = 1
+
+        return clip, target
+
+    def soundscape_order(self, shuffle=True, seed=None):
+        """
+        Clip indices with the clips of each soundscape next to each other
+
+        Iterating in this order renders every soundscape once with cache_size 1.
+        With shuffle, soundscapes and the clips within them are shuffled.
+        """
+        rng = np.random.default_rng(seed)
+        order = rng.permutation(len(self.paths)) if shuffle else range(len(self.paths))
+        clips = np.argsort(self.file_idx, kind="stable")
+        offsets = np.searchsorted(self.file_idx[clips], np.arange(len(self.paths) + 1))
+        return np.concatenate(
+            [
+                (
+                    rng.permutation(clips[offsets[f] : offsets[f + 1]])
+                    if shuffle
+                    else clips[offsets[f] : offsets[f + 1]]
+                )
+                for f in order
+            ]
+            + [np.zeros(0, dtype=int)]
+        )
@@ -0,0 +1,218 @@
+import json
+import os
+from os.path import join, dirname
+import numpy as np
+
+VOCABULARY_DIR = join(dirname(dirname(os.path.abspath(__file__))), "vocabulary")
+ONTOLOGY_PATH = join(VOCABULARY_DIR, "audioset-ontology.json")
+VOCAB_PATH = join(VOCABULARY_DIR, "vocab.json")
+INDEX_PATH = join(VOCABULARY_DIR, "audioset-ontology.npz")
+
+
+def normalise_name(name):
+    # vocab.json and the ontology name classes differently, e.g.
+    # Dishes_and_pots_and_pans and "Dishes, pots, and pans"
+    name = name.lower().replace("_", " ").replace(",", " ")
+    return " ".join(word for word in name.split() if word != "and")
+
+
+def compile_ontology(
+    ontology_path=ONTOLOGY_PATH, vocab_path=VOCAB_PATH, out_path=INDEX_PATH
+):
+    """
+    Compile the AudioSet ontology into arrays and save them
+
+    Params
+    -------
+    ontology_path: AudioSet ontology json file, a list of classes with child_ids
+    vocab_path: json list of the dataset class names, in label order
+    out_path: .npz file to save the index to, not saved if None
+
+    Returns
+    -------
+    index: dict of
+        ids, names: (n_classes,) ontology class ids and names
+        ancestors: (n_classes, n_words) uint64 bitsets, bit j of row i set if
+            class j is an ancestor of class i (excluding i itself)
+        depth: (n_classes,) length of the shortest path from a top-level class
+        vocab: (n_vocab,) dataset class names
+        vocab_idx: (n_vocab,) ontology index of each dataset class
+    """
+    with open(ontology_path, "r") as f:
+        ontology = json.load(f)
+    with open(vocab_path, "r") as f:
+        vocab = json.load(f)
+
+    ids = [c["id"] for c in ontology]
+    id_to_idx = {class_id: i for i, class_id in enumerate(ids)}
+    parents = [[] for _ in ids]
+    for i, c in enumerate(ontology):
+        for child_id in c["child_ids"]:
+            parents[id_to_idx[child_id]].append(i)
+
+    # ancestor closure, the ontology is a DAG with a few classes of two parents
+    closure = np.zeros((len(ids), len(ids)), dtype=bool)
+    depth = np.full(len(ids), -1)
+
+    def visit(i):
+        if depth[i] >= 0:
+            return
+        depth[i] = 0
+        for p in parents[i]:
+            visit(p)
+            closure[i] |= closure[p]
+            closure[i, p] = True
+        if parents[i]:
+            depth[i] = 1 + min(depth[p] for p in parents[i])
+
+    for i in range(len(ids)):
+        visit(i)
+
+    name_to_idx = {normalise_name(c["name"]): i for i, c in enumerate(ontology)}
+    missing = [name for name in vocab if normalise_name(name) not in name_to_idx]
+    if missing:
+        raise ValueError(f"Classes not found in the ontology: {missing}")
+
+    index = dict(
+        ids=np.array(ids),
+        names=np.array([c["name"] for c in ontology]),
+        ancestors=pack_bits(closure),
+        depth=depth,
+        vocab=np.array(vocab),
+        vocab_idx=np.array([name_to_idx[normalise_name(name)] for name in vocab]),
+    )
+    if out_path is not None:
+        np.savez(out_path, **index)
+
+    return index
+
+
+def load_ontology(
+    index_path=INDEX_PATH, ontology_path=ONTOLOGY_PATH, vocab_path=VOCAB_PATH
+):
+    """
+    Load the compiled ontology, compiling it first if it is missing or older than
+    the json files
+
+    Returns
+    -------
+    index: dict of compile_ontology, plus the maps id_to_idx and name_to_idx
+    """
+    if not os.path.isfile(index_path) or os.path.getmtime(index_path) < max(
+        os.path.getmtime(ontology_path), os.path.getmtime(vocab_path)
+    ):
+        index = compile_ontology(ontology_path, vocab_path, index_path)
+    else:
+        with np.load(index_path) as f:
+            index = dict(f)
+
+    index["id_to_idx"] = {class_id: i for i, class_id in enumerate(index["ids"])}
+    index["name_to_idx"] = {name: i for i, name in enumerate(index["names"])}
+    return index
+
+
+def pack_bits(matrix):
+    # (n, m) bool matrix -> (n, ceil(m / 64)) uint64 bitsets, bit j in word j // 64
+    n_words = -(-matrix.shape[1] // 64)
+    padded = np.zeros((matrix.shape[0], n_words * 64), dtype=bool)
+    padded[:, : matrix.shape[1]] = matrix
+    return np.packbits(padded, axis=1, bitorder="little").view("<u8")
+
+
+def unpack_bits(bitsets, n_bits):
+    # Inverse of pack_bits
+    packed = np.ascontiguousarray(bitsets).view(np.uint8)
+    return np.unpackbits(packed, axis=-1, bitorder="little")[..., :n_bits].astype(bool)
+
+
+def vocab_ancestors(index, include_self=True):
+    """
+    (n_vocab, n_classes) bool matrix of the ancestors of each dataset class
+    """
+    matrix = unpack_bits(index["ancestors"][index["vocab_idx"]], len(index["ids"]))
+    if include_self:
+        matrix[np.arange(len(index["vocab_idx"])), index["vocab_idx"]] = True
+    return matrix
+
+
+def labels_to_multi_hot(label_lists, n_vocab=89):
+    """
+    (n_clips, n_vocab) bool matrix of lists of labels, e.g. the label column of an
+    OST annotation file
+    """
+    lengths = [len(labels) for labels in label_lists]
+    rows = np.repeat(np.arange(len(label_lists)), lengths)
+    cols = np.array(
+        [int(label) for labels in label_lists for label in labels], dtype=int
+    )
+    multi_hot = np.zeros((len(label_lists), n_vocab), dtype=bool)
+    multi_hot[rows, cols] = True
+    return multi_hot
+
+
+def expand_to_ancestors(
+    multi_hot, index, include_self=True, packed=False, chunk_size=65_536
+):
+    """
+    Expand dataset labels to all their ontology ancestors
+
+    Params
+    -------
+    multi_hot: (n_clips, n_vocab) multi-hot matrix of dataset labels
+    index: compiled ontology, see load_ontology
+    include_self: if True, the labels themselves are kept, at their ontology index
+    packed: if True, return uint64 bitsets as in pack_bits instead of bools
+    chunk_size: clips expanded at once, bounds the memory used
+
+    Returns
+    -------
+    (n_clips, n_classes) bool matrix, or (n_clips, n_words) uint64 if packed
+    """
+    ancestors = vocab_ancestors(index, include_self).astype(np.float32)
+    chunks = []
+    for start in range(0, len(multi_hot), chunk_size):
+        chunk = np.asarray(multi_hot[start : start + chunk_size], dtype=np.float32)
+        expanded = chunk @ ancestors > 0
+        chunks.append(pack_bits(expanded) if packed else expanded)
+    if not chunks:
+        n_columns = index["ancestors"].shape[1] if packed else len(index["ids"])
+        return np.zeros((0, n_columns), dtype=np.uint64 if packed else bool)
+    return np.concatenate(chunks)
+
+
+def share_ancestor(index, a, b, min_depth=0):
+    """
+    Whether dataset classes a and b have a common ontology ancestor
+
+    Params
+    -------
+    a, b: dataset class indices, arrays of the same (or broadcastable) shape
+    min_depth: only count ancestors at least this deep, 1 to ignore the top-level
+        classes such as Human sounds or Sounds of things
+
+    Returns
+    -------
+    bool array of the broadcast shape of a and b
+    """
+    ancestors = index["ancestors"]
+    if min_depth > 0:
+        ancestors = ancestors & pack_bits(index["depth"][None, :] >= min_depth)
+    ancestors = ancestors[index["vocab_idx"]]
+    a, b = np.asarray(a), np.asarray(b)
+    return (ancestors[a] & ancestors[b]).any(axis=-1)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ontology", type=str, default=ONTOLOGY_PATH)
+    parser.add_argument("--vocab", type=str, default=VOCAB_PATH)
+    parser.add_argument("--out", type=str, default=INDEX_PATH)
+    args = parser.parse_args()
+
+    index = compile_ontology(args.ontology, args.vocab, args.out)
+    print(
+        f"Compiled {len(index['ids'])} classes and {len(index['vocab'])} dataset "
+        f"classes to {args.out}"
+    )
@@ -0,0 +1,284 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from os.path import join
+from pathlib import Path
+import numpy as np
+
+from dataset.render import WORK_DTYPE
+
+SPLITS = ["train", "val", "test"]
+
+
+def _render_stage(kind, scratch, split_dir, target_sr, backend, dtype, windows):
+    # Run OST or ground truth generation on split_dir, relative to scratch, in
+    # this (fresh) process. create_tag and ground_truth_estimates derive their
+    # output paths by replacing oss and jams in split_dir, so working in scratch
+    # keeps its own path out of the replacement
+    # Returns : seconds and peak RSS in bytes of the process
+    import resource
+    from dataset.generate_ost import create_tag
+    from dataset.ground_truth_estimates import ground_truth_estimates
+
+    os.chdir(scratch)
+    start_time = time.perf_counter()
+    if kind == "ost":
+        create_tag(
+            split_dir,
+            True,
+            target_sr,
+            "ost",
+            "oss",
+            backend=backend,
+            dtype=dtype,
+            windows=windows,
+        )
+    else:
+        ground_truth_estimates(
+            sorted(str(path) for path in Path(split_dir).rglob("*.jams")),
+            split_dir,
+            target_sr,
+            True,
+            "ost-gt",
+            "oss",
+            backend=backend,
+            dtype=dtype,
+        )
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return time.perf_counter() - start_time, peak_rss
+
+
+def _tree_size(path, pattern):
+    # Number and total size of the files matching pattern under path
+    sizes = [p.stat().st_size for p in Path(path).rglob(pattern)]
+    return len(sizes), sum(sizes)
+
+
+def plan_build(
+    fg_path,
+    bg_path,
+    config,
+    openness="low",
+    n_variants=5,
+    n_samples=200,
+    target_sr=16_000,
+    backend="sox",
+    dtype=WORK_DTYPE,
+    windows=None,
+    n_workers=1,
+    scratch_path=None,
+):
+    """
+    Estimate the resources of an OSS build and of its OST and ground truth
+
+    Samples n_samples soundscapes of variant 1, spread over the splits in
+    proportion to their size in config, with the code of generate_oss.py. Then
+    runs create_tag and ground_truth_estimates on them, each in a fresh worker
+    process as the scheduler does, and extrapolates to the n_variants variants.
+    The event draws use their own RandomState, the global np.random is left as is.
+
+    Params
+    -------
+    fg_path, bg_path: source directories, as for generate_oss.py. bg_path may
+        be None if config does not add backgrounds
+    config: OSS config dict, see oss.yml
+    openness, n_variants: as for generate_oss.py
+    n_samples: number of sampled soundscapes
+    target_sr, backend, dtype, windows: OST and ground truth settings
+    n_workers: number of OST and ground truth workers to estimate wall time for
+    scratch_path: directory for the samples, a temporary directory if None
+
+    Returns
+    -------
+    plan: dict of the sampled measurements and the extrapolated counts, sizes,
+    peak RSS per worker and times
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    import scaper
+    from dataset.augmentation import check_backend
+    from dataset.data_utils import list_source_paths
+    from dataset.generate_oss import generate_split, get_split_sources, get_vocab_idx
+    from dataset.soundscape_generation import SEED
+
+    check_backend(backend)
+    if bg_path is None and config["add_bg"]:
+        raise ValueError("bg_path is required when config adds backgrounds")
+    # the JAMS keep the source paths, which the workers read from scratch
+    fg_path = os.path.abspath(fg_path)
+    bg_path = None if bg_path is None else os.path.abspath(bg_path)
+
+    n_split = {split: int(config[f"n_{split}_soundscapes"]) for split in SPLITS}
+    n_total = sum(n_split.values())
+    n_sample_split = {
+        split: max(1, round(n_samples * n / n_total)) for split, n in n_split.items()
+    }
+
+    source_paths = list_source_paths(fg_path)
+    catalog_bytes = sum(os.path.getsize(path) for path in source_paths)
+
+    scratch = tempfile.mkdtemp(prefix="plan-") if scratch_path is None else scratch_path
+    try:
+        # split directories are passed relative to scratch, see _render_stage
+        variant_dir = join("oss", "jams", openness, "variant1")
+        if bg_path is None:
+            bg_path = join(scratch, "background")
+            os.makedirs(bg_path)
+
+        sample_config = dict(config, min_examples_per_class=0)
+        sc = scaper.Scaper(
+            duration=int(config["duration"]),
+            fg_path=fg_path,
+            bg_path=bg_path,
+            random_state=SEED,
+        )
+        sc.sr = int(config["sr"])
+        sc.n_channels = int(config["n_channels"])
+        sc.ref_db = float(config["ref_db"])
+        rng = np.random.RandomState(SEED)
+
+        split_sources = get_split_sources(
+            source_paths, get_vocab_idx(), 1, openness, config
+        )
+        start_time = time.perf_counter()
+        n = 0
+        for split in SPLITS:
+            os.makedirs(join(scratch, variant_dir, split), exist_ok=True)
+            sc = generate_split(
+                sc,
+                n,
+                split,
+                n_sample_split[split],
+                *split_sources[split],
+                join(scratch, variant_dir),
+                sample_config,
+                rng=rng,
+            )
+            n += n_sample_split[split]
+        oss_seconds = (time.perf_counter() - start_time) / n
+
+        stage_seconds = {"ost": 0.0, "gt": 0.0}
+        peak_rss = {"ost": 0, "gt": 0}
+        context = multiprocessing.get_context("spawn")
+        for split in SPLITS:
+            for kind in ["ost", "gt"]:
+                with ProcessPoolExecutor(1, mp_context=context) as pool:
+                    seconds, rss = pool.submit(
+                        _render_stage,
+                        kind,
+                        scratch,
+                        join(variant_dir, split),
+                        target_sr,
+                        backend,
+                        dtype,
+                        windows,
+                    ).result()
+                stage_seconds[kind] += seconds
+                peak_rss[kind] = max(peak_rss[kind], rss)
+
+        sample = {
+            "soundscapes": n,
+            "jams": _tree_size(join(scratch, "oss"), "*.jams"),
+            "ost": _tree_size(join(scratch, "ost"), "*.wav"),
+            "gt": _tree_size(join(scratch, "ost-gt"), "*.wav"),
+            "ost_annotations": _tree_size(join(scratch, "ost"), "*.pkl"),
+        }
+    finally:
+        if scratch_path is None:
+            shutil.rmtree(scratch)
+
+    n_build = n_total * n_variants
+    totals = {
+        kind: {
+            "files": round(sample[kind][0] / n * n_build),
+            "bytes": round(sample[kind][1] / n * n_build),
+        }
+        for kind in ["jams", "ost", "gt"]
+    }
+    # one OST annotation file per window configuration, variant and split
+    totals["ost_annotations"] = {
+        "files": sample["ost_annotations"][0] * n_variants,
+        "bytes": round(sample["ost_annotations"][1] / n * n_build),
+    }
+    worker_seconds = {
+        "oss": oss_seconds * n_build,
+        "ost": stage_seconds["ost"] / n * n_build,
+        "gt": stage_seconds["gt"] / n * n_build,
+    }
+
+    return {
+        "settings": dict(
+            openness=openness,
+            n_variants=n_variants,
+            soundscapes_per_variant=n_split,
+            target_sr=target_sr,
+            backend=backend,
+            dtype=dtype,
+            n_workers=n_workers,
+        ),
+        "sources": {"files": len(source_paths), "bytes": catalog_bytes},
+        "sample": sample,
+        "totals": totals,
+        "peak_rss": peak_rss,
+        "worker_seconds": worker_seconds,
+        # OSS generation is sequential, see the README
+        "wall_seconds": {
+            "oss": worker_seconds["oss"],
+            "ost": worker_seconds["ost"] / n_workers,
+            "gt": worker_seconds["gt"] / n_workers,
+        },
+        "node_memory": n_workers * max(peak_rss.values()),
+    }
+
+
+def _format_bytes(n_bytes):
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if n_bytes < 1024 or unit == "TB":
+            return f"{n_bytes:.1f} {unit}"
+        n_bytes /= 1024
+
+
+def _format_seconds(seconds):
+    return f"{seconds / 3600:.1f} h" if seconds >= 3600 else f"{seconds:.0f} s"
+
+
+def print_plan(plan, json_path=None):
+    settings = plan["settings"]
+    print(
+        f"Plan for {settings['n_variants']} {settings['openness']} openness "
+        f"variants of {sum(settings['soundscapes_per_variant'].values())} "
+        f"soundscapes, from {plan['sample']['soundscapes']} sampled soundscapes"
+    )
+    print(
+        f"Sources: {plan['sources']['files']} files, "
+        f"{_format_bytes(plan['sources']['bytes'])}"
+    )
+    for kind, name in [
+        ("jams", "OSS jams"),
+        ("ost", "OST clips"),
+        ("gt", "Ground truth clips"),
+        ("ost_annotations", "OST annotation files"),
+    ]:
+        total = plan["totals"][kind]
+        print(f"{name}: {total['files']} files, {_format_bytes(total['bytes'])}")
+    for kind, name in [("oss", "OSS jams"), ("ost", "OST"), ("gt", "Ground truth")]:
+        print(
+            f"{name}: {_format_seconds(plan['worker_seconds'][kind])} in one worker, "
+            f"{_format_seconds(plan['wall_seconds'][kind])} wall"
+            + (
+                ""
+                if kind == "oss"
+                else f", peak RSS {_format_bytes(plan['peak_rss'][kind])} per worker"
+            )
+        )
+    print(
+        f"{settings['n_workers']} OST and ground truth workers need "
+        f"{_format_bytes(plan['node_memory'])} of memory"
+    )
+    if json_path is not None:
+        with open(json_path, "w") as f:
+            json.dump(plan, f, indent=1)
+        print(f"Saved plan to {json_path}")
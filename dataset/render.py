@@ -0,0 +1,664 @@
+import argparse
+import os
+from glob import glob
+from os.path import join, basename, dirname
+import numpy as np
+
+from dataset.augmentation import RENDER_BACKENDS, check_backend
+
+# Working dtype of the rendered audio, float64 as the paper's OST was made, and
+# dtypes and wav subtypes to choose from. float32 halves the memory of a worker
+WORK_DTYPE = "float64"
+DTYPES = ["float32", "float64"]
+SUBTYPES = ["PCM_16", "PCM_32", "FLOAT"]
+
+
+def resample_audio(audio, orig_sr, target_sr, axis=0):
+    # audio : array with time along axis, e.g. (n_samples, n_channels)
+    # Returns : audio resampled along axis, same layout
+    import librosa
+
+    if orig_sr == target_sr:
+        return audio
+    resampled = librosa.resample(
+        np.moveaxis(audio, axis, -1), orig_sr=orig_sr, target_sr=target_sr
+    )
+    return np.moveaxis(resampled, -1, axis).astype(audio.dtype, copy=False)
+
+
+def resample_source_bank(source_path, out_path, target_sr, overwrite=False):
+    """
+    Resample every source file of a Scaper source tree once to target_sr
+
+    The output keeps the <label>/<file>.wav layout Scaper needs, so it can be passed
+    as fg_path (or bg_path) to render_from_jams. Files are written as 32-bit float
+    so resampling is the only change to the source audio.
+
+    Params
+    -------
+    source_path: Scaper source directory with one subdirectory per label
+    out_path: directory to write the resampled source tree to
+    target_sr: sample rate of the resampled sources
+    overwrite: if False, skip files that already exist in out_path
+
+    Returns
+    -------
+    number of files resampled
+    """
+    import soundfile as sf
+
+    n_resampled = 0
+    for path in glob(join(source_path, "*/*.wav")):
+        out_file = join(out_path, path.split("/")[-2], basename(path))
+        if os.path.isfile(out_file) and not overwrite:
+            continue
+        os.makedirs(dirname(out_file), exist_ok=True)
+        audio, sr = sf.read(path, always_2d=True)
+        sf.write(out_file, resample_audio(audio, sr, target_sr), target_sr, "FLOAT")
+        n_resampled += 1
+
+    return n_resampled
+
+
+def render_from_jams(
+    jams_path,
+    sr=None,
+    fg_path=None,
+    bg_path=None,
+    disable_sox_warnings=True,
+    backend="sox",
+    dtype=None,
+):
+    """
+    Render a soundscape and its isolated events from a Scaper JAMS file
+
+    Equivalent to scaper.generate_from_jams without writing audio, except that the
+    rendering sample rate can be set. With sr=None the soundscape is rendered at
+    the sample rate stored in the JAMS file. Rendering at a lower sr from a source
+    bank already resampled to sr (see resample_source_bank) avoids rendering at
+    the OSS rate and resampling every mixture afterwards.
+
+    With backend="sox" (default) events are augmented by Scaper itself, through
+    sox. Any other backend is a key of augmentation.BACKENDS and renders the
+    soundscape in process, see render_in_process.
+
+    Params
+    -------
+    jams_path: path to a JAMS file generated by Scaper
+    sr: rendering sample rate, defaults to the sr in the JAMS sandbox
+    fg_path, bg_path: source directories replacing those stored in the JAMS file
+    backend: "sox", or the name of an in-process augmentation backend
+    dtype: dtype of the returned audio, Scaper's float64 if None. In-process
+        backends read and process the sources in this dtype
+
+    Returns
+    -------
+    soundscape_audio: (n_samples, n_channels) array
+    event_audio_list: list of (n_samples, n_channels) arrays, one per event
+    ann: scaper namespace annotation
+    sr: rendering sample rate
+    """
+    import jams
+
+    ann = jams.load(jams_path).annotations.search(namespace="scaper")[0]
+    replace_source_dirs(ann, fg_path, bg_path)
+
+    return render_annotation(ann, sr, disable_sox_warnings, backend, dtype)
+
+
+def render_annotation(
+    ann, sr=None, disable_sox_warnings=True, backend="sox", dtype=None
+):
+    """
+    Render a scaper annotation, see render_from_jams
+
+    Params
+    -------
+    ann: scaper namespace annotation, with sandbox.scaper as a dict
+    sr, disable_sox_warnings, backend, dtype: see render_from_jams
+
+    Returns
+    -------
+    soundscape_audio, event_audio_list, ann, sr: as returned by render_from_jams
+    """
+    import jams
+    import scaper
+
+    sandbox = ann.sandbox.scaper
+
+    sr = sandbox["sr"] if sr is None else sr
+    if backend != "sox":
+        from dataset.augmentation import BACKENDS
+
+        soundscape_audio, event_audio_list = render_in_process(
+            ann, sr, BACKENDS[backend], dtype=dtype or "float64"
+        )
+        return soundscape_audio, event_audio_list, ann, sr
+
+    duration = sandbox.get("original_duration", sandbox["duration"])
+    sc = scaper.Scaper(
+        duration, sandbox["fg_path"], sandbox["bg_path"], sandbox["protected_labels"]
+    )
+    sc.sr = sr
+    sc.ref_db = sandbox["ref_db"]
+    sc.n_channels = sandbox["n_channels"]
+    sc.fade_in_len = sandbox["fade_in_len"]
+    sc.fade_out_len = sandbox["fade_out_len"]
+
+    generation_args = dict(
+        reverb=sandbox["reverb"],
+        fix_clipping=sandbox.get("fix_clipping", False),
+        peak_normalization=sandbox.get("peak_normalization", False),
+        quick_pitch_time=sandbox.get("quick_pitch_time", False),
+        disable_sox_warnings=disable_sox_warnings,
+    )
+    ann.sandbox.scaper = jams.Sandbox(**sandbox)
+    soundscape_audio, event_audio_list, _, _ = sc._generate_audio(
+        None, ann, **generation_args
+    )
+    if dtype is not None:
+        soundscape_audio = soundscape_audio.astype(dtype, copy=False)
+        event_audio_list = [e.astype(dtype, copy=False) for e in event_audio_list]
+
+    return soundscape_audio, event_audio_list, ann, sc.sr
+
+
+def moved_source_file(source_file, new_path):
+    # source_file in the label directory of the source directory new_path
+    return join(
+        os.path.expanduser(new_path), source_file.split("/")[-2], basename(source_file)
+    )
+
+
+def replace_source_dirs(ann, fg_path=None, bg_path=None):
+    # Point the source files of ann to new source directories, as in
+    # scaper.generate_from_jams. Paths that are None are left unchanged
+    sandbox = ann.sandbox.scaper
+    for role, new_path, key in [
+        ("foreground", fg_path, "fg_path"),
+        ("background", bg_path, "bg_path"),
+    ]:
+        if new_path is None:
+            continue
+        for obs in ann.data:
+            if obs.value["role"] == role:
+                obs.value["source_file"] = moved_source_file(
+                    obs.value["source_file"], new_path
+                )
+        sandbox[key] = os.path.expanduser(new_path)
+
+
+def read_excerpt(source_file, source_time, duration, source_bank=None, dtype="float64"):
+    """
+    Read an excerpt of a source file, from disk or from an in-memory source bank
+
+    Params
+    -------
+    source_file: path to the source file
+    source_time, duration: start and length of the excerpt in seconds
+    source_bank: optional dict of source file -> ((n_samples, n_channels) array,
+        sample rate), see load_source_bank
+    dtype: dtype of excerpts read from disk
+
+    Returns
+    -------
+    (n_samples, n_channels) excerpt, its sample rate and the source duration in s
+    """
+    import soundfile as sf
+
+    if source_bank is not None and source_file in source_bank:
+        audio, source_sr = source_bank[source_file]
+        source_duration = len(audio) / source_sr
+    else:
+        info = sf.info(source_file)
+        audio, source_sr, source_duration = None, info.samplerate, info.duration
+    start = int(source_time * source_sr)
+    stop = int((source_time + duration) * source_sr)
+    if audio is None:
+        audio, _ = sf.read(
+            source_file, always_2d=True, start=start, stop=stop, dtype=dtype
+        )
+        return audio, source_sr, source_duration
+    return audio[start:stop], source_sr, source_duration
+
+
+def load_source_bank(source_paths, sr=None, dtype="float32"):
+    """
+    Load source files into memory for render_in_process
+
+    Params
+    -------
+    source_paths: list of source wav files
+    sr: if given, resample the sources to sr, with a polyphase filter that is
+        much faster than the resampling of librosa.load
+    dtype: dtype of the stored audio
+
+    Returns
+    -------
+    dict of source file -> ((n_samples, n_channels) array, sample rate)
+    """
+    import soundfile as sf
+    from dataset.augmentation import resample_ratio
+
+    source_bank = {}
+    for source_path in source_paths:
+        audio, source_sr = sf.read(source_path, always_2d=True, dtype=dtype)
+        if sr is not None and sr != source_sr:
+            audio = resample_ratio(audio, sr / source_sr).astype(dtype)
+            source_sr = sr
+        source_bank[source_path] = (audio, source_sr)
+    return source_bank
+
+
+def render_in_process(ann, sr, transform, source_bank=None, dtype=WORK_DTYPE):
+    """
+    Render a scaper annotation with an in-process augmentation backend
+
+    Follows Scaper's audio generation step by step (source excerpt, augmentation,
+    loudness normalisation to ref_db and the event SNR, fades, padding, clipping
+    fix and peak normalisation), with transform replacing the sox transformer.
+    The mixture reverb that Scaper applies with sox is not reproduced.
+
+    Params
+    -------
+    ann: scaper namespace annotation, with sandbox.scaper as a dict
+    sr: rendering sample rate
+    transform: function(audio, sr_in, sr_out, n_channels, pitch_shift,
+        time_stretch), e.g. from augmentation.BACKENDS
+    source_bank: optional in-memory sources, see read_excerpt
+    dtype: dtype the sources are read and processed in
+
+    Returns
+    -------
+    soundscape_audio, event_audio_list: as returned by Scaper
+    """
+    from scaper.audio import get_integrated_lufs, peak_normalize
+
+    sandbox = ann.sandbox.scaper
+    duration = sandbox.get("original_duration", sandbox["duration"])
+    n_channels = sandbox["n_channels"]
+    duration_in_samples = int(duration * sr)
+
+    event_audio_list = []
+    for e in ann.data:
+        value = e.value
+        event_audio, event_sr, source_duration = read_excerpt(
+            value["source_file"],
+            value["source_time"],
+            value["event_duration"],
+            source_bank,
+            dtype,
+        )
+
+        if value["role"] == "background":
+            ntiles = int(max(duration // source_duration + 1, 1))
+            stop = int((value["source_time"] + value["event_duration"]) * event_sr)
+            event_audio = np.tile(event_audio, (ntiles, 1))[:stop]
+            event_audio = transform(event_audio, event_sr, sr, n_channels)
+            gain = sandbox["ref_db"] - get_integrated_lufs(event_audio, sr)
+            event_audio = event_audio * event_audio.dtype.type(
+                np.exp(gain * np.log(10) / 20)
+            )
+        else:
+            event_audio = transform(
+                event_audio,
+                event_sr,
+                sr,
+                n_channels,
+                value["pitch_shift"],
+                value["time_stretch"],
+            )
+            gain = (
+                sandbox["ref_db"] + value["snr"] - get_integrated_lufs(event_audio, sr)
+            )
+            event_audio = event_audio * event_audio.dtype.type(
+                np.exp(gain * np.log(10) / 20)
+            )
+
+            if sandbox["fade_in_len"] > 0:
+                fade_in_samples = int(sandbox["fade_in_len"] * sr)
+                event_audio[:fade_in_samples] *= np.sin(
+                    np.linspace(0, np.pi / 2, fade_in_samples)
+                )[: len(event_audio), None]
+            if sandbox["fade_out_len"] > 0:
+                fade_out_samples = int(sandbox["fade_out_len"] * sr)
+                event_audio[-fade_out_samples:] *= np.sin(
+                    np.linspace(np.pi / 2, 0, fade_out_samples)
+                )[-len(event_audio) :, None]
+
+            prepad = int(sr * value["event_time"])
+            postpad = max(0, duration_in_samples - (event_audio.shape[0] + prepad))
+            event_audio = np.pad(event_audio, ((prepad, postpad), (0, 0)))
+
+        event_audio_list.append(event_audio[:duration_in_samples])
+
+    soundscape_audio = sum(event_audio_list)
+    clipping = np.max(np.abs(soundscape_audio)) > 1
+    if sandbox.get("peak_normalization", False) or (
+        clipping and sandbox.get("fix_clipping", False)
+    ):
+        soundscape_audio, event_audio_list, _ = peak_normalize(
+            soundscape_audio, event_audio_list
+        )
+
+    return soundscape_audio.reshape(-1, n_channels), event_audio_list
+
+
+def render_at_sr(
+    jams_path,
+    target_sr,
+    fg_path=None,
+    bg_path=None,
+    at_target_sr=False,
+    backend="sox",
+    dtype=WORK_DTYPE,
+    cache_dir=None,
+    cache_bytes=None,
+):
+    """
+    Render a soundscape and its events at target_sr
+
+    If at_target_sr is False (default), render at the sr of the JAMS file and
+    resample the mixture and every event to target_sr, which is how OST was made.
+    If True, render directly at target_sr, fg_path and bg_path should then point
+    to source banks resampled to target_sr. backend is passed to render_from_jams.
+    The audio is cast to dtype as soon as it is rendered, so that resampling runs
+    in dtype too. With a cache_dir, renders and their resampled audio go through
+    the render cache (see render_cache.cached_render), bounded to cache_bytes.
+
+    Returns
+    -------
+    soundscape_audio, event_audio_list, ann: as returned by render_from_jams,
+    ann is None for renders read from the render cache
+    """
+    render_args = dict(
+        sr=target_sr if at_target_sr else None,
+        fg_path=fg_path,
+        bg_path=bg_path,
+        backend=backend,
+        dtype=dtype,
+    )
+    if cache_dir is not None:
+        from dataset.render_cache import DEFAULT_CACHE_BYTES, cached_render
+
+        soundscape_audio, event_audio_list, ann, _ = cached_render(
+            jams_path,
+            cache_dir,
+            DEFAULT_CACHE_BYTES if cache_bytes is None else cache_bytes,
+            target_sr=target_sr,
+            **render_args,
+        )
+        return soundscape_audio, event_audio_list, ann
+
+    soundscape_audio, event_audio_list, ann, sr = render_from_jams(
+        jams_path, **render_args
+    )
+    soundscape_audio, event_audio_list = resample_render(
+        soundscape_audio, event_audio_list, sr, target_sr
+    )
+
+    return soundscape_audio, event_audio_list, ann
+
+
+def resample_render(soundscape_audio, event_audio_list, sr, target_sr):
+    # Resample a mixture and its events from sr to target_sr, as render_at_sr does
+    if sr != target_sr:
+        soundscape_audio = resample_audio(soundscape_audio, sr, target_sr)
+        event_audio_list = list(
+            resample_audio(np.stack(event_audio_list), sr, target_sr, axis=1)
+        )
+    return soundscape_audio, event_audio_list
+
+
+def snr_db(reference, estimate):
+    # Signal to error ratio of estimate with respect to reference, in dB
+    error = np.sum((reference - estimate) ** 2)
+    return 10 * np.log10(np.sum(reference**2) / max(error, 1e-20))
+
+
+def measure_render_deviation(
+    jams_paths, target_sr, resampled_fg_path, fg_path=None, bg_path=None, backend="sox"
+):
+    """
+    Measure how far direct rendering at target_sr deviates from rendering at the
+    JAMS sr and resampling
+
+    Params
+    -------
+    jams_paths: list of JAMS files to render both ways
+    target_sr: sample rate of the compared outputs
+    resampled_fg_path: source bank resampled to target_sr
+    fg_path: original source bank, defaults to the one stored in the JAMS files
+    bg_path: background source bank resampled to target_sr, if any
+    backend: augmentation backend of both renderings, see render_from_jams
+
+    Returns
+    -------
+    dict of arrays with one entry per file: mixture_snr and worst event_snr in dB,
+    worst event_gain_db (level difference of an event) and max_abs_error of the
+    mixture
+    """
+    mixture_snr, event_snr, event_gain_db, max_abs_error = [], [], [], []
+    for jams_path in jams_paths:
+        reference, reference_events, _ = render_at_sr(
+            jams_path, target_sr, fg_path=fg_path, backend=backend
+        )
+        direct, direct_events, _ = render_at_sr(
+            jams_path,
+            target_sr,
+            fg_path=resampled_fg_path,
+            bg_path=bg_path,
+            at_target_sr=True,
+            backend=backend,
+        )
+        mixture_snr.append(snr_db(reference, direct))
+        event_snr.append(
+            min(snr_db(r, d) for r, d in zip(reference_events, direct_events))
+        )
+        event_gain_db.append(
+            max(
+                abs(10 * np.log10(np.sum(d**2) / max(np.sum(r**2), 1e-20)))
+                for r, d in zip(reference_events, direct_events)
+            )
+        )
+        max_abs_error.append(np.max(np.abs(reference - direct)))
+
+    return {
+        "mixture_snr": np.array(mixture_snr),
+        "event_snr": np.array(event_snr),
+        "event_gain_db": np.array(event_gain_db),
+        "max_abs_error": np.array(max_abs_error),
+    }
+
+
+def log_spectral_distance(reference, estimate, n_fft=1024):
+    # Root mean square difference of the dB magnitude spectra, averaged over frames
+    import librosa
+
+    n = max(len(reference), len(estimate))
+    spectra = [
+        20
+        * np.log10(
+            np.abs(librosa.stft(np.pad(x.mean(axis=-1), (0, n - len(x))), n_fft=n_fft))
+            + 1e-5
+        )
+        for x in [reference, estimate]
+    ]
+    active = spectra[0].max(axis=0) > spectra[0].max() - 60
+    return np.mean(np.sqrt(np.mean((spectra[0] - spectra[1]) ** 2, axis=0))[active])
+
+
+def compare_backends(jams_paths, backend, reference="sox", sr=None, fg_path=None):
+    """
+    Compare the events and mixtures rendered by two augmentation backends
+
+    Different time stretch algorithms do not produce sample-aligned outputs, so
+    events are compared by level and by log-spectral distance rather than by SNR.
+
+    Params
+    -------
+    jams_paths: list of JAMS files to render with both backends
+    backend, reference: backend names accepted by render_from_jams
+    sr: rendering sample rate, defaults to the sr in the JAMS files
+    fg_path: source directory, defaults to the path stored in the JAMS files
+
+    Returns
+    -------
+    dict of arrays: per event level_db (backend / reference) and lsd_db, per file
+    mixture_lsd_db, and the render time per file of backend and reference
+    """
+    import time
+
+    check_backend(backend)
+    check_backend(reference)
+    results = {k: [] for k in ["level_db", "lsd_db", "mixture_lsd_db"]}
+    times = {backend: [], reference: []}
+    for jams_path in jams_paths:
+        rendered = {}
+        for name in times:
+            start_time = time.perf_counter()
+            rendered[name] = render_from_jams(
+                jams_path, sr=sr, fg_path=fg_path, backend=name
+            )
+            times[name].append(time.perf_counter() - start_time)
+
+        (mix_ref, events_ref, _, _), (mix, events, _, _) = (
+            rendered[reference],
+            rendered[backend],
+        )
+        for r, e in zip(events_ref, events):
+            results["level_db"].append(
+                10 * np.log10(np.sum(e**2) / max(np.sum(r**2), 1e-20))
+            )
+            results["lsd_db"].append(log_spectral_distance(r, e))
+        results["mixture_lsd_db"].append(log_spectral_distance(mix_ref, mix))
+
+    results = {k: np.array(v) for k, v in results.items()}
+    results[f"{backend}_time"] = np.array(times[backend])
+    results[f"{reference}_time"] = np.array(times[reference])
+    return results
+
+
+def add_arguments(parser):
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    resample = subparsers.add_parser(
+        "resample", help="resample a Scaper source tree once to the target sr"
+    )
+    resample.add_argument(
+        "--fgpath", type=str, required=True, help="path to source files"
+    )
+    resample.add_argument(
+        "--outpath", type=str, required=True, help="path to save resampled sources"
+    )
+    resample.add_argument(
+        "--sr", type=int, required=False, help="target sample rate", default=16_000
+    )
+
+    compare = subparsers.add_parser(
+        "compare",
+        help="measure the deviation of direct rendering at the target sr",
+    )
+    compare.add_argument(
+        "-p", "--jamspath", type=str, required=True, help="directory of jams files"
+    )
+    compare.add_argument(
+        "--fgpath",
+        type=str,
+        required=False,
+        help="path to original source files, defaults to the path in the jams files",
+    )
+    compare.add_argument(
+        "--resampledpath",
+        type=str,
+        required=True,
+        help="path to source files resampled to the target sr",
+    )
+    compare.add_argument(
+        "-n", type=int, required=False, help="number of jams files", default=100
+    )
+    compare.add_argument(
+        "--sr", type=int, required=False, help="target sample rate", default=16_000
+    )
+    compare.add_argument(
+        "--backend",
+        type=str,
+        required=False,
+        choices=RENDER_BACKENDS,
+        help="augmentation backend of both renderings",
+        default="sox",
+    )
+
+    backends = subparsers.add_parser(
+        "backends",
+        help="compare an in-process augmentation backend with sox",
+    )
+    backends.add_argument(
+        "-p", "--jamspath", type=str, required=True, help="directory of jams files"
+    )
+    backends.add_argument(
+        "--backend",
+        type=str,
+        required=False,
+        choices=RENDER_BACKENDS,
+        help="augmentation backend to compare",
+        default="wsola",
+    )
+    backends.add_argument(
+        "--reference",
+        type=str,
+        required=False,
+        choices=RENDER_BACKENDS,
+        help="reference augmentation backend",
+        default="sox",
+    )
+    backends.add_argument(
+        "--fgpath",
+        type=str,
+        required=False,
+        help="path to source files, defaults to the path in the jams files",
+    )
+    backends.add_argument(
+        "-n", type=int, required=False, help="number of jams files", default=20
+    )
+
+    return parser
+
+
+def parse_args():
+    return add_arguments(argparse.ArgumentParser()).parse_args()
+
+
+def main(args=None):
+    if args is None:
+        args = parse_args()
+
+    if args.command == "resample":
+        n = resample_source_bank(args.fgpath, args.outpath, args.sr)
+        print(f"Resampled {n} source files to {args.sr} Hz")
+    else:
+        jams_paths = sorted(glob(join(args.jamspath, "**/*.jams"), recursive=True))
+        if args.command == "compare":
+            deviation = measure_render_deviation(
+                jams_paths[: args.n],
+                args.sr,
+                args.resampledpath,
+                fg_path=args.fgpath,
+                backend=args.backend,
+            )
+        else:
+            deviation = compare_backends(
+                jams_paths[: args.n],
+                args.backend,
+                reference=args.reference,
+                fg_path=args.fgpath,
+            )
+        for name, values in deviation.items():
+            print(
+                f"{name}: median {np.median(values):.4g}, "
+                f"min {np.min(values):.4g}, max {np.max(values):.4g}"
+            )
+
+
+if __name__ == "__main__":
+    main()
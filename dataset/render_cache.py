@@ -0,0 +1,334 @@
+import hashlib
+import json
+import os
+import time
+import zipfile
+from os.path import join
+import numpy as np
+
+from dataset.render import WORK_DTYPE
+
+CACHE_VERSION = 2  # bump when rendering changes in a way the key does not capture
+DEFAULT_CACHE_BYTES = 50 * 2**30
+# A process scans the cache directory for eviction when its estimate of the
+# cache size exceeds the limit, or after EVICT_EVERY writes for the writes of
+# other processes. Eviction then frees the cache down to EVICT_TO of the limit
+EVICT_EVERY = 1000
+EVICT_TO = 0.9
+# Temporary files of save_render older than this many seconds are left by
+# killed writers, and are deleted by eviction
+STALE_TMP_SECONDS = 3600
+# Errors of np.load on a corrupt or truncated render, read as a cache miss
+LOAD_ERRORS = (OSError, EOFError, KeyError, ValueError, zipfile.BadZipFile)
+
+_cache_sizes = {}  # per process (estimated size, writes since scan) by cache_dir
+
+# Sandbox fields that change the rendered audio, besides the events
+RENDER_FIELDS = [
+    "duration",
+    "original_duration",
+    "ref_db",
+    "n_channels",
+    "fade_in_len",
+    "fade_out_len",
+    "reverb",
+    "fix_clipping",
+    "peak_normalization",
+    "quick_pitch_time",
+]
+# Fields of the event values, all of which change the rendered audio
+EVENT_FIELDS = [
+    "label",
+    "source_file",
+    "source_time",
+    "event_time",
+    "event_duration",
+    "snr",
+    "role",
+    "pitch_shift",
+    "time_stretch",
+]
+
+
+def read_render_spec(jams_path, fg_path=None, bg_path=None):
+    """
+    Everything a render of a JAMS file depends on, read without jams.load
+
+    Returns
+    -------
+    dict of the sandbox sr, the RENDER_FIELDS of the sandbox, and the events as
+    [time, duration, value of EVENT_FIELDS], their source files moved to fg_path
+    and bg_path as replace_source_dirs does
+    """
+    from dataset.jams_reader import read_scaper_annotation
+    from dataset.render import moved_source_file
+
+    ann = read_scaper_annotation(
+        jams_path,
+        exclude_labels=(),
+        value_fields=[field for field in EVENT_FIELDS if field != "label"],
+        sandbox_fields=RENDER_FIELDS,
+    )
+    new_paths = {"foreground": fg_path, "background": bg_path}
+    events = []
+    for k in range(len(ann["label"])):
+        value = {field: ann[field][k] for field in EVENT_FIELDS}
+        if new_paths.get(value["role"]) is not None:
+            value["source_file"] = moved_source_file(
+                value["source_file"], new_paths[value["role"]]
+            )
+        events.append([float(ann["time"][k]), float(ann["duration"][k]), value])
+    return dict(sr=ann["sr"], sandbox=ann["sandbox"], events=events)
+
+
+def render_key(spec, sr, backend, dtype, target_sr=None):
+    """
+    Hash of everything a render of a scaper annotation depends on
+
+    The event spec, the rendering fields of the sandbox (see read_render_spec),
+    the rendering sr, backend and dtype (WORK_DTYPE if None), and the size and
+    modification time of every source file, so that replaced sources miss the
+    cache. With a target_sr, the key of the render resampled from sr to target_sr.
+    """
+    sources = {}
+    for _, _, value in spec["events"]:
+        source_file = value["source_file"]
+        try:
+            stat = os.stat(source_file)
+            sources[source_file] = [stat.st_size, stat.st_mtime_ns]
+        except OSError:
+            sources[source_file] = None
+    spec = dict(
+        version=CACHE_VERSION,
+        sr=sr,
+        target_sr=target_sr,
+        backend=backend,
+        dtype=np.dtype(WORK_DTYPE if dtype is None else dtype).name,
+        sandbox=spec["sandbox"],
+        events=spec["events"],
+        sources=sources,
+    )
+    return hashlib.sha256(
+        json.dumps(spec, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def trim_events(event_audio_list):
+    """
+    Trim events to their non-zero samples
+
+    Events last 0.5 to 4 s of a 10 s soundscape, so trimming them stores them in
+    a fraction of their padded size.
+
+    Returns
+    -------
+    stems: (n_trimmed_samples, n_channels) concatenation of the trimmed events
+    spans: (n_events, 2) start and stop sample of each event
+    """
+    spans, stems = [], []
+    for event_audio in event_audio_list:
+        nonzero = np.flatnonzero(np.any(event_audio != 0, axis=1))
+        start, stop = (nonzero[0], nonzero[-1] + 1) if len(nonzero) else (0, 0)
+        spans.append((start, stop))
+        stems.append(event_audio[start:stop])
+    return np.concatenate(stems), np.array(spans, dtype=np.int64).reshape(-1, 2)
+
+
+def untrim_events(stems, spans, n_samples):
+    """
+    Inverse of trim_events
+
+    Returns
+    -------
+    (n_events, n_samples, n_channels) array of the events
+    """
+    events = np.zeros((len(spans), n_samples) + stems.shape[1:], dtype=stems.dtype)
+    offset = 0
+    for event_audio, (start, stop) in zip(events, spans):
+        event_audio[start:stop] = stems[offset : offset + stop - start]
+        offset += stop - start
+    return events
+
+
+def save_render(path, soundscape_audio, event_audio_list):
+    """
+    Save a render to an .npz file, each event trimmed to its non-zero samples
+
+    The file is written under a temporary name and renamed, so concurrent readers
+    never see partial files. Returns the size of the file in bytes.
+    """
+    if event_audio_list:
+        stems, spans = trim_events(event_audio_list)
+    else:
+        stems, spans = soundscape_audio[:0], np.zeros((0, 2), dtype=np.int64)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, mixture=soundscape_audio, stems=stems, spans=spans)
+    n_bytes = os.path.getsize(tmp_path)
+    os.replace(tmp_path, path)
+    return n_bytes
+
+
+def load_render(path):
+    """
+    Inverse of save_render
+
+    Returns
+    -------
+    soundscape_audio: (n_samples, n_channels) array
+    event_audio_list: list of (n_samples, n_channels) arrays, one per event
+    """
+    with np.load(path) as f:
+        soundscape_audio, stems, spans = f["mixture"], f["stems"], f["spans"]
+
+    events = untrim_events(stems, spans, len(soundscape_audio))
+    return soundscape_audio, list(events)
+
+
+def evict(cache_dir, max_bytes, target_bytes=None):
+    """
+    If the cache exceeds max_bytes, delete the least recently used renders until
+    it fits in target_bytes (max_bytes if None)
+
+    Renders are touched when they are read, so modification time orders them by
+    last use. Temporary files of save_render older than STALE_TMP_SECONDS are
+    deleted whatever the size of the cache, newer ones count towards it. Returns
+    the number of renders and temporary files deleted.
+    """
+    target_bytes = max_bytes if target_bytes is None else target_bytes
+    stale_ns = time.time_ns() - int(STALE_TMP_SECONDS * 1e9)
+    entries, tmp_bytes, n_deleted = [], 0, 0
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            if not entry.name.endswith((".npz", ".tmp")):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if entry.name.endswith(".npz"):
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+            elif stat.st_mtime_ns < stale_ns:
+                try:
+                    os.remove(entry.path)
+                    n_deleted += 1
+                except FileNotFoundError:
+                    pass
+            else:
+                tmp_bytes += stat.st_size
+
+    total = tmp_bytes + sum(size for _, size, _ in entries)
+    if total > max_bytes:
+        for _, size, path in sorted(entries):
+            if total <= target_bytes:
+                break
+            try:
+                os.remove(path)
+                n_deleted += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+    _cache_sizes[cache_dir] = (total, 0)
+
+    return n_deleted
+
+
+def _note_write(cache_dir, max_bytes, n_bytes):
+    # Count a write of n_bytes, and evict once the cache may exceed max_bytes
+    size, n_writes = _cache_sizes.get(cache_dir, (None, 0))
+    if size is None or size + n_bytes > max_bytes or n_writes + 1 >= EVICT_EVERY:
+        evict(cache_dir, max_bytes, EVICT_TO * max_bytes)
+    else:
+        _cache_sizes[cache_dir] = (size + n_bytes, n_writes + 1)
+
+
+def _load_cached(path):
+    # Cached render at path, touched for eviction, or None. Corrupt or truncated
+    # renders are removed, to be rendered again
+    try:
+        render = load_render(path)
+    except FileNotFoundError:
+        return None
+    except LOAD_ERRORS:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return None
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+    return render
+
+
+def cached_render(
+    jams_path,
+    cache_dir,
+    max_bytes=DEFAULT_CACHE_BYTES,
+    sr=None,
+    fg_path=None,
+    bg_path=None,
+    backend="sox",
+    dtype=None,
+    target_sr=None,
+):
+    """
+    render_from_jams through an on-disk cache of renders
+
+    Renders are stored in cache_dir under render_key. With a target_sr, the render
+    resampled to target_sr (as in render_at_sr) is stored too, under its own key:
+    other windows, subtypes and ground truth estimates at the same target_sr skip
+    rendering and resampling, and another target_sr only resamples. The key is
+    computed from read_render_spec, so hits do not jams.load the file. Eviction
+    is amortised over writes, see EVICT_EVERY.
+
+    Params
+    -------
+    cache_dir: directory of the cache, shared by processes and runs
+    max_bytes: size of the cache, least recently used renders are evicted
+    sr, fg_path, bg_path, backend, dtype: see render_from_jams
+    target_sr: sample rate of the returned audio, defaults to the rendering sr
+
+    Returns
+    -------
+    soundscape_audio, event_audio_list: as returned by render_from_jams
+    ann: the rendered annotation, None if the render was read from the cache
+    sr: sample rate of the returned audio
+    """
+    spec = read_render_spec(jams_path, fg_path, bg_path)
+    sr = spec["sr"] if sr is None else sr
+    dtype = WORK_DTYPE if dtype is None else dtype
+    target_sr = sr if target_sr is None else target_sr
+    render_path = join(cache_dir, render_key(spec, sr, backend, dtype) + ".npz")
+    target_path = render_path
+    if target_sr != sr:
+        target_path = join(
+            cache_dir, render_key(spec, sr, backend, dtype, target_sr) + ".npz"
+        )
+
+    render = _load_cached(target_path)
+    if render is not None:
+        return render[0], render[1], None, target_sr
+
+    import jams
+    from dataset.render import render_annotation, replace_source_dirs, resample_render
+
+    os.makedirs(cache_dir, exist_ok=True)
+    ann = None
+    render = _load_cached(render_path)
+    if render is None:
+        ann = jams.load(jams_path).annotations.search(namespace="scaper")[0]
+        replace_source_dirs(ann, fg_path, bg_path)
+        soundscape_audio, event_audio_list, ann, _ = render_annotation(
+            ann, sr, backend=backend, dtype=dtype
+        )
+        n_bytes = save_render(render_path, soundscape_audio, event_audio_list)
+        _note_write(cache_dir, max_bytes, n_bytes)
+        render = soundscape_audio, event_audio_list
+    if target_path != render_path:
+        render = resample_render(*render, sr, target_sr)
+        _note_write(cache_dir, max_bytes, save_render(target_path, *render))
+
+    return render[0], render[1], ann, target_sr
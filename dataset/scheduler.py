@@ -0,0 +1,804 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import socket
+import sqlite3
+import threading
+import time
+from os.path import join
+from pathlib import Path
+import numpy as np
+
+from dataset.augmentation import RENDER_BACKENDS
+from dataset.generate_ost import parse_window
+from dataset.render import DTYPES, SUBTYPES, WORK_DTYPE
+
+OPENNESS = ["high", "low"]
+VARIANTS = [f"variant{i}" for i in range(1, 6)]
+SPLITS = ["train", "val", "test"]
+KINDS = ["ost", "gt"]
+
+DEFAULT_WORKER_MEMORY = 1.5 * 2**30  # bytes, until a peak RSS has been recorded
+PARTITIONS = ["balanced", "range"]
+
+# Relative render cost of a soundscape: per soundscape, per event (one
+# augmentation, and one clip per event for ground truth) and per second of audio
+# an event augments, the source excerpt and the stretched event
+COST_PER_SOUNDSCAPE = 1.0
+COST_PER_EVENT = 1.0
+COST_PER_SECOND = 0.25
+
+_jams_lists = {}  # per process cache of list_jams, by split directory
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    openness TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    split TEXT NOT NULL,
+    chunk INTEGER NOT NULL,
+    n_chunks INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    stop INTEGER NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    started_at REAL,
+    finished_at REAL,
+    peak_rss INTEGER,
+    error TEXT,
+    items TEXT,
+    cost REAL NOT NULL DEFAULT 0,
+    UNIQUE (kind, openness, variant, split, chunk)
+)
+"""
+
+
+def connect(db_path, timeout=60.0):
+    # One connection per process and thread. Transactions are explicit so that a
+    # lease is taken with a single write lock held (BEGIN IMMEDIATE).
+    con = sqlite3.connect(db_path, timeout=timeout, isolation_level=None)
+    con.row_factory = sqlite3.Row
+    con.execute("PRAGMA busy_timeout = %d" % int(timeout * 1000))
+    return con
+
+
+def upgrade_schema(con):
+    # Add the columns of newer versions to a queue created by an older version
+    columns = {row["name"] for row in con.execute("PRAGMA table_info(jobs)")}
+    for column, definition in [("items", "TEXT"), ("cost", "REAL NOT NULL DEFAULT 0")]:
+        if columns and column not in columns:
+            try:
+                con.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+            except sqlite3.OperationalError as e:
+                # another worker added it first
+                if "duplicate column" not in str(e):
+                    raise
+
+
+def list_jams(split_dir):
+    # Sorted list of jams files in split_dir, the order chunk ranges refer to
+    return sorted(str(path) for path in Path(split_dir).rglob("*.jams"))
+
+
+def soundscape_costs(paths, n_jobs=1):
+    """
+    Estimated render cost and main source file of each jams file
+
+    The cost counts the soundscape, its events and the seconds of audio each
+    event augments, weighted by COST_PER_SOUNDSCAPE, COST_PER_EVENT and
+    COST_PER_SECOND. The main source is that of the longest foreground event.
+
+    Returns
+    -------
+    costs: (n_files,) array
+    sources: list of the main source file of each jams file, None without events
+    """
+    from dataset.jams_reader import read_scaper_annotations
+
+    batch = read_scaper_annotations(
+        paths,
+        n_jobs,
+        exclude_labels=(),
+        value_fields=("source_file", "role", "time_stretch"),
+    )
+    stretch = np.array(
+        [1.0 if ts is None else ts for ts in batch["time_stretch"]], dtype=float
+    )
+    event_costs = COST_PER_EVENT + COST_PER_SECOND * batch["duration"] * (
+        1 + 1 / stretch
+    )
+    costs = COST_PER_SOUNDSCAPE + np.bincount(
+        batch["file_idx"], weights=event_costs, minlength=len(paths)
+    )
+
+    foreground_duration = np.where(
+        batch["role"] == "foreground", batch["duration"], -1.0
+    )
+    sources = []
+    for lo, hi in zip(batch["offsets"][:-1], batch["offsets"][1:]):
+        longest = lo + np.argmax(foreground_duration[lo:hi]) if hi > lo else None
+        if longest is None or foreground_duration[longest] < 0:
+            sources.append(None)
+        else:
+            sources.append(batch["source_file"][longest])
+
+    return costs, sources
+
+
+def balanced_chunks(costs, sources, n_chunks):
+    """
+    Partition soundscapes into n_chunks of about equal cost
+
+    Soundscapes with the same main source are kept in the same chunk, so that a
+    worker reads each source file from the page cache (or the render cache) as
+    often as possible. These groups are assigned longest processing time first,
+    each to the chunk with the lowest cost so far.
+
+    Returns
+    -------
+    list of n_chunks (sorted list of soundscape indices, cost)
+    """
+    import heapq
+
+    groups = {}
+    for k, source in enumerate(sources):
+        groups.setdefault(source if source is not None else f"#{k}", []).append(k)
+    groups = sorted(
+        groups.values(), key=lambda items: (-sum(costs[k] for k in items), items[0])
+    )
+
+    chunks = [[] for _ in range(n_chunks)]
+    loads = [(0.0, chunk) for chunk in range(n_chunks)]
+    for items in groups:
+        load, chunk = heapq.heappop(loads)
+        chunks[chunk].extend(items)
+        heapq.heappush(loads, (load + sum(costs[k] for k in items), chunk))
+
+    chunk_costs = dict((chunk, load) for load, chunk in loads)
+    return [(sorted(items), chunk_costs[i]) for i, items in enumerate(chunks)]
+
+
+def init_jobs(
+    db_path,
+    osspath,
+    params,
+    kinds=KINDS,
+    openness=OPENNESS,
+    variants=VARIANTS,
+    splits=SPLITS,
+    chunk_size=None,
+    partition="balanced",
+    n_jobs=1,
+):
+    """
+    Enumerate the kind x openness x variant x split job grid into the queue
+
+    Params
+    -------
+    db_path: path to the SQLite queue, on a filesystem shared by all workers
+    osspath: base directory with openness, dataset variants and splits of jams
+    params: dict of per kind parameters, e.g. {"ost": {...}, "gt": {...}}
+    chunk_size: number of jams files per job, defaults to one job per split
+    partition: "balanced" for chunks of equal estimated cost that keep
+        soundscapes of the same main source together (see balanced_chunks),
+        "range" for chunks of consecutive jams files
+    n_jobs: number of processes reading the jams files for balanced partitions
+
+    Returns
+    -------
+    number of jobs added, jobs already in the queue are left untouched
+    """
+    con = connect(db_path)
+    con.execute(SCHEMA)
+    upgrade_schema(con)
+    split_chunks = {}  # the same partition for every kind
+    n_added = 0
+    for o in openness:
+        for v in variants:
+            for s in splits:
+                split_dir = join(osspath, o, v, s)
+                paths = list_jams(split_dir)
+                n_files = len(paths)
+                size = chunk_size or max(n_files, 1)
+                n_chunks = max(-(-n_files // size), 1)
+                if partition == "balanced" and n_files:
+                    costs, sources = soundscape_costs(paths, n_jobs)
+                    split_chunks[split_dir] = balanced_chunks(costs, sources, n_chunks)
+                else:
+                    split_chunks[split_dir] = [
+                        (list(range(start, min(start + size, n_files))), None)
+                        for start in range(0, n_chunks * size, size)
+                    ]
+
+    con.execute("BEGIN IMMEDIATE")
+    for kind in kinds:
+        for o in openness:
+            for v in variants:
+                for s in splits:
+                    split_dir = join(osspath, o, v, s)
+                    chunks = split_chunks[split_dir]
+                    job_params = json.dumps(dict(params[kind], split_dir=split_dir))
+                    for chunk, (items, cost) in enumerate(chunks):
+                        cur = con.execute(
+                            "INSERT OR IGNORE INTO jobs (kind, openness, variant, "
+                            "split, chunk, n_chunks, start, stop, params, items, cost) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            (
+                                kind,
+                                o,
+                                v,
+                                s,
+                                chunk,
+                                len(chunks),
+                                min(items, default=0),
+                                max(items, default=-1) + 1,
+                                job_params,
+                                json.dumps(items) if cost is not None else None,
+                                len(items) if cost is None else cost,
+                            ),
+                        )
+                        n_added += cur.rowcount
+    con.execute("COMMIT")
+    con.close()
+
+    return n_added
+
+
+def lease_job(con, worker, lease_seconds, max_attempts=3):
+    """
+    Lease the next pending job, or a job whose lease has expired
+
+    The most costly job is leased first, so that the queue runs longest
+    processing time first and idle workers take the remaining jobs as they free
+    up. Jobs leased more than max_attempts times are marked as failed instead.
+
+    Returns
+    -------
+    sqlite3.Row of the leased job, or None if no job is available
+    """
+    now = time.time()
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        con.execute(
+            "UPDATE jobs SET status = 'failed', error = coalesce(error, 'lease expired') "
+            "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+            (now, max_attempts),
+        )
+        job = con.execute(
+            "SELECT * FROM jobs WHERE status = 'pending' "
+            "OR (status = 'leased' AND lease_expires < ?) "
+            "ORDER BY cost DESC, id LIMIT 1",
+            (now,),
+        ).fetchone()
+        if job is not None:
+            con.execute(
+                "UPDATE jobs SET status = 'leased', worker = ?, lease_expires = ?, "
+                "attempts = attempts + 1, started_at = ? WHERE id = ?",
+                (worker, now + lease_seconds, now, job["id"]),
+            )
+        con.execute("COMMIT")
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+
+    return job
+
+
+def renew_lease(con, job_id, worker, lease_seconds):
+    # Extend a lease still held by worker, returns False if it was lost
+    cur = con.execute(
+        "UPDATE jobs SET lease_expires = ? "
+        "WHERE id = ? AND worker = ? AND status = 'leased'",
+        (time.time() + lease_seconds, job_id, worker),
+    )
+    return cur.rowcount == 1
+
+
+def finish_job(con, job, worker, status, error=None):
+    """
+    Record the outcome of a leased job
+
+    Returns
+    -------
+    True if this was the last chunk of its kind and split to finish
+    """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    con.execute("BEGIN IMMEDIATE")
+    con.execute(
+        "UPDATE jobs SET status = ?, finished_at = ?, peak_rss = ?, error = ? "
+        "WHERE id = ? AND worker = ?",
+        (status, time.time(), peak_rss, error, job["id"], worker),
+    )
+    n_left = con.execute(
+        "SELECT count(*) FROM jobs WHERE kind = ? AND openness = ? AND variant = ? "
+        "AND split = ? AND status != 'done'",
+        (job["kind"], job["openness"], job["variant"], job["split"]),
+    ).fetchone()[0]
+    con.execute("COMMIT")
+
+    return status == "done" and n_left == 0 and job["n_chunks"] > 1
+
+
+def run_job(job):
+    # Run one chunk of the grid in this process
+    params = json.loads(job["params"])
+    split_dir = params["split_dir"]
+    if split_dir not in _jams_lists:
+        _jams_lists[split_dir] = list_jams(split_dir)
+    if job["items"] is not None:
+        paths = [_jams_lists[split_dir][k] for k in json.loads(job["items"])]
+    else:
+        paths = _jams_lists[split_dir][job["start"] : job["stop"]]
+
+    if job["kind"] == "ost":
+        from dataset.generate_ost import create_tag
+
+        create_tag(
+            split_dir,
+            params["genaudio"],
+            params["sr"],
+            params["outid"],
+            params["jamid"],
+            fg_path=params.get("fgpath"),
+            render_at_target_sr=params.get("atsr", False),
+            backend=params.get("backend", "sox"),
+            dtype=params.get("dtype", WORK_DTYPE),
+            subtype=params.get("subtype", "PCM_16"),
+            cache_dir=params.get("cache"),
+            cache_bytes=params.get("cachesize"),
+            windows=params.get("windows"),
+            paths=paths,
+            ann_name=chunk_ann_name(job) if job["n_chunks"] > 1 else None,
+        )
+    elif job["kind"] == "gt":
+        from dataset.ground_truth_estimates import ground_truth_estimates
+
+        ground_truth_estimates(
+            paths,
+            split_dir,
+            params["sr"],
+            params["label_in_file_name"],
+            params["outid"],
+            params["jamid"],
+            fg_path=params.get("fgpath"),
+            render_at_target_sr=params.get("atsr", False),
+            backend=params.get("backend", "sox"),
+            dtype=params.get("dtype", WORK_DTYPE),
+            subtype=params.get("subtype", "PCM_16"),
+            cache_dir=params.get("cache"),
+            cache_bytes=params.get("cachesize"),
+        )
+    else:
+        raise ValueError(f"Unknown job kind {job['kind']}")
+
+
+def chunk_ann_name(job, chunk=None):
+    # Name of the annotation file of one ost chunk
+    chunk = job["chunk"] if chunk is None else chunk
+    return f"{job['openness']}_{job['variant']}_{job['split']}_{chunk:05d}"
+
+
+def merge_annotations(job):
+    """
+    Concatenate the chunk annotation files of an ost split into the split
+    annotation file create_tag would have written, and delete the chunk files
+
+    Rows are put back in the order of list_jams, as chunks of a balanced
+    partition hold jams files from all over the split.
+    """
+    import pandas as pd
+    from dataset.generate_ost import OST_WINDOW, get_ann_dir, window_out_id
+
+    params = json.loads(job["params"])
+    for window in params.get("windows") or [OST_WINDOW]:
+        ann_dir = get_ann_dir(
+            params["split_dir"], params["jamid"], window_out_id(params["outid"], window)
+        )
+        chunk_files = [
+            join(ann_dir, chunk_ann_name(job, chunk) + ".pkl")
+            for chunk in range(job["n_chunks"])
+        ]
+        df = pd.concat([pd.read_pickle(f) for f in chunk_files], ignore_index=True)
+        order = {
+            os.path.basename(path): k
+            for k, path in enumerate(list_jams(params["split_dir"]))
+        }
+        rank = df["source_file"].map(order).to_numpy()
+        df = df.iloc[np.argsort(rank, kind="stable")].reset_index(drop=True)
+        df.to_pickle(
+            join(ann_dir, f"{job['openness']}_{job['variant']}_{job['split']}.pkl")
+        )
+        for f in chunk_files:
+            os.remove(f)
+
+
+def _heartbeat(db_path, job_id, worker, lease_seconds, stop):
+    con = connect(db_path)
+    while not stop.wait(lease_seconds / 3):
+        if not renew_lease(con, job_id, worker, lease_seconds):
+            break
+    con.close()
+
+
+def work(db_path, lease_seconds=600, poll_seconds=30, max_attempts=3):
+    """
+    Lease and run jobs until the queue is empty
+
+    Leases are renewed in the background while a job runs, so a job is only
+    reclaimed by another worker if this process dies or hangs. A job that raises
+    is put back in the queue until it has been attempted max_attempts times.
+
+    Returns
+    -------
+    number of jobs completed by this worker
+    """
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    con = connect(db_path)
+    upgrade_schema(con)
+    n_done = 0
+    while True:
+        job = lease_job(con, worker, lease_seconds, max_attempts)
+        if job is None:
+            n_active = con.execute(
+                "SELECT count(*) FROM jobs WHERE status IN ('pending', 'leased')"
+            ).fetchone()[0]
+            if n_active == 0:
+                break
+            time.sleep(poll_seconds)
+            continue
+
+        print(
+            f"{worker}: {job['kind']} {job['openness']} {job['variant']} "
+            f"{job['split']} chunk {job['chunk'] + 1}/{job['n_chunks']}"
+        )
+        stop = threading.Event()
+        heartbeat = threading.Thread(
+            target=_heartbeat,
+            args=(db_path, job["id"], worker, lease_seconds, stop),
+            daemon=True,
+        )
+        heartbeat.start()
+        try:
+            run_job(job)
+        except KeyboardInterrupt:
+            con.execute(
+                "UPDATE jobs SET status = 'pending', attempts = attempts - 1 "
+                "WHERE id = ? AND worker = ?",
+                (job["id"], worker),
+            )
+            raise
+        except Exception as e:
+            # leave the job for another attempt until max_attempts is reached
+            status = "failed" if job["attempts"] + 1 >= max_attempts else "pending"
+            finish_job(con, job, worker, status, error=repr(e))
+        else:
+            try:
+                # only ost chunks write annotation files, merged by the last one
+                if finish_job(con, job, worker, "done") and job["kind"] == "ost":
+                    merge_annotations(job)
+            except Exception as e:
+                # the chunk files are kept, so a retry of this job merges them
+                finish_job(con, job, worker, "failed", error=repr(e))
+            else:
+                n_done += 1
+        finally:
+            stop.set()
+            heartbeat.join()
+
+    con.close()
+    return n_done
+
+
+def parse_memory(size):
+    # "32G", "512M" or a number of bytes
+    units = {"K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+    size = str(size).strip().upper().rstrip("B")
+    if size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def workers_for_memory(memory_budget, worker_memory, n_cpus=None):
+    # Number of workers whose peak memory fits memory_budget, at most one per CPU
+    n_cpus = os.cpu_count() if n_cpus is None else n_cpus
+    return max(1, min(n_cpus, int(memory_budget // worker_memory)))
+
+
+def observed_worker_memory(db_path):
+    # Largest peak RSS recorded by a worker, or DEFAULT_WORKER_MEMORY
+    con = connect(db_path)
+    peak_rss = con.execute("SELECT max(peak_rss) FROM jobs").fetchone()[0]
+    con.close()
+    return peak_rss or DEFAULT_WORKER_MEMORY
+
+
+def run_workers(db_path, n_workers, **kwargs):
+    # Run n_workers worker processes on this node until the queue is empty
+    processes = [
+        multiprocessing.Process(target=work, args=(db_path,), kwargs=kwargs)
+        for _ in range(n_workers)
+    ]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+
+
+def progress(db_path):
+    """
+    Summarise the queue per kind, openness, variant and split
+
+    Returns
+    -------
+    list of dicts with job counts per status, jams files done and total, and an
+    estimate of the remaining time at the current throughput
+    """
+    con = connect(db_path)
+    upgrade_schema(con)
+    rows = con.execute(
+        "SELECT kind, openness, variant, split, "
+        "count(*) AS n_jobs, "
+        "sum(status = 'done') AS done, "
+        "sum(status = 'leased') AS leased, "
+        "sum(status = 'failed') AS failed, "
+        "sum(coalesce(json_array_length(items), stop - start)) AS n_files, "
+        "sum(CASE WHEN status = 'done' "
+        "THEN coalesce(json_array_length(items), stop - start) ELSE 0 END) "
+        "AS files_done, "
+        "min(started_at) AS first_start, max(finished_at) AS last_finish "
+        "FROM jobs GROUP BY kind, openness, variant, split "
+        "ORDER BY kind, openness, variant, split"
+    ).fetchall()
+    con.close()
+
+    report = [dict(row) for row in rows]
+    files_done = sum(r["files_done"] for r in report)
+    n_files = sum(r["n_files"] for r in report)
+    starts = [r["first_start"] for r in report if r["first_start"]]
+    finishes = [r["last_finish"] for r in report if r["last_finish"]]
+    eta = None
+    if files_done and starts and finishes:
+        rate = files_done / max(max(finishes) - min(starts), 1e-6)
+        eta = (n_files - files_done) / rate
+    report.append(
+        {
+            "kind": "total",
+            "n_jobs": sum(r["n_jobs"] for r in report),
+            "done": sum(r["done"] for r in report),
+            "leased": sum(r["leased"] for r in report),
+            "failed": sum(r["failed"] for r in report),
+            "n_files": n_files,
+            "files_done": files_done,
+            "eta": eta,
+        }
+    )
+
+    return report
+
+
+def print_progress(db_path):
+    report = progress(db_path)
+    for r in report[:-1]:
+        print(
+            f"{r['kind']:4s} {r['openness']:5s} {r['variant']:9s} {r['split']:6s} "
+            f"jobs {r['done']}/{r['n_jobs']} done, {r['leased']} running, "
+            f"{r['failed']} failed, jams {r['files_done']}/{r['n_files']}"
+        )
+    total = report[-1]
+    print(
+        f"Total: jobs {total['done']}/{total['n_jobs']} done, {total['leased']} "
+        f"running, {total['failed']} failed, jams {total['files_done']}/"
+        f"{total['n_files']}"
+    )
+    if total["eta"] is not None:
+        print(f"Estimated time left: {round(total['eta'] / 60.0, 2)} minutes")
+
+
+def reset_failed(db_path):
+    # Put failed jobs back in the queue, returns the number of jobs reset
+    con = connect(db_path)
+    cur = con.execute(
+        "UPDATE jobs SET status = 'pending', attempts = 0, error = NULL "
+        "WHERE status = 'failed'"
+    )
+    con.close()
+    return cur.rowcount
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        "--db", type=str, required=True, help="path to the SQLite job queue"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    init = subparsers.add_parser("init", help="add the job grid to the queue")
+    init.add_argument(
+        "-p",
+        "--osspath",
+        type=str,
+        required=True,
+        help="path to base directory with openness, dataset variants, and splits",
+    )
+    init.add_argument("--kinds", nargs="+", default=KINDS, choices=KINDS)
+    init.add_argument("-o", "--openness", nargs="+", default=OPENNESS)
+    init.add_argument("-v", "--variants", nargs="+", default=VARIANTS)
+    init.add_argument("-s", "--splits", nargs="+", default=SPLITS)
+    init.add_argument(
+        "--chunk",
+        type=int,
+        required=False,
+        help="number of jams files per job, defaults to one job per split",
+        default=None,
+    )
+    init.add_argument(
+        "--partition",
+        type=str,
+        choices=PARTITIONS,
+        help="balanced for chunks of equal estimated cost grouped by source file, "
+        "range for chunks of consecutive jams files",
+        default="balanced",
+    )
+    init.add_argument(
+        "--readers",
+        type=int,
+        default=os.cpu_count(),
+        help="number of processes reading jams files for balanced chunks",
+    )
+    init.add_argument("--jamid", type=str, default="oss", help="Name of jams dataset")
+    init.add_argument("--outid", type=str, default="ost", help="Name of OST dataset")
+    init.add_argument(
+        "--gtid", type=str, default="ost-gt", help="Name of ground truth dataset"
+    )
+    init.add_argument(
+        "--sr", type=int, default=16_000, help="sample rate of output wav files"
+    )
+    init.add_argument(
+        "--fgpath",
+        type=str,
+        default=None,
+        help="path to foreground source files, defaults to the path in the jams files",
+    )
+    init.add_argument(
+        "--atsr",
+        action="store_true",
+        help="render directly at --sr, --fgpath must hold sources resampled to --sr",
+    )
+    init.add_argument(
+        "--backend",
+        type=str,
+        choices=RENDER_BACKENDS,
+        help="pitch shift and time stretch backend, sox or in process",
+        default="sox",
+    )
+    init.add_argument(
+        "--windows",
+        type=str,
+        nargs="+",
+        default=["1"],
+        help="OST clip windows, length or length:hop in seconds",
+    )
+    init.add_argument(
+        "--dtype",
+        type=str,
+        choices=DTYPES,
+        help="working dtype of the rendered audio",
+        default=WORK_DTYPE,
+    )
+    init.add_argument(
+        "--subtype",
+        type=str,
+        choices=SUBTYPES,
+        help="sample format of the output wav files",
+        default="PCM_16",
+    )
+    init.add_argument(
+        "--cache",
+        type=str,
+        default=None,
+        help="directory of the render cache, on a filesystem shared by the workers",
+    )
+    init.add_argument(
+        "--cachesize", type=str, default="50G", help="size of the render cache"
+    )
+
+    run = subparsers.add_parser("work", help="run workers until the queue is empty")
+    run.add_argument(
+        "-j",
+        "--workers",
+        type=str,
+        default="auto",
+        help="number of worker processes, or auto to size them to --memory",
+    )
+    run.add_argument(
+        "--memory",
+        type=str,
+        default=None,
+        help="memory budget for this node, e.g. 64G, defaults to total memory",
+    )
+    run.add_argument("--lease", type=int, default=600, help="lease duration in seconds")
+    run.add_argument("--attempts", type=int, default=3, help="attempts per job")
+
+    subparsers.add_parser("status", help="report progress")
+    subparsers.add_parser("retry", help="put failed jobs back in the queue")
+
+    return parser
+
+
+def parse_args():
+    return add_arguments(argparse.ArgumentParser()).parse_args()
+
+
+def main(args=None):
+    if args is None:
+        args = parse_args()
+
+    if args.command == "init":
+        common = dict(
+            jamid=args.jamid,
+            sr=args.sr,
+            fgpath=args.fgpath,
+            atsr=args.atsr,
+            backend=args.backend,
+            dtype=args.dtype,
+            subtype=args.subtype,
+            cache=args.cache,
+            cachesize=parse_memory(args.cachesize),
+        )
+        params = {
+            "ost": dict(
+                common,
+                outid=args.outid,
+                genaudio=True,
+                windows=[parse_window(spec) for spec in args.windows],
+            ),
+            "gt": dict(common, outid=args.gtid, label_in_file_name=True),
+        }
+        n = init_jobs(
+            args.db,
+            args.osspath,
+            params,
+            kinds=args.kinds,
+            openness=args.openness,
+            variants=args.variants,
+            splits=args.splits,
+            chunk_size=args.chunk,
+            partition=args.partition,
+            n_jobs=args.readers,
+        )
+        print(f"Added {n} jobs to {args.db}")
+        print_progress(args.db)
+    elif args.command == "work":
+        if args.workers == "auto":
+            memory = args.memory or os.sysconf("SC_PAGE_SIZE") * os.sysconf(
+                "SC_PHYS_PAGES"
+            )
+            worker_memory = observed_worker_memory(args.db)
+            n_workers = workers_for_memory(parse_memory(memory), worker_memory)
+            print(
+                f"Running {n_workers} workers at "
+                f"{round(worker_memory / 2**30, 2)} GB per worker"
+            )
+        else:
+            n_workers = int(args.workers)
+        start_time = time.time()
+        run_workers(
+            args.db, n_workers, lease_seconds=args.lease, max_attempts=args.attempts
+        )
+        print(
+            f"Queue empty after {round((time.time() - start_time) / 60.0, 2)} minutes"
+        )
+        print_progress(args.db)
+    elif args.command == "status":
+        print_progress(args.db)
+    else:
+        print(f"Reset {reset_failed(args.db)} failed jobs")
+
+
+if __name__ == "__main__":
+    main()
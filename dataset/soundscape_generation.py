@@ -1,5 +1,4 @@
 from collections import Counter
-import scaper
 import numpy as np
 
 SEED = 123  # To reproduce OST as in the paper, do not update this
@@ -37,14 +36,17 @@ def create_soundscape(
     time_stretch_min=0.8,
     time_stretch_max=1.2,
     add_bg=True,
+    rng=None,
 ):
     # sc : Scaper object
     # paths : source paths
     # source_counts : Counter object containing occurrence counts of classes
     # class_id : class label
+    # rng : np.random.RandomState to draw from, the global np.random if None
     # This function is intended to add an event based on the train, val or test split
     # The args should be adjusted accordingly
     # Returns : Scaper object with added events
+    rng = np.random if rng is None else rng
 
     sc.reset_fg_event_spec()
     sc.reset_bg_event_spec()
@@ -57,7 +59,7 @@ def create_soundscape(
         )
 
     p = np.array([1.0 / (i + 1) for i in range(4)])  # p(n) = k x 1/n
-    n_events = np.random.choice(a=[1, 2, 3, 4], size=1, replace=False, p=p / sum(p))
+    n_events = rng.choice(a=[1, 2, 3, 4], size=1, replace=False, p=p / sum(p))
     class_idx = []
 
     if class_id is not None:
@@ -80,19 +82,17 @@ def create_soundscape(
             {k: v for (k, v) in source_counts.items() if k != str(class_id)}
         )
         if n_events != 1:
-            class_idx = (
-                np.random.choice(  # TODO : would scaper weighted choice be better?
-                    a=list(new_source_counts.keys()),
-                    size=n_events - 1,
-                    replace=False,
-                    p=np.array(list(new_source_counts.values()))
-                    / sum(new_source_counts.values()),
-                )
+            class_idx = rng.choice(  # TODO : would scaper weighted choice be better?
+                a=list(new_source_counts.keys()),
+                size=n_events - 1,
+                replace=False,
+                p=np.array(list(new_source_counts.values()))
+                / sum(new_source_counts.values()),
             )
 
     else:
         # Inherent stochasticity here
-        class_idx = np.random.choice(  # TODO : would scaper weighted choice be better?
+        class_idx = rng.choice(  # TODO : would scaper weighted choice be better?
             a=list(source_counts.keys()),
             size=n_events,
             replace=False,
@@ -117,22 +117,24 @@ def create_soundscape(
     return sc
 
 
-def choose_n_events(p_min=1, p_max=4):
+def choose_n_events(p_min=1, p_max=4, rng=None):
+    rng = np.random if rng is None else rng
     p_range = [i for i in range(p_min, p_max + 1)]
     p = np.array([1.0 / i for i in p_range])  # p(n) = k x 1/n
-    n_events = np.random.choice(a=p_range, replace=False, p=p / sum(p))
+    n_events = rng.choice(a=p_range, replace=False, p=p / sum(p))
 
     return n_events
 
 
-def choose_labels_for_soundscape(labels, n_events=None):
+def choose_labels_for_soundscape(labels, n_events=None, rng=None):
     # TODO: update p and n_events for bg only examples, maybe the same likelihood as polyphony 4
+    rng = np.random if rng is None else rng
 
     if n_events is None:
-        n_events = choose_n_events()
+        n_events = choose_n_events(rng=rng)
     sc_labels = []
 
-    sc_labels = np.random.choice(
+    sc_labels = rng.choice(
         a=labels,
         size=n_events,
         replace=False,
@@ -187,12 +189,14 @@ def oss_tiny_soundscape(
     time_stretch_min=0.8,
     time_stretch_max=1.2,
     add_bg=False,
+    rng=None,
 ):
     # sc : Scaper object
     # paths : source paths
     # labels : allowed labels
     # allowed_combos : dictionary of allowed class combinations indexed by 'px', x the polyphony
     # class_id : class label
+    # rng : np.random.RandomState to draw the labels from, the global np.random if None
     # This function is intended to add an event based on the train, val or test split
     # The args should be adjusted accordingly
     # Returns : Scaper object with added events
@@ -208,14 +212,15 @@ def oss_tiny_soundscape(
             source_time=("const", 0),
         )
 
+    rng = np.random if rng is None else rng
     if allowed_combos is None:
-        sc_labels = choose_labels_for_soundscape(labels)
+        sc_labels = choose_labels_for_soundscape(labels, rng=rng)
     else:
-        n_events = choose_n_events()
+        n_events = choose_n_events(rng=rng)
         if n_events == 1:
-            sc_labels = choose_labels_for_soundscape(labels, n_events=1)
+            sc_labels = choose_labels_for_soundscape(labels, n_events=1, rng=rng)
         else:
-            combo_choice = np.random.choice(
+            combo_choice = rng.choice(
                 [i for i in range(len(allowed_combos[f"p{n_events}"]))]
             )
             sc_labels = allowed_combos[f"p{n_events}"][combo_choice]
@@ -250,11 +255,16 @@ def oss_tiny_val_or_test_soundscape(
     time_stretch_max=1.2,
     add_bg=False,
     debug=False,
+    rng=None,
 ):
-    sc.reset_fg_event_spec()
-    sc.reset_bg_event_spec()
-
-    if add_bg:
+    # debug : if True, only draw and return the labels, sc may be None
+    # rng : np.random.RandomState to draw the labels from, the global np.random if None
+    rng = np.random if rng is None else rng
+    if not debug:
+        sc.reset_fg_event_spec()
+        sc.reset_bg_event_spec()
+
+    if add_bg and not debug:
         # TODO: update to sonyc backgrounds
         sc.add_background(
             label=("const", "brownnoise"),
@@ -263,42 +273,44 @@ def oss_tiny_val_or_test_soundscape(
         )
 
     if uu_labels is not None:
-        sc_type = np.random.choice(["kk", "uu"])
+        sc_type = rng.choice(["kk", "uu"])
     else:  # validation set behavior
         sc_type = "kk"
 
     if sc_type == "kk":
-        kk_combo = np.random.choice(["seen", "unseen"])
+        kk_combo = rng.choice(["seen", "unseen"])
 
         if kk_combo == "seen":
             # pick polyphony from a uniform distribution
-            n_events = np.random.choice([1, 2, 3, 4])
+            n_events = rng.choice([1, 2, 3, 4])
             if n_events == 1:
-                sc_labels = choose_labels_for_soundscape(kk_labels, n_events=1)
+                sc_labels = choose_labels_for_soundscape(kk_labels, n_events=1, rng=rng)
             else:
-                combo_choice = np.random.choice(
+                combo_choice = rng.choice(
                     [i for i in range(len(seen_kk_combos[f"p{n_events}"]))]
                 )
                 sc_labels = seen_kk_combos[f"p{n_events}"][combo_choice]
 
         else:
             # uniform distribution excluding polyphony 1, which is seen during training
-            n_events = np.random.choice([2, 3, 4])
-            combo_choice = np.random.choice(
+            n_events = rng.choice([2, 3, 4])
+            combo_choice = rng.choice(
                 [i for i in range(len(unseen_kk_combos[f"p{n_events}"]))]
             )
             sc_labels = unseen_kk_combos[f"p{n_events}"][combo_choice]
 
     else:
-        n_events = choose_n_events()
+        n_events = choose_n_events(rng=rng)
 
         # ensure one event is uu
-        uu_label = choose_labels_for_soundscape(uu_labels, n_events=1)
+        uu_label = choose_labels_for_soundscape(uu_labels, n_events=1, rng=rng)
 
         if n_events > 1:
             allowed_labels = kk_labels + uu_labels
             allowed_labels.remove(uu_label[0])
-            labels = choose_labels_for_soundscape(allowed_labels, n_events=n_events - 1)
+            labels = choose_labels_for_soundscape(
+                allowed_labels, n_events=n_events - 1, rng=rng
+            )
             sc_labels = uu_label + labels
 
         else:
@@ -318,50 +330,3 @@ def oss_tiny_val_or_test_soundscape(
         time_stretch_max,
     )
     return sc, sc_type, kk_combo if "kk_combo" in locals() else ""
-
-
-def unit_test_oss_tiny_test_soundscape(
-    seen_combos,
-    unseen_combos,
-    n_soundscapes=10_000,
-    n_kk_classes=15,
-    uu_end_idx=89,
-    uu_start_idx=54,
-    kk_labels=None,
-    uu_labels=None,
-):
-    kk, unseen, seen, uu = 0, 0, 0, 0
-    if uu_labels is None:
-        uu_labels = [i for i in range(uu_start_idx, uu_end_idx)]
-    if kk_labels is None:
-        kk_labels = [i for i in range(n_kk_classes)]
-
-    for i in range(n_soundscapes):
-        sc_labels = oss_tiny_val_or_test_soundscape(
-            sc=None,
-            paths=None,
-            kk_labels=kk_labels,
-            uu_labels=uu_labels,
-            seen_kk_combos=seen_combos,
-            unseen_kk_combos=unseen_combos,
-            debug=True,
-        )
-        if sc_labels[1] == "kk":
-            kk += 1
-            assert all([l in kk_labels for l in sc_labels[0]])
-            if sc_labels[2] == "seen":
-                seen += 1
-                assert tuple(sc_labels[0]) in seen_combos
-            else:
-                unseen += 1
-                assert tuple(sc_labels[0]) in unseen_combos
-        else:
-            uu += 1
-            assert any([l in uu_labels for l in sc_labels[0]])
-
-    print(f"Tested {n_soundscapes} soundscapes: ")
-    print(
-        f"{kk} were kk, with {seen} seen kk class combos and {unseen} unseen kk class combos"
-    )
-    print(f"{uu} were uu")
-    print("Tests passed successfully!")
@@ -0,0 +1,449 @@
+import argparse
+import os
+import time
+from pathlib import Path
+import numpy as np
+
+from dataset.augmentation import RENDER_BACKENDS
+from dataset.render import DTYPES, SUBTYPES, WORK_DTYPE
+
+
+def stems_path(jams_path, stems_dir_id="stems"):
+    # Stem file of a JAMS file, next to its OSS wav file (jams replaced by stems)
+    return os.path.splitext(jams_path)[0].replace("jams", stems_dir_id) + ".npz"
+
+
+def render_stems(
+    jams_path, sr=None, fg_path=None, bg_path=None, backend="sox", dtype=WORK_DTYPE
+):
+    """
+    Render the augmented events of a soundscape without their SNR gain
+
+    The soundscape is rendered with its clipping fix and peak normalisation turned
+    off, so that every foreground event is its augmented source normalised to the
+    soundscape ref_db, times its SNR gain. Dividing the gain out leaves each event
+    at 0 dB SNR, and backgrounds at ref_db. See remix to mix them again.
+
+    Params
+    -------
+    jams_path, sr, fg_path, bg_path, backend, dtype: see render_from_jams
+
+    Returns
+    -------
+    stems: dict of
+        events: (n_events, n_samples, n_channels) events at 0 dB SNR
+        role, label: (n_events,) scaper role and label of each event
+        snr: (n_events,) SNR of each event in the JAMS file, nan for backgrounds
+        ref_db, sr, fix_clipping, peak_normalization: as in the JAMS file, sr
+            is the rendering sr
+    """
+    import jams
+    from dataset.render import render_annotation, replace_source_dirs
+
+    ann = jams.load(jams_path).annotations.search(namespace="scaper")[0]
+    replace_source_dirs(ann, fg_path, bg_path)
+    sandbox = ann.sandbox.scaper
+    mix_settings = dict(
+        ref_db=float(sandbox["ref_db"]),
+        fix_clipping=bool(sandbox.get("fix_clipping", False)),
+        peak_normalization=bool(sandbox.get("peak_normalization", False)),
+    )
+    sandbox["fix_clipping"] = sandbox["peak_normalization"] = False
+
+    _, event_audio_list, ann, sr = render_annotation(
+        ann, sr, backend=backend, dtype=dtype
+    )
+    role = np.array([obs.value["role"] for obs in ann.data])
+    snr = np.array(
+        [
+            obs.value["snr"] if obs.value["role"] == "foreground" else np.nan
+            for obs in ann.data
+        ],
+        dtype=np.float64,
+    )
+    events = np.stack(event_audio_list)
+    gains = np.where(role == "foreground", 10 ** (-np.nan_to_num(snr) / 20), 1.0)
+    events *= gains.astype(events.dtype)[:, None, None]
+
+    return dict(
+        events=events,
+        role=role,
+        label=np.array([obs.value["label"] for obs in ann.data]),
+        snr=snr,
+        sr=sr,
+        **mix_settings,
+    )
+
+
+def save_stems(path, stems):
+    # Save stems to an .npz file, events trimmed as in render_cache.save_render
+    from dataset.render_cache import trim_events
+
+    trimmed, spans = trim_events(stems["events"])
+    fields = {k: v for k, v in stems.items() if k != "events"}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            trimmed=trimmed,
+            spans=spans,
+            n_samples=stems["events"].shape[1],
+            **fields,
+        )
+    os.replace(tmp_path, path)
+
+
+def load_stems(path):
+    # Inverse of save_stems
+    from dataset.render_cache import untrim_events
+
+    with np.load(path) as f:
+        stems = {k: f[k] for k in f.files}
+    stems["events"] = untrim_events(
+        stems.pop("trimmed"), stems.pop("spans"), int(stems.pop("n_samples"))
+    )
+    stems["sr"], stems["ref_db"] = int(stems["sr"]), float(stems["ref_db"])
+    for k in ["fix_clipping", "peak_normalization"]:
+        stems[k] = bool(stems[k])
+    return stems
+
+
+def with_background(stems, audio=None, sr=None, label="background"):
+    """
+    Replace the backgrounds of stems
+
+    Params
+    -------
+    stems: see render_stems
+    audio: (n_samples,) or (n_samples, n_channels) background, tiled or cut to
+        the soundscape length and normalised to the stems' ref_db as Scaper
+        does. If None, the backgrounds are only removed
+    sr: sample rate of audio, resampled to the stems' sr. Required with audio
+
+    Returns
+    -------
+    new stems dict, sharing the foreground events with stems
+    """
+    from scaper.audio import get_integrated_lufs
+    from dataset.render import resample_audio
+
+    keep = stems["role"] != "background"
+    new = dict(stems)
+    for k in ["events", "role", "label", "snr"]:
+        new[k] = stems[k][keep]
+    if audio is None:
+        return new
+
+    if sr is None:
+        raise ValueError("sr is required to add a background")
+    n_samples, n_channels = stems["events"].shape[1:]
+    audio = np.asarray(audio, dtype=stems["events"].dtype).reshape(len(audio), -1)
+    audio = resample_audio(audio, sr, stems["sr"])
+    audio = np.broadcast_to(audio, (len(audio), n_channels))
+    audio = np.tile(audio, (-(-n_samples // len(audio)), 1))[:n_samples]
+    gain = stems["ref_db"] - get_integrated_lufs(audio, stems["sr"])
+    audio = audio * audio.dtype.type(10 ** (gain / 20))
+
+    new["events"] = np.concatenate([new["events"], audio[None]])
+    new["role"] = np.append(new["role"], "background")
+    new["label"] = np.append(new["label"], label)
+    new["snr"] = np.append(new["snr"], np.nan)
+    return new
+
+
+def event_gains(stems, snr=None, ref_db=None):
+    """
+    Linear gains of the events of stems for one or several mix conditions
+
+    Params
+    -------
+    snr: SNR of the foreground events in dB, the stored SNRs if None. A scalar
+        for all events, (n_foreground,) for each event, or (n_mixes, n_foreground)
+        for several mixes
+    ref_db: reference loudness of the mix, the stored ref_db if None
+
+    Returns
+    -------
+    (n_events,) or (n_mixes, n_events) gains
+    """
+    foreground = stems["role"] == "foreground"
+    if snr is None:
+        snr = stems["snr"][foreground]
+    snr = np.asarray(snr, dtype=np.float64) + np.zeros(foreground.sum())
+    gains_db = np.zeros(snr.shape[:-1] + foreground.shape)
+    gains_db[..., foreground] = snr
+    if ref_db is not None:
+        gains_db += ref_db - stems["ref_db"]
+    return 10 ** (gains_db / 20)
+
+
+def remix(
+    stems,
+    snr=None,
+    ref_db=None,
+    fix_clipping=None,
+    peak_normalization=None,
+    return_events=True,
+):
+    """
+    Mix stems at new SNRs and reference loudness
+
+    Gains and sum are a single matrix product, so a batch of mixes of the same
+    soundscape costs little more than one. Clipping fix and peak normalisation
+    follow Scaper and apply to each mix. With the stored snr and ref_db, the mix
+    is the soundscape as rendered by the in-process backends. The mixture reverb
+    of the sox backend is not applied.
+
+    Params
+    -------
+    stems: see render_stems and with_background
+    snr, ref_db: see event_gains
+    fix_clipping, peak_normalization: default to the stored settings
+    return_events: if True, also return the events scaled as in the mix
+
+    Returns
+    -------
+    soundscape_audio: (n_samples, n_channels), or (n_mixes, n_samples,
+        n_channels) for several SNRs per event
+    event_audio_list: list of (n_samples, n_channels) events, or of
+        (n_mixes, n_samples, n_channels), if return_events
+    """
+    fix_clipping = stems["fix_clipping"] if fix_clipping is None else fix_clipping
+    if peak_normalization is None:
+        peak_normalization = stems["peak_normalization"]
+    events = stems["events"]
+    gains = event_gains(stems, snr, ref_db).astype(events.dtype)
+
+    flat_events = events.reshape(len(events), -1)
+    mixtures = np.atleast_2d(gains) @ flat_events
+    peaks = np.max(np.abs(mixtures), axis=1)
+    scale = np.ones_like(peaks)
+    normalise = (peaks > 1) & fix_clipping | peak_normalization
+    scale[normalise] = 1.0 / (peaks[normalise] + 1e-10)
+    mixtures *= scale[:, None]
+    mixtures = mixtures.reshape((-1,) + events.shape[1:])
+    if gains.ndim == 1:
+        mixtures = mixtures[0]
+    if not return_events:
+        return mixtures
+
+    gains = gains * scale.reshape(gains.shape[:-1] + (1,)).astype(gains.dtype)
+    event_audio_list = [
+        np.multiply.outer(gains[..., i], event_audio)
+        for i, event_audio in enumerate(events)
+    ]
+    return mixtures, event_audio_list
+
+
+def save_split_stems(
+    paths,
+    sr=None,
+    fg_path=None,
+    backend="sox",
+    dtype=WORK_DTYPE,
+    stems_dir_id="stems",
+    overwrite=False,
+):
+    # Render and save the stems of each jams file in paths, see stems_path
+    n_saved = 0
+    for jams_path in paths:
+        path = stems_path(jams_path, stems_dir_id)
+        if os.path.isfile(path) and not overwrite:
+            continue
+        stems = render_stems(jams_path, sr, fg_path, backend=backend, dtype=dtype)
+        save_stems(path, stems)
+        n_saved += 1
+    return n_saved
+
+
+def remix_split(
+    paths,
+    snr_range,
+    ref_db=None,
+    background=None,
+    seed=0,
+    stems_dir_id="stems",
+    out_dir_id="remix",
+    subtype="PCM_16",
+):
+    """
+    Write a remix of each soundscape of paths from its stems
+
+    Params
+    -------
+    paths: jams files whose stems were saved with save_split_stems
+    snr_range: (min, max) of the uniform SNR of each foreground event, or None
+        to keep the SNRs of the JAMS files
+    ref_db: reference loudness, defaults to that of the JAMS files
+    background: wav file replacing the background of every soundscape, "none"
+        to remove backgrounds, or None to keep them
+    seed: seed of the SNRs, the SNRs of a file depend on seed and its name only
+    out_dir_id: the wav of each jams file is saved to its path with jams
+        replaced by out_dir_id, "audio" for generate_ost to cut OST from them
+    """
+    import soundfile as sf
+
+    background_audio = None
+    if background not in [None, "none"]:
+        background_audio, background_sr = sf.read(background, always_2d=True)
+
+    for jams_path in paths:
+        stems = load_stems(stems_path(jams_path, stems_dir_id))
+        if background == "none":
+            stems = with_background(stems)
+        elif background_audio is not None:
+            stems = with_background(stems, background_audio, background_sr)
+        snr = None
+        if snr_range is not None:
+            name = os.path.splitext(os.path.basename(jams_path))[0]
+            rng = np.random.default_rng([seed, int(name) if name.isdigit() else 0])
+            snr = rng.uniform(*snr_range, size=(stems["role"] == "foreground").sum())
+        mixture = remix(stems, snr, ref_db, return_events=False)
+
+        wav_path = os.path.splitext(jams_path)[0].replace("jams", out_dir_id) + ".wav"
+        os.makedirs(os.path.dirname(wav_path), exist_ok=True)
+        sf.write(wav_path, mixture, stems["sr"], subtype=subtype)
+
+
+def add_arguments(parser):
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    save = subparsers.add_parser(
+        "save", help="render and save the un-gained event stems of jams files"
+    )
+    save.add_argument(
+        "-p", "--jamspath", type=str, required=True, help="directory of jams files"
+    )
+    save.add_argument(
+        "--sr",
+        type=int,
+        required=False,
+        help="rendering sample rate, defaults to the sr in the jams files",
+        default=None,
+    )
+    save.add_argument(
+        "--fgpath",
+        type=str,
+        required=False,
+        help="path to source files, defaults to the path in the jams files",
+        default=None,
+    )
+    save.add_argument(
+        "--backend",
+        type=str,
+        required=False,
+        choices=RENDER_BACKENDS,
+        help="pitch shift and time stretch backend, sox or in process",
+        default="sox",
+    )
+    save.add_argument(
+        "--dtype",
+        type=str,
+        required=False,
+        choices=DTYPES,
+        help="dtype of the stems",
+        default=WORK_DTYPE,
+    )
+    save.add_argument(
+        "--stemsid",
+        type=str,
+        required=False,
+        help="replaces jams in the path of the stem files",
+        default="stems",
+    )
+    save.add_argument(
+        "--overwrite", action="store_true", help="render existing stems again"
+    )
+
+    mix = subparsers.add_parser("remix", help="write soundscapes remixed from stems")
+    mix.add_argument(
+        "-p", "--jamspath", type=str, required=True, help="directory of jams files"
+    )
+    mix.add_argument(
+        "--snr",
+        type=float,
+        nargs=2,
+        required=False,
+        help="min and max of the uniform SNR of each event, defaults to the jams",
+        default=None,
+    )
+    mix.add_argument(
+        "--refdb",
+        type=float,
+        required=False,
+        help="reference loudness, defaults to the jams",
+        default=None,
+    )
+    mix.add_argument(
+        "--background",
+        type=str,
+        required=False,
+        help="wav file of a new background, or none to remove backgrounds",
+        default=None,
+    )
+    mix.add_argument("--seed", type=int, required=False, help="SNR seed", default=0)
+    mix.add_argument(
+        "--stemsid",
+        type=str,
+        required=False,
+        help="replaces jams in the path of the stem files",
+        default="stems",
+    )
+    mix.add_argument(
+        "--outid",
+        type=str,
+        required=False,
+        help="replaces jams in the path of the wav files, audio to cut OST from them",
+        default="remix",
+    )
+    mix.add_argument(
+        "--subtype",
+        type=str,
+        required=False,
+        choices=SUBTYPES,
+        help="sample format of the output wav files",
+        default="PCM_16",
+    )
+
+    return parser
+
+
+def parse_args():
+    return add_arguments(argparse.ArgumentParser()).parse_args()
+
+
+def main(args=None):
+    if args is None:
+        args = parse_args()
+
+    start_time = time.time()
+    paths = sorted(str(path) for path in Path(args.jamspath).rglob("*.jams"))
+    if args.command == "save":
+        n_saved = save_split_stems(
+            paths,
+            args.sr,
+            args.fgpath,
+            args.backend,
+            args.dtype,
+            args.stemsid,
+            args.overwrite,
+        )
+        print(f"Saved the stems of {n_saved} of {len(paths)} jams files")
+    else:
+        remix_split(
+            paths,
+            args.snr,
+            args.refdb,
+            args.background,
+            args.seed,
+            args.stemsid,
+            args.outid,
+            args.subtype,
+        )
+        print(f"Remixed {len(paths)} soundscapes")
+    print(f"Done in {round(time.time() - start_time, 1)} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,570 @@
+import argparse
+import json
+import multiprocessing
+import os
+import struct
+import sys
+import time
+from os.path import join, dirname, splitext
+from pathlib import Path
+import numpy as np
+import yaml
+
+from dataset.generate_ost import (
+    OST_WINDOW,
+    clip_windows,
+    get_ann_dir,
+    ost_window,
+    overlapping_events,
+    parse_window,
+    window_out_id,
+)
+from dataset.scheduler import KINDS, OPENNESS, SPLITS, VARIANTS
+
+# Consecutive full-scale samples of a channel counted as clipping. Peak
+# normalisation (Scaper's fix_clipping) leaves single full-scale samples
+CLIP_RUN = 3
+
+# WAVE format tags, the sub-format of WAVE_FORMAT_EXTENSIBLE is one of the others
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def read_wav_header(path):
+    """
+    Parse the fmt and data chunks of a RIFF WAVE file without reading the samples
+
+    Returns
+    -------
+    dict with format (WAVE_FORMAT_PCM or WAVE_FORMAT_IEEE_FLOAT), n_channels, sr,
+    bits, data_offset (bytes) and n_frames
+    """
+    header = {}
+    with open(path, "rb") as f:
+        riff, _, wave = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or wave != b"WAVE":
+            raise ValueError("not a RIFF WAVE file")
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                raise ValueError("no data chunk")
+            chunk_id, size = struct.unpack("<4sI", chunk)
+            if chunk_id == b"fmt ":
+                fmt = f.read(size)
+                tag, n_channels, sr, _, block_align, bits = struct.unpack(
+                    "<HHIIHH", fmt[:16]
+                )
+                if tag == WAVE_FORMAT_EXTENSIBLE:
+                    tag = struct.unpack("<H", fmt[24:26])[0]
+                header.update(
+                    format=tag,
+                    n_channels=n_channels,
+                    sr=sr,
+                    bits=bits,
+                    block_align=block_align,
+                )
+            elif chunk_id == b"data":
+                if "format" not in header:
+                    raise ValueError("data chunk before fmt chunk")
+                header["data_offset"] = f.tell()
+                header["n_frames"] = size // header["block_align"]
+                return header
+            else:
+                f.seek(size + size % 2, os.SEEK_CUR)
+
+
+def wav_samples(path, header=None):
+    """
+    Memory-map the samples of a PCM or float WAVE file
+
+    Returns
+    -------
+    (n_frames, n_channels) np.memmap of the stored sample type
+    """
+    if header is None:
+        header = read_wav_header(path)
+    dtypes = {
+        (WAVE_FORMAT_PCM, 16): "<i2",
+        (WAVE_FORMAT_PCM, 32): "<i4",
+        (WAVE_FORMAT_IEEE_FLOAT, 32): "<f4",
+        (WAVE_FORMAT_IEEE_FLOAT, 64): "<f8",
+    }
+    dtype = dtypes.get((header["format"], header["bits"]))
+    if dtype is None:
+        raise ValueError(f"unsupported format {header['format']}/{header['bits']}")
+    if header["n_frames"] == 0:
+        return np.zeros((0, header["n_channels"]), dtype=dtype)
+    return np.memmap(
+        path,
+        dtype=dtype,
+        mode="r",
+        offset=header["data_offset"],
+        shape=(header["n_frames"], header["n_channels"]),
+    )
+
+
+def count_clipped(full_scale, min_run=CLIP_RUN):
+    """
+    Number of samples in runs of at least min_run consecutive full-scale samples
+
+    Params
+    -------
+    full_scale: (n_frames, n_channels) boolean array
+    """
+    edges = np.diff(np.pad(full_scale.T.astype(np.int8), ((0, 0), (1, 1))), axis=1)
+    # runs of each channel in order, so starts and stops pair up
+    lengths = np.nonzero(edges == -1)[1] - np.nonzero(edges == 1)[1]
+    return int(lengths[lengths >= min_run].sum())
+
+
+def scan_wav(path, target_sr=16_000, duration=1.0):
+    """
+    Check one clip: it exists, is at target_sr, lasts duration and holds no NaN
+    or clipped samples (runs of CLIP_RUN samples at full scale for PCM, at or
+    above 1 for float)
+
+    Returns
+    -------
+    dict of path and the problems found, empty apart from path if none
+    """
+    result = {"path": path}
+    try:
+        header = read_wav_header(path)
+        if header["sr"] != target_sr:
+            result["sr"] = header["sr"]
+        if header["n_frames"] != int(round(target_sr * duration)):
+            result["n_frames"] = header["n_frames"]
+
+        samples = wav_samples(path, header)
+        if samples.dtype.kind == "f":
+            n_nan = int(np.isnan(samples).sum())
+            n_clipped = count_clipped(np.abs(samples) >= 1)
+        else:
+            info = np.iinfo(samples.dtype)
+            n_nan = 0
+            n_clipped = count_clipped((samples == info.max) | (samples == info.min))
+        if n_nan:
+            result["n_nan"] = n_nan
+        if n_clipped:
+            result["n_clipped"] = n_clipped
+    except FileNotFoundError:
+        result["missing"] = True
+    except (ValueError, struct.error) as e:
+        result["error"] = str(e)
+
+    return result
+
+
+def expected_clips(
+    paths, jamid, outid, gtid, events=None, windows=None, label_in_file_name=True
+):
+    """
+    Clips that create_tag and ground_truth_estimates write for a list of jams files
+
+    Params
+    -------
+    paths: jams files of a split
+    jamid, outid, gtid: names of the jams, OST and ground truth datasets
+    events: output of read_scaper_annotations for paths, read if None
+    windows: window configurations of create_tag, defaults to [OST_WINDOW]
+    label_in_file_name: as passed to ground_truth_estimates
+
+    Returns
+    -------
+    ost: dict of window -> dict of clip path -> list of labels, as in the
+        annotation file of the window
+    gt: dict of ground truth clip path -> label
+    """
+    from dataset.jams_reader import read_scaper_annotations
+
+    if events is None:
+        events = read_scaper_annotations(paths)
+    if windows is None:
+        windows = [OST_WINDOW]
+    offsets, labels = events["offsets"], events["label"]
+    end_time = events["time"] + events["duration"]
+
+    ost, gt = {tuple(window): {} for window in windows}, {}
+    for k, jams_path in enumerate(paths):
+        wav_base = splitext(jams_path)[0].replace("jams", "audio")
+        start_times = events["time"][offsets[k] : offsets[k + 1]].tolist()
+        end_times = end_time[offsets[k] : offsets[k + 1]].tolist()
+        file_labels = labels[offsets[k] : offsets[k + 1]]
+        duration = events["soundscape_duration"][k]
+        for window, clips in ost.items():
+            out_id = window_out_id(outid, window)
+            for n, (_, event_idx) in enumerate(
+                clip_windows(start_times, end_times, duration, window)
+            ):
+                clips[(wav_base + f"_{n + 1}.wav").replace(jamid, out_id)] = [
+                    file_labels[j] for j in event_idx
+                ]
+        for i in range(len(start_times)):
+            window_start = ost_window(start_times[i], end_times[i], duration)
+            others = overlapping_events(
+                window_start, window_start + 1, start_times, end_times, i
+            )
+            gt_base = wav_base.replace(jamid, gtid) + f"_{i + 1}"
+            for n, j in enumerate([i] + others):
+                name = file_labels[j] if label_in_file_name else n + 1
+                gt[gt_base + f"_{name}.wav"] = file_labels[j]
+
+    return ost, gt
+
+
+def check_annotations(ann_path, expected):
+    """
+    Compare an OST annotation file with the clips expected from the jams files
+
+    Returns
+    -------
+    dict of counts: rows, missing_rows (expected clips without a row),
+    extra_rows (rows of no expected clip) and label_mismatch
+    """
+    import pandas as pd
+
+    if not os.path.isfile(ann_path):
+        return {"rows": 0, "missing_file": True, "missing_rows": len(expected)}
+    df = pd.read_pickle(ann_path)
+    rows = dict(zip(df["file_name"], df["label"]))
+    return {
+        "rows": len(rows),
+        "missing_rows": len(set(expected) - set(rows)),
+        "extra_rows": len(set(rows) - set(expected)),
+        "label_mismatch": sum(
+            sorted(map(str, rows[path])) != sorted(map(str, labels))
+            for path, labels in expected.items()
+            if path in rows
+        ),
+    }
+
+
+def scan_files(paths, target_sr, n_jobs=1, chunksize=256, duration=1.0):
+    # scan_wav over paths with a process pool, returns the results with problems
+    args = [(path, target_sr, duration) for path in paths]
+    if n_jobs == 1:
+        results = [scan_wav(*a) for a in args]
+    else:
+        with multiprocessing.Pool(n_jobs) as pool:
+            results = pool.starmap(scan_wav, args, chunksize=chunksize)
+    return [result for result in results if len(result) > 1]
+
+
+def summarise(problems, n_expected, orphans):
+    # Counts of each kind of problem among the scanned files
+    summary = {"expected": n_expected, "orphans": len(orphans)}
+    for key in ["missing", "error", "sr", "n_frames", "n_nan", "n_clipped"]:
+        summary[key] = sum(key in problem for problem in problems)
+    return summary
+
+
+def check_leakage(source_files, labels, known_classes, fg_path=None, splits=None):
+    """
+    Check that no source file is used in two splits, and that train and val only
+    hold known classes
+
+    Params
+    -------
+    source_files, labels: dict of split -> list of the source files and labels of
+        its events
+    known_classes: class indices of train and val
+    fg_path: if given, also check that every source file belongs to its split in
+        get_source_path_splits, passed as splits (dict of split -> source paths)
+
+    Returns
+    -------
+    dict of shared sources per pair of splits, unknown labels per split and
+    sources outside their split
+    """
+    # sources are compared by label directory and file name, independent of fg_path
+    keys = {
+        split: {join(*Path(f).parts[-2:]) for f in files}
+        for split, files in source_files.items()
+    }
+    split_names = list(keys)
+    report = {"shared_sources": {}, "unknown_labels": {}, "outside_split": {}}
+    for a in range(len(split_names)):
+        for b in range(a + 1, len(split_names)):
+            shared = keys[split_names[a]] & keys[split_names[b]]
+            report["shared_sources"][f"{split_names[a]}/{split_names[b]}"] = sorted(
+                shared
+            )
+    known = {str(c) for c in known_classes}
+    for split in ["train", "val"]:
+        if split in labels:
+            report["unknown_labels"][split] = sorted(set(labels[split]) - known)
+    if fg_path is not None and splits is not None:
+        for split, files in keys.items():
+            allowed = {join(*Path(f).parts[-2:]) for f in splits[split]}
+            report["outside_split"][split] = sorted(files - allowed)
+
+    return report
+
+
+def verify(
+    osspath,
+    openness=OPENNESS,
+    variants=VARIANTS,
+    splits=SPLITS,
+    kinds=KINDS,
+    jamid="oss",
+    outid="ost",
+    gtid="ost-gt",
+    target_sr=16_000,
+    fg_path=None,
+    config=join(dirname(__file__), "oss.yml"),
+    n_jobs=1,
+    windows=None,
+    label_in_file_name=True,
+    sort_sources=False,
+):
+    """
+    Scan OST and ground truth clips and the OSS splits of an openness/variant tree
+
+    For every split, the clips expected from its jams files are scanned (header
+    and memory-mapped samples) for existence, sample rate, length, NaN and
+    clipping, wav files nobody expects are counted as orphans, and the OST
+    annotation file is cross-checked with the jams files. For every variant, the
+    sources of its splits are checked for leakage and train and val for unknown
+    classes. windows and label_in_file_name are those create_tag and
+    ground_truth_estimates were run with, sort_sources that of generate_oss.py.
+
+    Returns
+    -------
+    report: dict of "{openness}/{variant}" -> splits (per split, kind and OST
+    window counts and the first problems found) and leakage
+    """
+    from dataset.data_utils import list_source_paths
+    from dataset.generate_oss import get_split_sources, get_vocab_idx
+    from dataset.jams_reader import read_scaper_annotations
+
+    with open(config, "r") as f:
+        config = yaml.safe_load(f)
+    if windows is None:
+        windows = [OST_WINDOW]
+    windows = [tuple(window) for window in windows]
+    source_paths = None
+    if fg_path is not None:
+        source_paths = list_source_paths(fg_path, sort_sources)
+
+    report = {}
+    for o in openness:
+        for v in variants:
+            variant_report = {"splits": {}}
+            source_files, labels = {}, {}
+            for s in splits:
+                split_dir = join(osspath, o, v, s)
+                paths = sorted(str(path) for path in Path(split_dir).rglob("*.jams"))
+                if not paths:
+                    continue
+                events = read_scaper_annotations(
+                    paths, n_jobs=n_jobs, value_fields=("source_file",)
+                )
+                source_files[s] = list(events["source_file"])
+                labels[s] = list(events["label"])
+                ost, gt = expected_clips(
+                    paths, jamid, outid, gtid, events, windows, label_in_file_name
+                )
+                # (report key, output dataset, clip duration, expected clips)
+                outputs = []
+                if "ost" in kinds:
+                    outputs += [
+                        (
+                            window_out_id("ost", window),
+                            window_out_id(outid, window),
+                            window[0],
+                            ost[window],
+                        )
+                        for window in windows
+                    ]
+                if "gt" in kinds:
+                    outputs.append(("gt", gtid, 1.0, gt))
+
+                split_report = {"jams": len(paths), "events": len(labels[s])}
+                for key, out_id, duration, expected in outputs:
+                    audio_dir = split_dir.replace("jams", "audio").replace(
+                        jamid, out_id
+                    )
+                    found = {str(p) for p in Path(audio_dir).rglob("*.wav")}
+                    orphans = sorted(found - set(expected))
+                    problems = scan_files(
+                        sorted(expected), target_sr, n_jobs, duration=duration
+                    )
+                    split_report[key] = summarise(problems, len(expected), orphans)
+                    split_report[key]["examples"] = problems[:10] + [
+                        {"path": path, "orphan": True} for path in orphans[:10]
+                    ]
+                    if out_id != gtid:
+                        ann_path = join(
+                            get_ann_dir(split_dir, jamid, out_id), f"{o}_{v}_{s}.pkl"
+                        )
+                        split_report[key]["annotations"] = check_annotations(
+                            ann_path, expected
+                        )
+                variant_report["splits"][s] = split_report
+
+            variant_id = int(v.replace("variant", ""))
+            split_sources = get_split_sources(
+                source_paths or [], get_vocab_idx(), variant_id, o, config
+            )
+            variant_report["leakage"] = check_leakage(
+                source_files,
+                labels,
+                split_sources["train"][2],
+                fg_path,
+                {split: sources[0] for split, sources in split_sources.items()},
+            )
+            report[f"{o}/{v}"] = variant_report
+
+    return report
+
+
+def count_issues(report):
+    # Total number of problems in a report of verify
+    n_issues = 0
+    for variant_report in report.values():
+        for split_report in variant_report["splits"].values():
+            for output in split_report.values():
+                if not isinstance(output, dict):
+                    continue
+                n_issues += sum(
+                    count
+                    for key, count in output.items()
+                    if key not in ["expected", "examples", "annotations"]
+                )
+                annotations = output.get("annotations", {})
+                n_issues += sum(
+                    annotations.get(key, 0)
+                    for key in ["missing_rows", "extra_rows", "label_mismatch"]
+                )
+        for checks in variant_report["leakage"].values():
+            n_issues += sum(len(items) for items in checks.values())
+    return n_issues
+
+
+def print_report(report):
+    for name, variant_report in report.items():
+        print(f"{name}")
+        for split, split_report in variant_report["splits"].items():
+            print(
+                f"  {split}: {split_report['jams']} jams files, "
+                f"{split_report['events']} events"
+            )
+            for name, output in split_report.items():
+                if not isinstance(output, dict):
+                    continue
+                counts = ", ".join(
+                    f"{key} {count}"
+                    for key, count in output.items()
+                    if key not in ["examples", "annotations"]
+                )
+                print(f"    {name}: {counts}")
+                if "annotations" in output:
+                    counts = ", ".join(
+                        f"{key} {count}" for key, count in output["annotations"].items()
+                    )
+                    print(f"    {name} annotations: {counts}")
+        for check, items in variant_report["leakage"].items():
+            for key, values in items.items():
+                print(f"  {check} {key}: {len(values)}")
+    print(f"{count_issues(report)} issues found")
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        "-p",
+        "--osspath",
+        type=str,
+        required=True,
+        help="path to base directory with openness, dataset variants, and splits",
+    )
+    parser.add_argument("-o", "--openness", nargs="+", default=OPENNESS)
+    parser.add_argument("-v", "--variants", nargs="+", default=VARIANTS)
+    parser.add_argument("-s", "--splits", nargs="+", default=SPLITS)
+    parser.add_argument("--kinds", nargs="+", default=KINDS, choices=KINDS)
+    parser.add_argument("--jamid", type=str, default="oss", help="Name of jams dataset")
+    parser.add_argument("--outid", type=str, default="ost", help="Name of OST dataset")
+    parser.add_argument(
+        "--gtid", type=str, default="ost-gt", help="Name of ground truth dataset"
+    )
+    parser.add_argument(
+        "--sr", type=int, default=16_000, help="sample rate of output wav files"
+    )
+    parser.add_argument(
+        "--windows",
+        type=str,
+        nargs="+",
+        default=["1"],
+        help="clip windows OST was generated with, see generate_ost.py",
+    )
+    parser.add_argument(
+        "--nolabel",
+        dest="label_in_file_name",
+        action="store_false",
+        help="ground truth files are named by overlap index instead of label",
+    )
+    parser.add_argument(
+        "--fgpath",
+        type=str,
+        default=None,
+        help="path to foreground source files, to check sources against their split",
+    )
+    parser.add_argument(
+        "--sortsources",
+        action="store_true",
+        help="sources were split in sorted order, see generate_oss.py",
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default=join(dirname(__file__), "oss.yml"),
+        help="path to the OSS config file",
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=os.cpu_count(), help="number of processes"
+    )
+    parser.add_argument(
+        "--report", type=str, default=None, help="path to save the report as json"
+    )
+
+    return parser
+
+
+def parse_args():
+    return add_arguments(argparse.ArgumentParser()).parse_args()
+
+
+def main(args=None):
+    if args is None:
+        args = parse_args()
+
+    start_time = time.time()
+    report = verify(
+        args.osspath,
+        args.openness,
+        args.variants,
+        args.splits,
+        args.kinds,
+        args.jamid,
+        args.outid,
+        args.gtid,
+        args.sr,
+        args.fgpath,
+        args.config,
+        args.jobs,
+        [parse_window(spec) for spec in args.windows],
+        args.label_in_file_name,
+        args.sortsources,
+    )
+    print_report(report)
+    print(f"Verified in {round((time.time() - start_time) / 60.0, 2)} minutes")
+    if args.report is not None:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+    if count_issues(report):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from dataset.augmentation import BACKENDS
+
+SR_IN = 44100
+SR_OUT = 16000
+F0 = 440.0
+
+
+def make_tone(duration=2.0):
+    # A harmonic tone, mono, at SR_IN
+    t = np.arange(int(duration * SR_IN)) / SR_IN
+    audio = 0.5 * np.sin(2 * np.pi * F0 * t) + 0.2 * np.sin(2 * np.pi * 2 * F0 * t)
+    return audio[:, None]
+
+
+def peak_frequency(audio, sr):
+    spectrum = np.abs(np.fft.rfft(audio[:, 0] * np.hanning(len(audio))))
+    return np.argmax(spectrum) * sr / len(audio)
+
+
+@pytest.mark.parametrize("backend", list(BACKENDS))
+@pytest.mark.parametrize(
+    "pitch_shift, time_stretch",
+    [(None, None), (3.0, None), (-4.0, None), (None, 1.3), (None, 0.8), (2.0, 1.2)],
+)
+def test_transform_duration_and_pitch(backend, pitch_shift, time_stretch):
+    audio = make_tone()
+
+    out = BACKENDS[backend](audio, SR_IN, SR_OUT, 2, pitch_shift, time_stretch)
+
+    n_expected = len(audio) * SR_OUT / SR_IN * (time_stretch or 1)
+    assert out.shape[1] == 2
+    assert abs(len(out) - n_expected) <= 1
+    f_expected = F0 * 2 ** ((pitch_shift or 0) / 12)
+    assert peak_frequency(out, SR_OUT) == pytest.approx(f_expected, rel=0.005)
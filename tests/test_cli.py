@@ -0,0 +1,23 @@
+import subprocess
+import sys
+
+from dataset.cli import check_import_time
+
+
+def test_cli_start_up_is_fast_and_light():
+    start_time, heavy, failures = check_import_time(budget=0.5, n_runs=3)
+
+    assert heavy == []
+    assert failures == [], failures
+    assert start_time < 0.5
+
+
+def test_importcheck_exits_with_status_1_over_budget():
+    result = subprocess.run(
+        [sys.executable, "-m", "dataset", "importcheck", "--budget", "0", "-n", "1"],
+        capture_output=True,
+        text=True,
+    )
+
+    assert result.returncode == 1
+    assert "CLI start-up took" in result.stderr
@@ -0,0 +1,93 @@
+import os
+
+import pytest
+
+from dataset.data_utils import STAGING_MODES, create_new_paths, stage_file
+
+
+def make_sources(root, n_per_label=2):
+    # Source files in label subdirectories, as Scaper reads them
+    paths = []
+    for label in ["0", "1"]:
+        os.makedirs(root / label)
+        for k in range(n_per_label):
+            path = root / label / f"{label}_{k}.wav"
+            path.write_bytes(os.urandom(64))
+            paths.append(str(path))
+    return paths
+
+
+def assert_staged(src, dst, mode):
+    with open(src, "rb") as f_src, open(dst, "rb") as f_dst:
+        assert f_src.read() == f_dst.read()
+    if mode == "symlink":
+        assert os.readlink(dst) == os.path.abspath(src)
+    else:
+        assert not os.path.islink(dst)
+    assert os.path.samefile(src, dst) == (mode in ["hardlink", "symlink"])
+
+
+@pytest.mark.parametrize("mode", STAGING_MODES)
+def test_create_new_paths_modes(tmp_path, mode):
+    paths = make_sources(tmp_path / "src")
+    staged = tmp_path / "staged"
+
+    modes = create_new_paths(paths, str(staged), mode)
+
+    # reflinks fall back to copies on filesystems without them
+    used = {"reflink", "copy"} if mode == "reflink" else {mode}
+    assert set(modes) <= used and sum(modes.values()) == len(paths)
+    for path in paths:
+        dst = staged / os.path.basename(os.path.dirname(path)) / os.path.basename(path)
+        assert_staged(path, dst, mode)
+
+
+@pytest.mark.parametrize("mode", STAGING_MODES)
+def test_incremental_rerun_skips_staged_files(tmp_path, mode):
+    paths = make_sources(tmp_path / "src")
+    staged = str(tmp_path / "staged")
+    create_new_paths(paths, staged, mode)
+
+    assert create_new_paths(paths, staged, mode, incremental=True) == {
+        "skipped": len(paths)
+    }
+    # without incremental, every file is staged again
+    assert "skipped" not in create_new_paths(paths, staged, mode)
+
+
+def test_incremental_copy_restages_changed_source(tmp_path):
+    src = make_sources(tmp_path / "src", n_per_label=1)[0]
+    dst = str(tmp_path / "dst.wav")
+    stage_file(src, dst, "copy")
+    with open(src, "ab") as f:
+        f.write(b"more")
+
+    assert stage_file(src, dst, "copy", incremental=True) == "copy"
+    assert_staged(src, dst, "copy")
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_copy_over_symlink_copies(tmp_path, incremental):
+    src = make_sources(tmp_path / "src", n_per_label=1)[0]
+    dst = str(tmp_path / "dst.wav")
+    stage_file(src, dst, "symlink")
+
+    assert stage_file(src, dst, "copy", incremental) == "copy"
+    assert_staged(src, dst, "copy")
+
+
+def test_incremental_hardlink_replaces_copy(tmp_path):
+    src = make_sources(tmp_path / "src", n_per_label=1)[0]
+    dst = str(tmp_path / "dst.wav")
+    stage_file(src, dst, "copy")
+
+    assert stage_file(src, dst, "hardlink", incremental=True) == "hardlink"
+    assert_staged(src, dst, "hardlink")
+
+
+def test_stage_onto_itself_raises(tmp_path):
+    src = make_sources(tmp_path / "src", n_per_label=1)[0]
+
+    with pytest.raises(ValueError):
+        stage_file(src, src, "copy")
+    assert os.path.isfile(src)
@@ -0,0 +1,39 @@
+import librosa
+import numpy as np
+import pytest
+import soundfile as sf
+
+from dataset.generate_ost import read_windows
+
+TARGET_SR = 16000
+
+
+def write_wav(path, sr, duration=10.0, seed=0):
+    # Noise with a few full-scale bursts, saved as PCM_16
+    rng = np.random.RandomState(seed)
+    audio = 0.2 * rng.randn(int(duration * sr))
+    audio[sr : sr + 100] = 1.0
+    sf.write(path, np.clip(audio, -1, 1), sr, subtype="PCM_16")
+
+
+@pytest.mark.parametrize("orig_sr", [48000, 44100])
+def test_read_windows_matches_librosa_load(tmp_path, orig_sr):
+    path = str(tmp_path / "soundscape.wav")
+    write_wav(path, orig_sr)
+    # edges, overlapping windows and a window running past the end
+    windows = [
+        (int(t * TARGET_SR), int(length * TARGET_SR))
+        for t, length in [(0, 1), (0.3, 1), (0.9, 2), (4.4375, 1), (9, 1), (9.5, 1)]
+    ]
+
+    audio, _ = librosa.load(path, sr=TARGET_SR)
+    clips = read_windows(path, TARGET_SR, windows)
+
+    for clip, (start, length) in zip(clips, windows):
+        expected = audio[start : start + length]
+        assert clip.dtype == expected.dtype == np.float32
+        if orig_sr == 48000:
+            # integer ratio, the samples line up exactly
+            np.testing.assert_array_equal(clip, expected)
+        else:
+            np.testing.assert_allclose(clip, expected, atol=1e-6)
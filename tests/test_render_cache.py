@@ -0,0 +1,80 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from dataset import render_cache
+from dataset.render_cache import STALE_TMP_SECONDS, _load_cached, evict, save_render
+
+
+def make_render(n_samples=1000, n_events=2, seed=0):
+    rng = np.random.RandomState(seed)
+    events = []
+    for k in range(n_events):
+        event_audio = np.zeros((n_samples, 1))
+        event_audio[100 * k : 100 * k + 300] = rng.randn(300, 1)
+        events.append(event_audio)
+    return sum(events), events
+
+
+def test_load_cached_round_trip(tmp_path):
+    path = str(tmp_path / "render.npz")
+    mixture, events = make_render()
+    save_render(path, mixture, events)
+
+    loaded_mixture, loaded_events = _load_cached(path)
+
+    assert np.array_equal(loaded_mixture, mixture)
+    for loaded, event_audio in zip(loaded_events, events):
+        assert np.array_equal(loaded, event_audio)
+
+
+@pytest.mark.parametrize("n_bytes", [0, 10, -10])
+def test_load_cached_removes_corrupt_render(tmp_path, n_bytes):
+    path = str(tmp_path / "render.npz")
+    save_render(path, *make_render())
+    with open(path, "rb") as f:
+        data = f.read()
+    # empty, truncated, or with its zip directory cut off
+    with open(path, "wb") as f:
+        f.write(data[:n_bytes] if n_bytes >= 0 else data[:n_bytes] + b"\0" * 10)
+
+    assert _load_cached(path) is None
+    assert not os.path.exists(path)
+
+
+def test_load_cached_miss(tmp_path):
+    assert _load_cached(str(tmp_path / "missing.npz")) is None
+
+
+def test_evict_deletes_stale_tmp_files(tmp_path):
+    cache_dir = str(tmp_path)
+    render_path = os.path.join(cache_dir, "render.npz")
+    save_render(render_path, *make_render())
+    stale, fresh = render_path + ".1.tmp", render_path + ".2.tmp"
+    for path in [stale, fresh]:
+        with open(path, "wb") as f:
+            f.write(b"\0" * 100)
+    old = time.time() - 2 * STALE_TMP_SECONDS
+    os.utime(stale, (old, old))
+
+    assert evict(cache_dir, max_bytes=2**30) == 1
+
+    assert not os.path.exists(stale)
+    assert os.path.exists(fresh) and os.path.exists(render_path)
+    size, _ = render_cache._cache_sizes[cache_dir]
+    assert size == os.path.getsize(render_path) + 100
+
+
+def test_evict_deletes_least_recently_used(tmp_path):
+    cache_dir = str(tmp_path)
+    paths = [os.path.join(cache_dir, f"{k}.npz") for k in range(3)]
+    for k, path in enumerate(paths):
+        save_render(path, *make_render(seed=k))
+        os.utime(path, (k, k))
+    n_bytes = os.path.getsize(paths[0])
+
+    assert evict(cache_dir, max_bytes=2 * n_bytes) == 1
+
+    assert [os.path.exists(path) for path in paths] == [False, True, True]
@@ -0,0 +1,389 @@
+import numpy as np
+import pytest
+from scipy.stats import chisquare, hypergeom
+
+from dataset.soundscape_generation import (
+    SEED,
+    oss_tiny_soundscape,
+    oss_tiny_val_or_test_soundscape,
+)
+
+KK_LABELS = list(range(15))
+UU_LABELS = list(range(54, 89))
+N_SOUNDSCAPES = 2_000_000
+N_SEQUENTIAL = 5_000
+CHUNK = 100_000
+ALPHA = 1e-3
+
+
+class TreeRNG:
+    # Stand-in for np.random.RandomState that follows a script of outcome indices
+    # through the choices of a sampler, and records the probability of the path.
+    # Draws of several labels without replacement are not branched over, they are
+    # recorded and drawn by sample_leaves
+    def __init__(self, script):
+        self.script, self.n_outcomes, self.prob, self.subsets = script, [], 1.0, []
+
+    def choice(self, a, size=None, replace=True, p=None):
+        a = np.asarray(a)
+        if size is not None and size > 1:
+            assert not replace
+            self.subsets.append((a.tolist(), size))
+            return a[:size]
+        k = len(self.n_outcomes)
+        index = self.script[k] if k < len(self.script) else 0
+        self.n_outcomes.append(len(a))
+        self.prob *= 1.0 / len(a) if p is None else p[index]
+        return a[index] if size is None else a[index : index + 1]
+
+
+def enumerate_leaves(sampler):
+    # Every path of sampler(rng) -> (labels, info), run on TreeRNG, as
+    # (probability, fixed labels, pool, size, info): the labels of the path are
+    # the fixed labels followed by size labels drawn without replacement from pool
+    leaves, script = [], []
+    while True:
+        rng = TreeRNG(script)
+        labels, info = sampler(rng)
+        labels = list(labels)
+        assert len(rng.subsets) <= 1
+        pool, size = rng.subsets[0] if rng.subsets else ([], 0)
+        assert labels[len(labels) - size :] == pool[:size]
+        leaves.append((rng.prob, labels[: len(labels) - size], pool, size, info))
+
+        script = [
+            script[k] if k < len(script) else 0 for k in range(len(rng.n_outcomes))
+        ]
+        branching = [k for k, n in enumerate(rng.n_outcomes) if script[k] < n - 1]
+        if not branching:
+            break
+        script = script[: branching[-1]] + [script[branching[-1]] + 1]
+
+    assert abs(sum(leaf[0] for leaf in leaves) - 1) < 1e-9
+    return leaves
+
+
+def sample_leaves(leaves, n_soundscapes, label_index, seed=SEED):
+    # Label sets drawn at the probabilities of the leaves, vectorised: (n, 4)
+    # label indices padded with -1, and the leaf of each row
+    rng = np.random.default_rng(seed)
+    probs = np.array([leaf[0] for leaf in leaves])
+    leaf_idx = rng.choice(len(leaves), size=n_soundscapes, p=probs / probs.sum())
+    order = np.argsort(leaf_idx, kind="stable")
+    groups = np.split(order, np.cumsum(np.bincount(leaf_idx, minlength=len(leaves))))
+    labels = np.full((n_soundscapes, 4), -1, dtype=np.int64)
+    for (_, fixed, pool, size, _), rows in zip(leaves, groups):
+        labels[rows, : len(fixed)] = [label_index[l] for l in fixed]
+        if not size or not len(rows):
+            continue
+        pool = np.array([label_index[l] for l in pool])
+        for chunk in np.array_split(rows, -(-len(rows) // CHUNK)):
+            keys = rng.random((len(chunk), len(pool)))
+            drawn = np.argpartition(keys, size - 1, axis=1)[:, :size]
+            labels[chunk, len(fixed) : len(fixed) + size] = pool[drawn]
+    return labels, leaf_idx
+
+
+def make_combos(labels, n_combos=20, seed=SEED):
+    # Disjoint seen and unseen class combinations of polyphony 2 to 4, in the
+    # format of oss_tiny_val_or_test_soundscape
+    rng = np.random.default_rng(seed)
+    seen_combos, unseen_combos = {}, {}
+    for n_events in [2, 3, 4]:
+        combos = set()
+        while len(combos) < 2 * n_combos:
+            combo = rng.choice(labels, size=n_events, replace=False).tolist()
+            combos.add(tuple(sorted(combo)))
+        combos = sorted(combos)
+        rng.shuffle(combos)
+        seen_combos[f"p{n_events}"] = combos[:n_combos]
+        unseen_combos[f"p{n_events}"] = combos[n_combos:]
+    return seen_combos, unseen_combos
+
+
+def encode(label_sets, label_index):
+    # (n, 4) array of label indices, padded with -1
+    encoded = np.full((len(label_sets), 4), -1, dtype=np.int64)
+    for row, sc_labels in enumerate(label_sets):
+        encoded[row, : len(sc_labels)] = [label_index[l] for l in sc_labels]
+    return encoded
+
+
+def combo_keys(labels, n_labels):
+    # One integer per row of labels, independent of the label order
+    padded = np.sort(np.where(labels < 0, n_labels, labels), axis=1)
+    return padded @ (n_labels + 1) ** np.arange(4)
+
+
+def p_value(observed, expected):
+    # Chi-square goodness of fit, bins with zero expected count must be empty
+    observed = np.asarray(observed, dtype=float)
+    expected = np.asarray(expected, dtype=float)
+    assert not np.any(observed[expected == 0]), "label drawn with zero probability"
+    keep = expected > 0
+    if keep.sum() < 2:
+        return 1.0
+    expected = expected[keep] * observed[keep].sum() / expected[keep].sum()
+    return float(chisquare(observed[keep], expected).pvalue)
+
+
+def val_or_test_sampler(uu_labels, seen_combos, unseen_combos):
+    # oss_tiny_val_or_test_soundscape as a sampler of (labels, (is_uu, is_seen))
+    def sampler(rng):
+        sc_labels, sc_type, kk_combo = oss_tiny_val_or_test_soundscape(
+            sc=None,
+            paths=None,
+            kk_labels=KK_LABELS,
+            uu_labels=uu_labels,
+            seen_kk_combos=seen_combos,
+            unseen_kk_combos=unseen_combos,
+            debug=True,
+            rng=rng,
+        )
+        return sc_labels, (sc_type == "uu", kk_combo == "seen")
+
+    return sampler
+
+
+def draw_labels(n_soundscapes, uu_labels, seen_combos, unseen_combos):
+    # Label sets drawn at the probabilities of oss_tiny_val_or_test_soundscape
+    label_index = {l: k for k, l in enumerate(KK_LABELS + (uu_labels or []))}
+    leaves = enumerate_leaves(
+        val_or_test_sampler(uu_labels, seen_combos, unseen_combos)
+    )
+    labels, leaf_idx = sample_leaves(leaves, n_soundscapes, label_index)
+    info = np.array([leaf[4] for leaf in leaves])[leaf_idx]
+    return labels, info[:, 0], info[:, 1]
+
+
+def draw_labels_sequential(n_soundscapes, uu_labels, seen_combos, unseen_combos, rng):
+    # Label sets drawn one at a time by oss_tiny_val_or_test_soundscape with rng
+    label_index = {l: k for k, l in enumerate(KK_LABELS + (uu_labels or []))}
+    sampler = val_or_test_sampler(uu_labels, seen_combos, unseen_combos)
+    label_sets, info = zip(*[sampler(rng) for _ in range(n_soundscapes)])
+    info = np.array(info)
+    return encode(label_sets, label_index), info[:, 0], info[:, 1]
+
+
+@pytest.mark.parametrize("split", ["val", "test"])
+def test_val_or_test_label_distributions(split):
+    uu_labels = UU_LABELS if split == "test" else None
+    seen_combos, unseen_combos = make_combos(KK_LABELS)
+    labels, is_uu, is_seen = draw_labels(
+        N_SOUNDSCAPES, uu_labels, seen_combos, unseen_combos
+    )
+    n_kk, n_uu = len(KK_LABELS), len(uu_labels or [])
+    n_labels = n_kk + n_uu
+    label_index = {l: k for k, l in enumerate(KK_LABELS + (uu_labels or []))}
+    n_events = (labels >= 0).sum(axis=1)
+    is_kk = ~is_uu
+    p_values = {}
+
+    # membership
+    assert np.all((n_events >= 1) & (n_events <= 4))
+    assert np.all(labels[is_kk] < n_kk), "kk soundscape with a uu class"
+    padded = np.where(labels < 0, n_labels + np.arange(4), labels)
+    assert np.all(np.diff(np.sort(padded, axis=1), axis=1) > 0), "repeated label"
+    if n_uu:
+        assert np.all(labels[is_uu, 0] >= n_kk), "uu soundscape without a uu class"
+        p_values["kk_uu_ratio"] = p_value([is_kk.sum(), is_uu.sum()], [1, 1])
+    else:
+        assert not is_uu.any()
+    p_values["seen_unseen_ratio"] = p_value(
+        [(is_kk & is_seen).sum(), (is_kk & ~is_seen).sum()], [1, 1]
+    )
+
+    # polyphony: uniform for kk (without 1 for unseen), p(n) = k x 1/n for uu
+    for name, mask, expected in [
+        ("seen", is_kk & is_seen, [0, 1, 1, 1, 1]),
+        ("unseen", is_kk & ~is_seen, [0, 0, 1, 1, 1]),
+        ("uu", is_uu, [0] + [1.0 / i for i in range(1, 5)]),
+    ]:
+        if mask.any():
+            p_values[f"polyphony_{name}"] = p_value(
+                np.bincount(n_events[mask], minlength=5), expected
+            )
+
+    # kk class frequency and combo choice
+    single = is_kk & is_seen & (n_events == 1)
+    p_values["class_seen_p1"] = p_value(
+        np.bincount(labels[single, 0], minlength=n_kk), np.ones(n_kk)
+    )
+    for name, mask, combos in [
+        ("seen", is_kk & is_seen, seen_combos),
+        ("unseen", is_kk & ~is_seen, unseen_combos),
+    ]:
+        for p in [2, 3, 4]:
+            rows = mask & (n_events == p)
+            table = combo_keys(encode(combos[f"p{p}"], label_index), n_labels)
+            keys = combo_keys(labels[rows], n_labels)
+            assert np.all(np.isin(keys, table)), f"{name} p{p} combo not in list"
+            table, multiplicity = np.unique(table, return_counts=True)
+            p_values[f"combo_{name}_p{p}"] = p_value(
+                np.bincount(np.searchsorted(table, keys), minlength=len(table)),
+                multiplicity,
+            )
+
+    # uu class frequency and uu events per uu soundscape
+    if n_uu:
+        first, others = labels[is_uu, 0], labels[is_uu, 1:]
+        p_values["class_uu_first"] = p_value(
+            np.bincount(first - n_kk, minlength=n_uu), np.ones(n_uu)
+        )
+        # each remaining label is one of the n - 1 drawn from the other labels
+        weight = (n_events[is_uu] - 1) / (n_labels - 1)
+        expected = weight.sum() - np.bincount(first, weights=weight, minlength=n_labels)
+        p_values["class_uu_others"] = p_value(
+            np.bincount(others[others >= 0], minlength=n_labels), expected
+        )
+
+        n_uu_events = (labels[is_uu] >= n_kk).sum(axis=1)
+        expected = np.zeros(5)
+        for p in [1, 2, 3, 4]:
+            count = (n_events[is_uu] == p).sum()
+            expected[1:] += count * hypergeom.pmf(
+                np.arange(4), n_labels - 1, n_uu - 1, p - 1
+            )
+        p_values["uu_events_per_uu_soundscape"] = p_value(
+            np.bincount(n_uu_events, minlength=5), expected
+        )
+
+    failed = {k: v for k, v in p_values.items() if v < ALPHA}
+    assert not failed, f"distribution tests failed: {failed}"
+
+
+@pytest.mark.parametrize("split", ["val", "test"])
+def test_val_or_test_sequential_draws_follow_the_tree(split):
+    # RandomState draws match the probabilities enumerated with TreeRNG
+    uu_labels = UU_LABELS if split == "test" else None
+    seen_combos, unseen_combos = make_combos(KK_LABELS)
+    labels, is_uu, is_seen = draw_labels_sequential(
+        N_SEQUENTIAL, uu_labels, seen_combos, unseen_combos, np.random.RandomState(0)
+    )
+    leaves = enumerate_leaves(
+        val_or_test_sampler(uu_labels, seen_combos, unseen_combos)
+    )
+
+    # joint distribution of soundscape type, seen combo and polyphony
+    expected = np.zeros((2, 2, 5))
+    for prob, fixed, _, size, (uu, seen) in leaves:
+        expected[int(uu), int(seen), len(fixed) + size] += prob
+    observed = np.zeros((2, 2, 5))
+    n_events = (labels >= 0).sum(axis=1)
+    np.add.at(observed, (is_uu.astype(int), is_seen.astype(int), n_events), 1)
+    assert p_value(observed.ravel(), expected.ravel()) > ALPHA
+
+
+def test_val_or_test_rng_leaves_global_state():
+    seen_combos, unseen_combos = make_combos(KK_LABELS)
+    np.random.seed(SEED)
+    state = np.random.get_state()[1].copy()
+
+    draws = [
+        draw_labels_sequential(
+            100, UU_LABELS, seen_combos, unseen_combos, np.random.RandomState(1)
+        )
+        for _ in range(2)
+    ]
+
+    assert np.array_equal(np.random.get_state()[1], state)
+    for a, b in zip(*draws):
+        assert np.array_equal(a, b)
+
+
+class RecordingScaper:
+    # Records the event specs oss_tiny_soundscape adds, in place of a Scaper
+    def __init__(self):
+        self.events, self.backgrounds = ["stale"], ["stale"]
+
+    def reset_fg_event_spec(self):
+        self.events = []
+
+    def reset_bg_event_spec(self):
+        self.backgrounds = []
+
+    def add_event(self, **kwargs):
+        self.events.append(kwargs)
+
+    def add_background(self, **kwargs):
+        self.backgrounds.append(kwargs)
+
+
+def make_paths(labels, n_per_label=3):
+    return [f"/src/{l}/{l}_{k}.wav" for l in labels for k in range(n_per_label)]
+
+
+@pytest.mark.parametrize("add_bg", [False, True])
+@pytest.mark.parametrize("combos", [False, True])
+def test_oss_tiny_soundscape_events(add_bg, combos):
+    paths = make_paths(KK_LABELS)
+    allowed_combos = make_combos(KK_LABELS)[0] if combos else None
+    rng = np.random.RandomState(0)
+
+    for _ in range(50):
+        sc, sc_labels = oss_tiny_soundscape(
+            RecordingScaper(), paths, KK_LABELS, allowed_combos, add_bg=add_bg, rng=rng
+        )
+
+        assert 1 <= len(sc_labels) <= 4 and len(set(sc_labels)) == len(sc_labels)
+        assert [e["label"] for e in sc.events] == [("const", str(l)) for l in sc_labels]
+        for event, label in zip(sc.events, sc_labels):
+            # Scaper chooses one of the source files of the label
+            assert event["source_file"] == (
+                "choose",
+                [path for path in paths if path.split("/")[-2] == str(label)],
+            )
+            assert event["snr"] == ("uniform", -5, 20)
+            assert event["pitch_shift"] == ("uniform", -2.0, 2.0)
+            assert event["time_stretch"] == ("uniform", 0.8, 1.2)
+        assert len(sc.backgrounds) == int(add_bg)
+
+
+@pytest.mark.parametrize("combos", [False, True])
+def test_oss_tiny_soundscape_label_distributions(combos):
+    allowed_combos = make_combos(KK_LABELS)[0] if combos else None
+    paths = make_paths(KK_LABELS, n_per_label=1)
+    n_labels = len(KK_LABELS)
+    label_index = {l: k for k, l in enumerate(KK_LABELS)}
+
+    def sampler(rng):
+        _, sc_labels = oss_tiny_soundscape(
+            RecordingScaper(), paths, KK_LABELS, allowed_combos, rng=rng
+        )
+        return sc_labels, None
+
+    labels, _ = sample_leaves(enumerate_leaves(sampler), N_SOUNDSCAPES, label_index)
+    n_events = (labels >= 0).sum(axis=1)
+    p_values = {}
+
+    # membership and polyphony, p(n) = k x 1/n
+    padded = np.where(labels < 0, n_labels + np.arange(4), labels)
+    assert np.all(np.diff(np.sort(padded, axis=1), axis=1) > 0), "repeated label"
+    p_values["polyphony"] = p_value(
+        np.bincount(n_events, minlength=5), [0] + [1.0 / i for i in range(1, 5)]
+    )
+
+    if allowed_combos is None:
+        # every class equally likely at every polyphony
+        for p in [1, 2, 3, 4]:
+            p_values[f"class_p{p}"] = p_value(
+                np.bincount(labels[n_events == p, :p].ravel(), minlength=n_labels),
+                np.ones(n_labels),
+            )
+    else:
+        p_values["class_p1"] = p_value(
+            np.bincount(labels[n_events == 1, 0], minlength=n_labels),
+            np.ones(n_labels),
+        )
+        for p in [2, 3, 4]:
+            table = combo_keys(encode(allowed_combos[f"p{p}"], label_index), n_labels)
+            keys = combo_keys(labels[n_events == p], n_labels)
+            assert np.all(np.isin(keys, table)), f"p{p} combo not in list"
+            table, multiplicity = np.unique(table, return_counts=True)
+            p_values[f"combo_p{p}"] = p_value(
+                np.bincount(np.searchsorted(table, keys), minlength=len(table)),
+                multiplicity,
+            )
+
+    failed = {k: v for k, v in p_values.items() if v < ALPHA}
+    assert not failed, f"distribution tests failed: {failed}"
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from scaper.audio import get_integrated_lufs
+
+from dataset.stems import remix, with_background
+
+SR = 44100
+
+
+def make_stems(ref_db=-20.0, n_channels=1, seed=0):
+    # One foreground tone at 0 dB SNR and one noise background, 10 s at SR
+    rng = np.random.RandomState(seed)
+    n_samples = 10 * SR
+    t = np.arange(n_samples) / SR
+    tone = 0.1 * np.sin(2 * np.pi * 440 * t)
+    tone[: 2 * SR] = tone[6 * SR :] = 0
+    noise = 0.05 * rng.randn(n_samples)
+    events = np.stack([tone, noise])[:, :, None].repeat(n_channels, axis=2)
+    return dict(
+        events=events.astype(np.float32),
+        role=np.array(["foreground", "background"]),
+        label=np.array(["tone", "noise"]),
+        snr=np.array([6.0, np.nan]),
+        sr=SR,
+        ref_db=ref_db,
+        fix_clipping=False,
+        peak_normalization=False,
+    )
+
+
+@pytest.mark.parametrize("background_sr", [8000, 16000, SR])
+@pytest.mark.parametrize("n_channels", [1, 2])
+def test_with_background_loudness(background_sr, n_channels):
+    ref_db = -20.0
+    stems = make_stems(ref_db, n_channels)
+    rng = np.random.RandomState(1)
+    # 3 s of noise, tiled to the soundscape length
+    background = 0.3 * rng.randn(3 * background_sr)
+
+    new = with_background(stems, background, background_sr, label="new")
+
+    assert list(new["role"]) == ["foreground", "background"]
+    assert new["label"][-1] == "new"
+    assert new["events"].shape == stems["events"].shape
+    _, event_audio_list = remix(new)
+    lufs = get_integrated_lufs(event_audio_list[-1].astype(np.float64), SR)
+    assert abs(lufs - ref_db) < 0.1
+
+
+def test_with_background_requires_sr():
+    with pytest.raises(ValueError):
+        with_background(make_stems(), np.zeros(SR))
+
+
+def test_with_background_removes_backgrounds():
+    new = with_background(make_stems())
+    assert list(new["role"]) == ["foreground"]
+    assert len(new["events"]) == 1